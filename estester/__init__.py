@@ -1,14 +1,34 @@
+import copy
+import gzip
+import hashlib
+import io
 import json
+import math
+import os
+import threading
 import time
 import unittest
 import urllib
 
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
+
 import requests
 
+from estester.cassette import Cassette
+from estester.memory import get_cluster
+from estester.profile import Profile
+from estester.timings import recorder, timed
+
 
 __author__ = "Tatiana Al-Chueyr Pereira Martins"
 __license__ = "GNU GPL v2"
 
+try:
+    string_types = basestring
+except NameError:  # Python 3 (estester.aio)
+    string_types = str
+
 
 class ElasticSearchException(Exception):
     """
@@ -17,14 +37,366 @@ class ElasticSearchException(Exception):
     pass
 
 
+def _bulk_results(response):
+    """
+    Parse a _bulk <response> (parsed JSON) and return a tuple containing:
+        - the number of documents which were created (not updated)
+        - a list of (type, id, error) tuples, one for each failed item
+    """
+    created = 0
+    failures = []
+    for item in response.get("items", []):
+        for result in item.values():
+            if "error" in result:
+                failures.append(
+                    (result.get("_type"), result.get("_id"), result["error"]))
+            # Elasticsearch 0.90 did not return the status of each item
+            elif result.get("status", 201) == 201:
+                created += 1
+    return created, failures
+
+
+_golden_lock = threading.Lock()
+
+# guards the _bulk payloads cached per test case class (read _bulk_payloads),
+# which are filled by the threads setting up indexes in parallel
+_payload_cache_lock = threading.Lock()
+
+# result of the cluster health check of each host: None if the cluster was
+# ready, or else the error message
+_cluster_health = {}
+_cluster_health_lock = threading.Lock()
+
+CLUSTER_STATUSES = ["red", "yellow", "green"]
+
+# index settings applied by fast_ingest, on top of the test case's settings
+FAST_INGEST_SETTINGS = {
+    "index.number_of_shards": 1,
+    "index.number_of_replicas": 0,
+    "index.refresh_interval": "-1",
+    "index.translog.durability": "async"
+}
+
+
+def _json_response(response):
+    """
+    Return the JSON of <response>, raising ElasticSearchException if its
+    status is not 200 or 201.
+    """
+    if not response.status_code in [200, 201]:
+        raise ElasticSearchException(response.text)
+    return json.loads(response.text)
+
+
+def _check_index_created(response):
+    """
+    Raise ElasticSearchException if <response> (of a call creating an index)
+    is an error other than the index already existing.
+    """
+    if not response.status_code in [200, 201] and \
+            not _index_exists(response):
+        raise ElasticSearchException(response.text)
+
+
+class _BulkLoad(object):
+    """
+    Results of the _bulk requests sent by bulk_index to <index>, which
+    collects the documents which failed to be indexed.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.created = 0
+        self.total = 0
+        self.failures = []
+
+    def add(self, response, count):
+        "Add the <response> of a _bulk request of <count> documents."
+        created, failures = _bulk_results(_json_response(response))
+        self.created += created
+        self.failures.extend(failures)
+        self.total += count
+
+    def result(self):
+        """
+        Return the number of documents created, raising a single
+        ElasticSearchException listing every failed document, if any.
+        """
+        if self.failures:
+            lines = ["{0}/{1}: {2}".format(*failure)
+                     for failure in self.failures]
+            message = "Failed to load {0} of {1} fixture(s) into {2}:\n{3}"
+            raise ElasticSearchException(message.format(
+                len(self.failures), self.total, self.index,
+                "\n".join(lines)))
+        return self.created
+
+
+class _CountWait(object):
+    """
+    Polling of the _count of <index> by wait_for_count, until <count>
+    documents are searchable or <timeout> seconds passed.
+    """
+
+    def __init__(self, url, index, count, timeout):
+        self.url = url
+        self.index = index
+        self.count = count
+        self.timeout = timeout
+        if timeout is not None:
+            self.deadline = time.time() + timeout
+        self.delay = 0.01
+
+    def check(self, response):
+        """
+        Return the number of searchable documents of the _count <response>
+        if it reached count, or else None. Raises ElasticSearchException if
+        the next poll would be after the timeout.
+        """
+        found = _json_response(response)["count"]
+        if found >= self.count:
+            return found
+        if self.timeout is not None and \
+                time.time() + self.delay > self.deadline:
+            message = "Index {0} was not ready after {1}s: " \
+                "{2} of {3} documents are searchable"
+            raise ElasticSearchException(message.format(
+                self.index, self.timeout, found, self.count))
+        return None
+
+    def next_delay(self):
+        "Return the time to sleep before the next poll."
+        delay = self.delay
+        self.delay = min(self.delay * 2, 0.5)
+        return delay
+
+
+def _index_exists(response):
+    """
+    Tell if <response> is the error ElasticSearch returns when creating an
+    index which already exists (kept when reset_index is False).
+    """
+    error = response.text.replace("_", "").lower()
+    return response.status_code == 400 and "alreadyexists" in error
+
+
+def _flat_settings(settings, prefix=""):
+    """
+    Return <settings> (dict with nested or dotted keys) as a dict with dotted
+    keys, all starting with "index.".
+    """
+    flat = {}
+    for key, value in settings.items():
+        key = prefix + key
+        if isinstance(value, dict):
+            flat.update(_flat_settings(value, key + "."))
+        else:
+            if not key.startswith("index."):
+                key = "index." + key
+            flat[key] = value
+    return flat
+
+
+# iterators of fixtures which were loaded (read _fixture_items), kept so
+# their ids are not reused
+_loaded_iterators = {}
+_loaded_iterators_lock = threading.Lock()
+
+
+def _fixture_items(fixtures):
+    """
+    Return the items of <fixtures>: what it returns if it is a function
+    (which returns a new iterator at each call), or else <fixtures>.
+
+    Raises ElasticSearchException if <fixtures> is an iterator which was
+    already loaded, as loading it again would silently load no document.
+    """
+    if callable(fixtures):
+        return fixtures()
+    if isinstance(fixtures, string_types) or iter(fixtures) is not fixtures:
+        return fixtures
+    with _loaded_iterators_lock:
+        if id(fixtures) in _loaded_iterators:
+            message = "Fixtures {0!r} is an iterator which was already " \
+                "loaded: use setup_scope = \"class\", or a function " \
+                "returning a new iterator"
+            raise ElasticSearchException(message.format(fixtures))
+        _loaded_iterators[id(fixtures)] = fixtures
+    return fixtures
+
+
+def _fingerprint(mappings, settings, fixtures, aliases=()):
+    """
+    Return a SHA-1 hex digest identifying the given index definition.
+
+    <fixtures> must be a list (or another iterable which can be read many
+    times, such as estester.synthetic.SyntheticFixtures), a function
+    returning a new iterator or the path of a NDJSON file, as iterators can
+    only be read once.
+    """
+    if callable(fixtures):
+        # the function returns a new iterator, read only here
+        fixtures = fixtures()
+    elif not isinstance(fixtures, string_types) and \
+            iter(fixtures) is fixtures:
+        raise ElasticSearchException(
+            "reuse_index requires fixtures to be a list or a NDJSON file")
+    digest = hashlib.sha1()
+    definition = [mappings, settings, sorted(aliases)]
+    digest.update(json.dumps(definition, sort_keys=True))
+    if isinstance(fixtures, string_types):
+        with _open_ndjson(fixtures) as ndjson:
+            for block in iter(lambda: ndjson.read(1024 * 1024), b""):
+                digest.update(block)
+    else:
+        for doc in fixtures:
+            digest.update(json.dumps(doc, sort_keys=True))
+    return digest.hexdigest()
+
+
+def _open_ndjson(path):
+    """
+    Open the NDJSON file at <path> in binary mode, decompressing it if its
+    name ends with ".gz".
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return io.open(path, "rb")
+
+
+def _ndjson_entries(path, index):
+    """
+    Yield the _bulk entries (action and source lines) of the NDJSON file at
+    <path>, which must be in the format of ElasticSearch's _bulk request
+    body. Action lines are sent to <index>; source lines are kept as they
+    are in the file, without being parsed.
+    """
+    with _open_ndjson(path) as ndjson:
+        lines = (line for line in ndjson if line.strip())
+        for line in lines:
+            action = json.loads(line.decode("utf-8"))
+            action_type, meta = list(action.items())[0]
+            meta["_index"] = index
+            entry = [json.dumps(action).encode("utf-8"), b"\n"]
+            if action_type != "delete":
+                source = next(lines)
+                entry.append(source)
+                if not source.endswith(b"\n"):
+                    entry.append(b"\n")
+            yield b"".join(entry)
+
+
+class LRUCache(object):
+    """
+    Thread-safe dict-like cache which keeps at most <size> items, discarding
+    the least recently used ones.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+# Tokens returned by tokenize_many, shared by all test case classes
+tokens_cache = LRUCache(10000)
+
+
+def _split_tokens(texts, tokens):
+    """
+    Split the <tokens> returned by _analyze for the list <texts> into one
+    list per text, with offsets relative to the text and positions counted
+    from 0 at the first token of the text.
+    """
+    groups = [[] for text in texts]
+    tokens = iter(tokens)
+    token = next(tokens, None)
+    start = 0
+    for group, text in zip(groups, texts):
+        # offsets are counted in UTF-16 code units, with a gap of 1 between
+        # texts
+        end = start + len(text.encode("utf-16-le")) // 2 + 1
+        first_position = None
+        while token is not None and token["start_offset"] < end:
+            token = dict(token)
+            if first_position is None:
+                first_position = token["position"]
+            token["start_offset"] -= start
+            token["end_offset"] -= start
+            token["position"] -= first_position
+            group.append(token)
+            token = next(tokens, None)
+        start = end
+    return groups
+
+
+# Timing of a call to a search endpoint (read query_timings)
+QueryTiming = namedtuple("QueryTiming", ["url", "wall_ms", "took_ms", "size"])
+
+
+def _percentile(values, percentile):
+    "Return the <percentile> (0-100) of <values>, by the nearest rank."
+    values = sorted(values)
+    rank = int(math.ceil(percentile / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def worker_namespace():
+    """
+    Return the namespace of the current test process, used to prefix index
+    names when namespace_indexes is True. It is the value of the
+    ESTESTER_NAMESPACE environment variable, or the pytest-xdist worker
+    name, or else the process id.
+    """
+    namespace = os.environ.get("ESTESTER_NAMESPACE") or \
+        os.environ.get("PYTEST_XDIST_WORKER") or \
+        "p{0}".format(os.getpid())
+    return namespace.lower()
+
+
+def writes_index(method):
+    """
+    Decorator which marks a test method as one that changes the data loaded
+    by _pre_setup. When setup_scope is "class", the data is set up again
+    before the next test method runs.
+    """
+    method.writes_index = True
+    return method
+
+
 class ExtendedTestCase(unittest.TestCase):
     """
     Extends unittest.TestCase providing two new methods:
         pre_setup :: run before method setUp (unittest.TestCase)
         post_teardown :: run after method tearDown (unittest.TestCase)
+
+    If setup_scope is "class", pre_setup runs only once, before the first
+    test method of the class, and post_teardown runs after the last one.
+    Test methods decorated with writes_index make pre_setup run again before
+    the next test method, and make pre_write run before them.
     """
 
     maxDiff = None
+    setup_scope = "method"
 
     def __call__(self, *args, **kwds):
         """
@@ -32,22 +404,69 @@ class ExtendedTestCase(unittest.TestCase):
         set up. This means that user-defined Test Cases aren't required to
         include a call to super().setUp().
         """
+        class_scope = self.setup_scope == "class"
         try:
-            self._pre_setup()
+            with recorder.phase(self, "pre_setup"):
+                if class_scope:
+                    self._pre_setup_class_scope()
+                else:
+                    self._pre_setup()
+                if self._writes_index():
+                    self._pre_write()
         except (KeyboardInterrupt, SystemExit):
             raise
 
-        super(ExtendedTestCase, self).__call__(*args, **kwds)
+        with recorder.phase(self, "test"):
+            super(ExtendedTestCase, self).__call__(*args, **kwds)
 
         try:
-            self._post_teardown()
+            if class_scope:
+                if self._writes_index():
+                    type(self)._class_setup_dirty = True
+            else:
+                with recorder.phase(self, "post_teardown"):
+                    self._post_teardown()
         except (KeyboardInterrupt, SystemExit):
             raise
 
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Run post_teardown once for the whole class, if setup_scope is "class".
+        """
+        super(ExtendedTestCase, cls).tearDownClass()
+        test_case = cls.__dict__.get("_class_setup_test_case")
+        if test_case is not None:
+            del cls._class_setup_test_case
+            with recorder.phase(test_case, "post_teardown"):
+                test_case._post_teardown()
+
+    def _pre_setup_class_scope(self):
+        """
+        Run pre_setup if it did not run yet for this class or if the last
+        test method changed the data it set up.
+        """
+        cls = type(self)
+        if "_class_setup_test_case" in cls.__dict__ and \
+                not cls.__dict__.get("_class_setup_dirty"):
+            return
+        cls._class_setup_dirty = False
+        self._pre_setup()
+        cls._class_setup_test_case = self
+
+    def _writes_index(self):
+        "Tell if the current test method was decorated with writes_index."
+        method = getattr(self, self._testMethodName, None)
+        return getattr(method, "writes_index", False)
+
     def _pre_setup(self):
         "Hook method for setting up the test fixture before default setUp."
         pass
 
+    def _pre_write(self):
+        "Hook method run before test methods decorated with writes_index."
+        pass
+
     def _post_teardown(self):
         "Hook method for setting up the test fixture after default tearDown."
         pass
@@ -68,6 +487,213 @@ class ElasticSearchQueryTestCase(ExtendedTestCase):
     fixtures = []
     timeout = 5
     settings = {}
+    bulk_size = 500
+    bulk_max_bytes = 5 * 1024 * 1024
+    readiness = None
+    pool_size = 10
+    max_retries = 0
+    request_timeout = None
+    reuse_index = False
+    reset_strategy = "rebuild"
+    snapshot_repository = "estester"
+    snapshot_location = "estester"
+    namespace_indexes = False
+    backend = "http"
+    cassette = None
+    cassette_mode = None
+    fast_ingest = False
+    msearch_size = 100
+    mget_size = 500
+    scroll_keep_alive = "1m"
+    analyze_size = 100
+    cache_tokens = True
+    wait_for_status = "yellow"
+    cluster_timeout = 30
+    record_timings = True
+
+    def __call__(self, *args, **kwds):
+        """
+        Make sure the cluster is ready (read wait_for_cluster) before the
+        test runs.
+        """
+        self.wait_for_cluster()
+        return super(ElasticSearchQueryTestCase, self).__call__(*args, **kwds)
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete the golden indexes created for the class (unless reuse_index
+        is True), close the HTTP session shared by the tests of the class,
+        drop its cached _bulk payloads and save its cassette.
+
+        Raises ElasticSearchException if the cassette was verified and some
+        responses changed.
+        """
+        super(ElasticSearchQueryTestCase, cls).tearDownClass()
+        test_case = cls.__dict__.get("_golden_test_case")
+        if test_case is not None:
+            del cls._golden_test_case
+            golden_indexes = cls._golden_indexes
+            del cls._golden_indexes
+            if test_case.reset_index and not test_case.reuse_index:
+                for golden in golden_indexes:
+                    test_case.delete_index(golden)
+        session = cls.__dict__.get("_session")
+        if session is not None:
+            session.close()
+            del cls._session
+        with _payload_cache_lock:
+            if "_payload_cache" in cls.__dict__:
+                del cls._payload_cache
+        cassette = cls.__dict__.get("_cassette")
+        if cassette is not None:
+            del cls._cassette
+            cassette.save()
+            if cassette.drifts:
+                message = "{0} response(s) differ from cassette {1}:\n{2}"
+                raise ElasticSearchException(message.format(
+                    len(cassette.drifts), cassette.path,
+                    "\n".join(cassette.drifts)))
+
+    @property
+    def session(self):
+        """
+        Keep-alive requests.Session shared by all tests of the test case
+        class, through which every call to ElasticSearch is made.
+
+        Uses the following class attributes:
+            proxies: proxies used by every request (default: {})
+            pool_size: max number of connections kept open (default: 10)
+            max_retries: number of retries on connection errors (default: 0)
+        """
+        cls = type(self)
+        session = cls.__dict__.get("_session")
+        if session is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=self.pool_size,
+                max_retries=self.max_retries)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.proxies.update(self.proxies)
+            cls._session = session
+        return session
+
+    @property
+    def transport(self):
+        """
+        Object whose request method (with the signature of
+        requests.Session.request) answers the calls to ElasticSearch.
+
+        Uses the following class attributes:
+            backend: "http" to use the ElasticSearch node at host, "memory"
+                to use an in-memory ElasticSearch (estester.memory) shared
+                by the whole process, or any object with a request method
+                (default: "http")
+            cassette: path of the cassette (read estester.cassette) which
+                records or replays the calls sent to backend (default: None)
+            cassette_mode: "record", "replay" or "verify". If None, the
+                ESTESTER_CASSETTE_MODE environment variable is used or, if
+                it is not set, "replay" when the cassette file exists and
+                "record" otherwise (default: None)
+        """
+        if self.cassette:
+            return self._load_cassette()
+        return self._backend()
+
+    def _load_cassette(self):
+        "Return the cassette shared by all tests of the test case class."
+        cls = type(self)
+        cassette = cls.__dict__.get("_cassette")
+        if cassette is None:
+            mode = self.cassette_mode or \
+                os.environ.get("ESTESTER_CASSETTE_MODE")
+            if not mode:
+                exists = os.path.exists(self.cassette)
+                mode = "replay" if exists else "record"
+            backend = None if mode == "replay" else self._backend()
+            cassette = Cassette(self.cassette, mode, backend)
+            cls._cassette = cassette
+        return cassette
+
+    def _backend(self):
+        "Return the transport chosen by the backend class attribute."
+        if self.backend == "http":
+            return self.session
+        if self.backend == "memory":
+            return get_cluster(self.host)
+        if hasattr(self.backend, "request"):
+            return self.backend
+        raise ElasticSearchException(
+            "Unknown backend: {0}".format(self.backend))
+
+    @timed("wait_for_cluster")
+    def wait_for_cluster(self):
+        """
+        Wait until the health of the ElasticSearch cluster at host reaches
+        wait_for_status, polling its _cluster/health with an exponential
+        backoff. It is checked once per host by the whole process: later
+        calls return (or fail) at once.
+
+        Raises ElasticSearchException if it takes more than cluster_timeout
+        seconds.
+
+        Uses the following class attributes:
+            wait_for_status: "yellow" or "green", or None to skip the check,
+                which is also skipped for backends other than "http" and
+                when replaying a cassette (default: "yellow")
+            cluster_timeout: max time to wait, in seconds (default: 30)
+        """
+        if not self.wait_for_status or self.backend != "http" or \
+                self._replaying():
+            return
+        with _cluster_health_lock:
+            if self.host not in _cluster_health:
+                _cluster_health[self.host] = self._poll_cluster_health()
+            error = _cluster_health[self.host]
+        if error is not None:
+            raise ElasticSearchException(error)
+
+    def _poll_cluster_health(self):
+        """
+        Poll _cluster/health until it reaches wait_for_status, returning
+        None, or the error message if it does not within cluster_timeout.
+        """
+        url = "{0}_cluster/health".format(self.host)
+        expected = CLUSTER_STATUSES.index(self.wait_for_status)
+        deadline = time.time() + self.cluster_timeout
+        delay = 0.1
+        while True:
+            try:
+                # sent through the session, so cassettes do not record it
+                timeout = max(deadline - time.time(), delay)
+                response = self.session.request(
+                    "GET", url, timeout=self.request_timeout or timeout)
+                if response.status_code == 200:
+                    status = json.loads(response.text)["status"]
+                    if CLUSTER_STATUSES.index(status) >= expected:
+                        return None
+                    found = "status {0}".format(status)
+                else:
+                    found = response.text
+            except requests.RequestException as error:
+                found = str(error)
+            if time.time() + delay > deadline:
+                message = "Cluster at {0} was not {1} after {2}s: {3}"
+                return message.format(self.host, self.wait_for_status,
+                                      self.cluster_timeout, found)
+            time.sleep(delay)
+            delay = min(delay * 2, 2)
+
+    def _request(self, method, url, **kwargs):
+        """
+        Send a HTTP request through the test case transport, using
+        request_timeout (in seconds) unless another timeout is given.
+        """
+        kwargs.setdefault("timeout", self.request_timeout)
+        with recorder.request(self, method, url):
+            return self.transport.request(method.upper(), url, **kwargs)
 
     def _pre_setup(self):
         """
@@ -76,24 +702,163 @@ class ElasticSearchQueryTestCase(ExtendedTestCase):
 
         Uses the following class attributes:
             reset_index: delete index before loading data (default: True)
+            reuse_index: skip loading data if the index was already loaded
+                with the same mappings, settings and fixtures, even by a
+                previous test run (default: False)
+            reset_strategy: how the index is set up (read setup_index for
+                more information)
         """
-        if self.reset_index:
-            self.delete_index()
-        self.create_index()
-        self.load_fixtures()
+        self.setup_index(self.index, self.settings, self.mappings,
+                         self.fixtures)
+
+    def setup_index(self, index, settings, mappings, fixtures, aliases=()):
+        """
+        Set up <index> with <settings>, <mappings>, <fixtures> and <aliases>,
+        according to reset_strategy:
+            "rebuild": delete, create and load the index (default)
+            "clone": load the fixtures once per class into a read-only
+                "golden" index (<index>.golden), which is copied to <index>
+                using ElasticSearch's _clone API (requires ElasticSearch 7.4
+                or later)
+            "snapshot": load the fixtures once per class into a golden index,
+                whose snapshot (stored in a filesystem repository called
+                snapshot_repository, at snapshot_location) is restored as
+                <index> (requires snapshot_location to be allowed by the
+                path.repo ElasticSearch setting)
+
+        With "clone" and "snapshot", the time needed to reset the index does
+        not depend on the number of fixtures.
+        """
+        created, aliases = self._prepare_index(
+            index, settings, mappings, fixtures, aliases)
+        if aliases:
+            self.create_aliases(index, aliases)
+        if created is not None:
+            self.wait_for_fixtures(index, created)
+
+    def _prepare_index(self, index, settings, mappings, fixtures, aliases):
+        """
+        Set up <index> as setup_index does, but neither create its aliases
+        nor wait for its fixtures to be searchable.
+
+        Returns a tuple containing the number of documents created (None if
+        there is nothing to wait for) and the list of aliases to create.
+        """
+        if self.reset_strategy == "rebuild":
+            return self._build_index(
+                index, settings, mappings, fixtures, aliases)
+        elif self.reset_strategy in ["clone", "snapshot"]:
+            golden = self._golden_index(index)
+            self._build_golden_index(golden, settings, mappings, fixtures)
+            self.delete_index(index)
+            self.copy_index(golden, index)
+            return None, list(aliases)
+        else:
+            message = "Unknown reset strategy: {0}".format(
+                self.reset_strategy)
+            raise ElasticSearchException(message)
+
+    def _build_index(self, index, settings, mappings, fixtures, aliases=()):
+        """
+        Delete, create and load <index>, unless reuse_index is True and
+        the index was already loaded with the same data.
+
+        Returns the same as _prepare_index.
+        """
+        aliases = list(aliases)
+        if self.reuse_index:
+            fingerprint = _fingerprint(mappings or self.mappings,
+                                       self._create_settings(settings),
+                                       fixtures,
+                                       aliases)
+            if self.has_fingerprint(index, fingerprint):
+                return None, []
+        if self.reset_index or self.reuse_index:
+            self.delete_index(index)
+        self.create_index(index, settings, mappings)
+        created = self.load_fixtures(index, fixtures, wait=False)
+        if self.reuse_index:
+            aliases.append(self._fingerprint_alias(index, fingerprint))
+        return created, aliases
+
+    @timed("build_golden_index")
+    def _build_golden_index(self, golden, settings, mappings, fixtures):
+        """
+        Build the read-only <golden> index, once per test case class.
+        """
+        cls = type(self)
+        with _golden_lock:
+            if "_golden_test_case" not in cls.__dict__:
+                cls._golden_test_case = self
+                cls._golden_indexes = set()
+        if golden in cls._golden_indexes:
+            return
+        created, aliases = self._build_index(
+            golden, settings, mappings, fixtures)
+        if aliases:
+            self.create_aliases(golden, aliases)
+        self.refresh_index(golden)
+        self.flush_index(golden)
+        if self.reset_strategy == "clone":
+            self.update_settings(golden, {"index.blocks.write": True})
+        else:
+            self.create_snapshot(golden)
+        cls._golden_indexes.add(golden)
+
+    def _golden_index(self, index):
+        return "{0}.golden".format(index)
+
+    def _pre_write(self):
+        """
+        Make sure an index about to be changed is not reused, if reuse_index
+        is True.
+        """
+        if self.reuse_index and self.reset_strategy == "rebuild":
+            self.remove_fingerprint(self.index)
 
     def _post_teardown(self):
         """
-        Clear up ElasticSearch index, if reset_index is True.
+        Clear up ElasticSearch index, if reset_index is True and it is not
+        reused (read setup_index for more information).
 
         Uses the following class attributes:
             index: name of the index (default: sample.test)
             host: ElasticSearch host (default: http://localhost:9200/)
             reset_index: delete index after running tests (default: True)
         """
-        if self.reset_index:
+        if not self._keeps_index():
             self.delete_index()
 
+    def _keeps_index(self):
+        "Tell if indexes must be kept after each test, to be reused."
+        if self.reuse_index and self.reset_strategy == "rebuild":
+            return True
+        return not self.reset_index
+
+    def has_fingerprint(self, index, fingerprint):
+        """
+        Tell if <index> was loaded with data identified by <fingerprint>.
+
+        Fingerprints are stored as aliases of the index, which are only
+        created after all fixtures were loaded.
+        """
+        alias = self._fingerprint_alias(index, fingerprint)
+        return alias in self.get_aliases(index)
+
+    def remove_fingerprint(self, index):
+        """
+        Remove any fingerprint of <index>, so it is not reused.
+        """
+        prefix = self._fingerprint_alias(index, "")
+        aliases = [alias for alias in self.get_aliases(index)
+                   if alias.startswith(prefix)]
+        if aliases:
+            self.remove_aliases(index, aliases)
+
+    def _fingerprint_alias(self, index, fingerprint):
+        return "{0}.fingerprint.{1}".format(index, fingerprint)
+
+    @timed("refresh_index")
     def refresh_index(self, index=None):
         """
         Calls ElasticSearch's _refresh method on <index>. If index is None,
@@ -102,14 +867,14 @@ class ElasticSearchQueryTestCase(ExtendedTestCase):
         This method makes all operations performed since the last refresh
         available for search.
         """
-        if index is None:
-            url = "{0}_refresh".format(self.host)
-        else:
-            url = "{0}{1}/_refresh".format(self.host, index)
-        response = requests.post(url, proxies=self.proxies)
-        if response.status_code not in [200, 201]:
-            raise ElasticSearchException(response.text)
-        return json.loads(response.text)
+        return _json_response(self._request("post", self._refresh_url(index)))
+
+    def _refresh_url(self, index=None):
+        "Return the url of the _refresh of <index> (read refresh_index)."
+        if index is None and not self.namespace_indexes:
+            return "{0}_refresh".format(self.host)
+        index = self.namespaced("*" if index is None else index)
+        return "{0}{1}/_refresh".format(self.host, index)
 
     def refresh(self):
         """
@@ -120,7 +885,8 @@ class ElasticSearchQueryTestCase(ExtendedTestCase):
         """
         return self.refresh_index(self.index)
 
-    def create_index(self):
+    @timed("create_index")
+    def create_index(self, index_name="", settings="", mappings=""):
         """
         Use the following class attributes:
             index: name of the index (default: sample.test)
@@ -130,26 +896,79 @@ class ElasticSearchQueryTestCase(ExtendedTestCase):
 
         To create an empty index in ElasticSearch.
 
+        Raises ElasticSearchException if ElasticSearch fails to create it,
+        unless it already exists.
+
         (i) http://www.elasticsearch.org/guide/en/elasticsearch/guide/current/
         configuring-analyzers.html
         """
+        url, json_data = self._create_index_request(index_name, settings,
+                                                    mappings)
+        _check_index_created(self._request("put", url, data=json_data))
+
+    def _create_index_request(self, index_name="", settings="", mappings=""):
+        "Return the url and body of the call made by create_index."
         url = "{0}{1}/"
-        url = url.format(self.host, self.index)
+        index = self.namespaced(index_name or self.index)
+        url = url.format(self.host, index)
         data = {}
-        if self.mappings:
-            data["mappings"] = self.mappings
-        if self.settings:
-            data["settings"] = self.settings
-        json_data = json.dumps(data)
-        response = requests.put(url, proxies=self.proxies, data=json_data)
+        mappings = mappings or self.mappings
+        if mappings:
+            data["mappings"] = mappings
+        settings = self._create_settings(settings)
+        if settings:
+            data["settings"] = settings
+        return url, json.dumps(data)
 
-    def load_fixtures(self):
+    def _create_settings(self, settings=""):
+        """
+        Return the settings an index is created with: <settings> (or the
+        settings class attribute) and, if fast_ingest is True, the settings
+        which speed up loading fixtures into a single test node
+        (FAST_INGEST_SETTINGS). Those are 1 shard, 0 replicas and an async
+        translog, unless <settings> say otherwise, and refresh disabled
+        until load_fixtures restores the refresh_interval of <settings>.
+        """
+        settings = settings or self.settings
+        if not self.fast_ingest:
+            return settings
+        settings = _flat_settings(settings)
+        for key, value in FAST_INGEST_SETTINGS.items():
+            if key == "index.refresh_interval" or key not in settings:
+                settings[key] = value
+        return settings
+
+    def _index_settings(self, index):
+        "Return the settings <index> was declared with by the test case."
+        return self.settings
+
+    @timed("load_fixtures")
+    def load_fixtures(self, index_name="", fixtures="", wait=True):
         """
         Use the following class attributes:
             index: name of the index (default: sample.test)
             host: ElasticSearch host (default: http://localhost:9200/)
             fixtures: list of items to be loaded (default: [])
             timeout: time in seconds to wait index load (default: 5s)
+            bulk_size: max number of documents per _bulk request
+            bulk_max_bytes: max size in bytes of each _bulk request
+            readiness: how to wait for fixtures to be searchable (read
+                wait_for_fixtures for more information)
+            fast_ingest: if True, indexes are created with refresh disabled
+                (read _create_settings), and load_fixtures restores the
+                refresh_interval of the index settings (default: 1s) after
+                loading the fixtures (default: False)
+
+        Besides a list, fixtures may be any iterator of items (which can
+        only be loaded once, so it suits setup_scope = "class" or the clone
+        and snapshot reset strategies; loading it again raises
+        ElasticSearchException), a function returning a new iterator of
+        items at each call, or the path of a NDJSON file in the format of
+        ElasticSearch's _bulk body, optionally compressed with gzip
+        (".gz"). Documents are streamed to ElasticSearch in chunks and
+        the source lines of NDJSON files are sent as they are; the _index of
+        their action lines is replaced by the index being loaded.
+        estester.synthetic generates large fixtures the same way.
 
         Example of fixtures:
         [
@@ -170,68 +989,762 @@ class ElasticSearchQueryTestCase(ExtendedTestCase):
             type: type of the document
             id: unique identifier
             body: json with fields of values of document
+
+        Unless <wait> is False, waits for the fixtures to be searchable
+        (read wait_for_fixtures for more information).
+
+        Returns the number of documents created.
         """
-        for doc in self.fixtures:
-            doc_type = urllib.quote_plus(doc["type"])
-            doc_id = urllib.quote_plus(doc["id"])
-            doc_body = doc["body"]
-            url = "{0}{1}/{2}/{3}"
-            url = url.format(self.host, self.index, doc_type, doc_id)
-            response = requests.put(
-                url,
-                data=json.dumps(doc_body),
-                proxies=self.proxies)
-            if not response.status_code in [200, 201]:
-                raise ElasticSearchException(response.text)
-        if self.timeout is None:
-            self.refresh()
-        else:
+        index = index_name or self.index
+        fixtures = fixtures or self.fixtures
+        created = self.bulk_index(index, fixtures)
+        if self.fast_ingest:
+            self.update_settings(index, self._restored_settings(index))
+        if self.readiness == "wait_for":
+            self.refresh_index(index)
+        if wait:
+            self.wait_for_fixtures(index, created)
+        return created
+
+    def _restored_settings(self, index):
+        """
+        Return the settings restored by load_fixtures after a fast_ingest:
+        the refresh_interval <index> was declared with (default: 1s).
+        """
+        settings = _flat_settings(self._index_settings(index))
+        return {
+            "index.refresh_interval": settings.get("index.refresh_interval",
+                                                   "1s")
+        }
+
+    @timed("wait_for_fixtures")
+    def wait_for_fixtures(self, index, count):
+        """
+        Wait until the <count> documents loaded to <index> can be searched.
+
+        Uses the following class attributes:
+            readiness: one of
+                None: if timeout is None, refresh the index, otherwise sleep
+                    for timeout seconds (default)
+                "refresh": call _refresh on the index
+                "wait_for": load_fixtures refreshes the index once all
+                    _bulk requests were sent, so there is nothing left to
+                    wait for
+                "count": poll the index's _count until it reaches <count>
+            timeout: when readiness is set, the maximum time in seconds to
+                wait for the index (None means no limit)
+        """
+        step = self._readiness_step()
+        if step == "refresh":
+            self.refresh_index(index)
+        elif step == "sleep":
             time.sleep(self.timeout)
-        # http://0.0.0.0:9200/sample.test/_search
+        elif step == "count":
+            self.wait_for_count(index, count)
+
+    def _readiness_step(self):
+        """
+        Return how wait_for_fixtures waits according to readiness:
+        "refresh", "sleep" (for timeout seconds), "count" or None (nothing
+        to wait for). Raises ElasticSearchException on unknown modes.
+        """
+        if self.readiness is None:
+            if self.timeout is None:
+                return "refresh"
+            elif not self._replaying():
+                return "sleep"
+            return None
+        elif self.readiness in ["refresh", "count"]:
+            return self.readiness
+        elif self.readiness != "wait_for":
+            message = "Unknown readiness mode: {0}".format(self.readiness)
+            raise ElasticSearchException(message)
+        return None
+
+    def _replaying(self):
+        "Tell if calls are answered by a cassette, so there is no wait."
+        return bool(self.cassette) and self._load_cassette().mode == "replay"
+
+    def wait_for_count(self, index, count):
+        """
+        Poll <index>'s _count until at least <count> documents are searchable.
+
+        Raises ElasticSearchException if it takes more than timeout seconds.
+        """
+        wait = self._count_wait(index, count)
+        while True:
+            found = wait.check(self._request("get", wait.url))
+            if found is not None:
+                return found
+            time.sleep(wait.next_delay())
 
-    def delete_index(self):
+    def _count_wait(self, index, count):
+        "Return the _CountWait polled by wait_for_count."
+        url = "{0}{1}/_count".format(self.host, self.namespaced(index))
+        return _CountWait(url, index, count, self.timeout)
+
+    def bulk_index(self, index, fixtures):
+        """
+        Index <fixtures> into <index> using ElasticSearch's _bulk endpoint.
+
+        Documents are sent as NDJSON in chunks of at most bulk_size documents
+        and bulk_max_bytes bytes. Every document which fails to be indexed is
+        collected, and a single ElasticSearchException listing all of them is
+        raised after all chunks were sent. Chunks are sent without the
+        refresh parameter (refresh=wait_for would block each of them until
+        the next scheduled refresh), so documents become searchable after
+        the index is refreshed (read wait_for_fixtures).
+
+        Returns the number of documents created.
+        """
+        url = "{0}_bulk".format(self.host)
+        load = _BulkLoad(index)
+        for payload, count in self._bulk_payloads(index, fixtures):
+            load.add(self._request("post", url, data=payload), count)
+        return load.result()
+
+    def _bulk_payloads(self, index, fixtures):
+        """
+        Return an iterator of (payload, number_of_documents) tuples, where
+        payload is a NDJSON _bulk request body respecting bulk_size and
+        bulk_max_bytes.
+
+        Payloads of fixture lists are built once per test case class and
+        reused by its test methods, until the list is replaced (or changes
+        its length) or the class finishes. Iterators and NDJSON files are
+        read as the payloads are sent, so they are loaded with constant
+        memory (read _fixture_items).
+        """
+        fixtures = _fixture_items(fixtures)
+        if not isinstance(fixtures, (list, tuple)):
+            return self._serialize_payloads(index, fixtures)
+        cls = type(self)
+        key = (self.namespaced(index), self.bulk_size, self.bulk_max_bytes)
+        with _payload_cache_lock:
+            if "_payload_cache" not in cls.__dict__:
+                cls._payload_cache = {}
+            cache = cls._payload_cache
+            cached = cache.get(key)
+        if cached is None or cached[0] is not fixtures or \
+                cached[1] != len(fixtures):
+            payloads = list(self._serialize_payloads(index, fixtures))
+            cached = (fixtures, len(fixtures), payloads)
+            with _payload_cache_lock:
+                cache[key] = cached
+        return iter(cached[2])
+
+    def _serialize_payloads(self, index, fixtures):
+        "Yield the _bulk payloads of <fixtures> (read _bulk_payloads)."
+        lines = []
+        size = 0
+        for entry in self._bulk_entries(self.namespaced(index), fixtures):
+            if lines and (len(lines) >= self.bulk_size or
+                          size + len(entry) > self.bulk_max_bytes):
+                yield entry[:0].join(lines), len(lines)
+                lines = []
+                size = 0
+            lines.append(entry)
+            size += len(entry)
+        if lines:
+            yield lines[0][:0].join(lines), len(lines)
+
+    def _bulk_entries(self, index, fixtures):
+        """
+        Yield the _bulk entry (action and source lines) of each fixture, which
+        may be listed by any iterable or by the path of a NDJSON file.
+        """
+        if isinstance(fixtures, string_types):
+            for entry in _ndjson_entries(fixtures, index):
+                yield entry
+            return
+        for doc in fixtures:
+            action = {
+                "index": {
+                    "_index": index,
+                    "_type": doc["type"],
+                    "_id": doc["id"]
+                }
+            }
+            yield "{0}\n{1}\n".format(json.dumps(action),
+                                       json.dumps(doc["body"]))
+
+    @timed("delete_index")
+    def delete_index(self, index_name=""):
         """
         Deletes test index. Uses class attribute:
             index: name of the index to be deleted
         """
-        url = "{0}{1}/".format(self.host, self.index)
-        requests.delete(url, proxies=self.proxies)
+        index = self.namespaced(index_name or self.index)
+        url = "{0}{1}/".format(self.host, index)
+        self._request("delete", url)
+
+    @timed("flush_index")
+    def flush_index(self, index):
+        """
+        Calls ElasticSearch's _flush method on <index>, so all its documents
+        are committed to disk.
+        """
+        url = "{0}{1}/_flush".format(self.host, self.namespaced(index))
+        response = self._request("post", url)
+        if not response.status_code in [200, 201]:
+            raise ElasticSearchException(response.text)
+        return json.loads(response.text)
+
+    @timed("update_settings")
+    def update_settings(self, index, settings):
+        """
+        Update the dynamic <settings> (dict) of <index>.
+        """
+        url = "{0}{1}/_settings".format(self.host, self.namespaced(index))
+        return _json_response(
+            self._request("put", url, data=json.dumps(settings)))
+
+    @timed("copy_index")
+    def copy_index(self, source, target):
+        """
+        Copy the golden index <source> to the index <target>, which must not
+        exist, according to reset_strategy ("clone" or "snapshot").
+        """
+        source = self.namespaced(source)
+        target = self.namespaced(target)
+        if self.reset_strategy == "clone":
+            url = "{0}{1}/_clone/{2}".format(self.host, source, target)
+            payload = {"settings": {"index.blocks.write": None}}
+            params = {}
+        else:
+            url = "{0}_snapshot/{1}/{2}/_restore".format(
+                self.host, self.snapshot_repository, source)
+            payload = {
+                "indices": source,
+                "include_global_state": False,
+                "include_aliases": False,
+                "rename_pattern": ".+",
+                "rename_replacement": target
+            }
+            params = {"wait_for_completion": "true"}
+        response = self._request("post", url, data=json.dumps(payload),
+                                 params=params)
+        if not response.status_code in [200, 201]:
+            raise ElasticSearchException(response.text)
+        return json.loads(response.text)
+
+    @timed("create_snapshot")
+    def create_snapshot(self, index):
+        """
+        Take a snapshot of <index>, named after it, in the filesystem
+        repository snapshot_repository, which is registered at
+        snapshot_location. A previous snapshot with the same name is
+        replaced.
+        """
+        url = "{0}_snapshot/{1}".format(self.host, self.snapshot_repository)
+        repository = {
+            "type": "fs",
+            "settings": {"location": self.snapshot_location}
+        }
+        response = self._request("put", url, data=json.dumps(repository))
+        if not response.status_code in [200, 201]:
+            raise ElasticSearchException(response.text)
+        index = self.namespaced(index)
+        url = "{0}/{1}".format(url, index)
+        self._request("delete", url)
+        payload = {"indices": index, "include_global_state": False}
+        response = self._request("put", url, data=json.dumps(payload),
+                                 params={"wait_for_completion": "true"})
+        if not response.status_code in [200, 201]:
+            raise ElasticSearchException(response.text)
+        snapshot = json.loads(response.text)["snapshot"]
+        if snapshot["state"] != "SUCCESS":
+            raise ElasticSearchException(response.text)
+        return snapshot
 
     def search(self, query=None):
         """
         Run a search <query> (JSON) and returns the JSON response.
         """
-        url = "{0}{1}/_search".format(self.host, self.index)
+        url = "{0}{1}/_search".format(self.host, self.namespaced(self.index))
         query = {} if query is None else query
-        response = requests.post(
-            url,
-            data=json.dumps(query),
-            proxies=self.proxies)
-        return json.loads(response.text)
+        started = time.time()
+        response = self._request("post", url, data=json.dumps(query))
+        return self._strip_namespace(
+            self._timed_result(url, started, response))
+
+    @property
+    def query_timings(self):
+        """
+        List of the QueryTiming (url, wall_ms, took_ms, size) of each call
+        made by the current test to a search endpoint (search,
+        search_in_index, search_many, iter_hits and
+        assertQueryFasterThan), in the order they were made: wall_ms is
+        the time (in milliseconds) the client waited for the response,
+        took_ms the time ElasticSearch reported (None if it did not) and
+        size the length of the response body.
+
+        Nothing is recorded while record_timings is False, as done by
+        estester.replay and estester.benchmark, whose long runs would
+        otherwise keep a QueryTiming per search.
+        """
+        return self.__dict__.setdefault("_query_timings", [])
+
+    def _timed_result(self, url, started, response):
+        """
+        Add the timing of the call to the search endpoint <url> started at
+        <started> (time.time()) to query_timings, returning the JSON of its
+        <response>.
+        """
+        wall_ms = (time.time() - started) * 1000
+        result = json.loads(response.text)
+        took_ms = result.get("took") if isinstance(result, dict) else None
+        if self.record_timings:
+            self.query_timings.append(
+                QueryTiming(url, wall_ms, took_ms, len(response.text)))
+        return result
+
+    def assertQueryFasterThan(self, query, ms, runs=10, percentile=95,
+                              warmup=2, timing="wall_ms"):
+        """
+        Run the search <query> (JSON) <warmup> times, then <runs> times,
+        failing if the <percentile> of the <timing> ("wall_ms", measured by
+        the client, or "took_ms", reported by ElasticSearch) of the runs is
+        greater than <ms> milliseconds, or if the query fails.
+        """
+        for i in range(warmup + runs):
+            response = self.search(query)
+            if "error" in response:
+                self.fail("Query failed: {0}".format(json.dumps(response)))
+        values = [getattr(item, timing)
+                  for item in self.query_timings[-runs:]]
+        if None in values:
+            self.fail("ElasticSearch did not report {0}".format(timing))
+        value = _percentile(values, percentile)
+        if value > ms:
+            message = "Percentile {0} of {1} is {2:.1f}ms, above {3}ms: {4}"
+            self.fail(message.format(
+                percentile, timing, value, ms,
+                ", ".join("{0:.1f}".format(item) for item in values)))
+
+    def profile_search(self, query=None):
+        """
+        Run a search <query> (JSON) as search does, with "profile": true,
+        and return its Profile (read estester.profile): the query and
+        collector trees of all shards, merged, with their timings.
+        """
+        query = dict({} if query is None else query, profile=True)
+        response = self.search(query)
+        if "profile" not in response:
+            raise ElasticSearchException(
+                "Search was not profiled: {0}".format(json.dumps(response)))
+        return Profile(response)
+
+    def _profile(self, query):
+        if isinstance(query, Profile):
+            return query
+        return self.profile_search(query)
+
+    def assertClauseTimeBelow(self, query, clause_type, percent):
+        """
+        Profile the search <query> (JSON, or the Profile returned by
+        profile_search), failing if the queries whose type matches
+        <clause_type> (a regular expression, such as "Wildcard|Script")
+        take more than <percent>% of the time of the query, including
+        their children.
+        """
+        profile = self._profile(query)
+        share = profile.time_share(clause_type)
+        if share > percent:
+            message = "{0} took {1:.1f}% of the query time, above {2}%:\n{3}"
+            self.fail(message.format(clause_type, share, percent,
+                                     profile.format()))
+
+    def assertTermClausesAtMost(self, query, count):
+        """
+        Profile the search <query> (JSON, or the Profile returned by
+        profile_search), failing if it was rewritten into more than <count>
+        term queries (TermQuery, such as the terms a prefix, wildcard or
+        fuzzy query expands to), counted in the merged tree of all shards.
+        """
+        profile = self._profile(query)
+        found = profile.count("^TermQuery$")
+        if found > count:
+            message = "Query was rewritten into {0} term queries, " \
+                "above {1}:\n{2}"
+            self.fail(message.format(found, count, profile.format()))
+
+    def iter_hits(self, query=None, page_size=100, index=None):
+        """
+        Iterate over every hit of a search <query> (JSON), getting
+        <page_size> hits per request, so large result sets are read with
+        bounded memory. <index> overrides the indexes searched by search.
+
+        Pages are got with search_after over a point in time, sorted by
+        _shard_doc unless <query> has a sort (ElasticSearch 7.12 or later),
+        or, if the cluster does not support it, with a scroll. Either is
+        released when all hits were read or when the iterator is closed
+        (including when it is garbage collected).
+
+        Uses the following class attributes:
+            scroll_keep_alive: how long ElasticSearch keeps the point in time
+                or scroll between two pages (default: "1m")
+        """
+        index = self.namespaced(index) if index else self._searched_indexes()
+        pit_id = self._open_pit(index)
+        if pit_id is None:
+            pages = self._scroll_pages(index, query, page_size)
+        else:
+            pages = self._pit_pages(index, pit_id, query, page_size)
+        try:
+            for page in pages:
+                for hit in page:
+                    yield hit
+        finally:
+            pages.close()
+
+    def _searched_indexes(self):
+        "Return the indexes searched by search."
+        return self.namespaced(self.index)
+
+    def _open_pit(self, index):
+        """
+        Open a point in time over <index>, returning its id, or None if the
+        cluster does not support it.
+        """
+        url = "{0}{1}/_pit".format(self.host, index or "_all")
+        params = {"keep_alive": self.scroll_keep_alive}
+        response = self._request("post", url, params=params)
+        if not response.status_code in [200, 201]:
+            return None
+        return json.loads(response.text)["id"]
+
+    def _pit_pages(self, index, pit_id, query, page_size):
+        """
+        Yield the pages of hits of <query> using search_after and the PIT
+        <pit_id> over <index>.
+
+        If the first search fails (ElasticSearch 7.10 and 7.11 open points
+        in time, but cannot sort by _shard_doc), the PIT is closed and the
+        pages are got with a scroll instead.
+        """
+        url = "{0}_search".format(self.host)
+        body = dict(query or {})
+        body.pop("from", None)
+        body["size"] = page_size
+        body.setdefault("sort", ["_shard_doc"])
+        first_page = True
+        try:
+            while True:
+                body["pit"] = {
+                    "id": pit_id,
+                    "keep_alive": self.scroll_keep_alive
+                }
+                started = time.time()
+                response = self._request("post", url, data=json.dumps(body))
+                if first_page and not response.status_code in [200, 201]:
+                    break
+                elif not response.status_code in [200, 201]:
+                    raise ElasticSearchException(response.text)
+                first_page = False
+                result = self._strip_namespace(
+                    self._timed_result(url, started, response))
+                pit_id = result.get("pit_id", pit_id)
+                hits = result["hits"]["hits"]
+                if hits:
+                    yield hits
+                if len(hits) < page_size:
+                    return
+                body["search_after"] = hits[-1]["sort"]
+        finally:
+            self._request("delete", "{0}_pit".format(self.host),
+                          data=json.dumps({"id": pit_id}))
+        # a query which is wrong anyway fails again with the scroll
+        pages = self._scroll_pages(index, query, page_size)
+        try:
+            for page in pages:
+                yield page
+        finally:
+            pages.close()
+
+    def _scroll_pages(self, index, query, page_size):
+        "Yield the pages of hits of <query> on <index> using a scroll."
+        url = "{0}{1}_search".format(self.host, index + "/" if index else "")
+        body = dict(query or {})
+        body["size"] = page_size
+        params = {"scroll": self.scroll_keep_alive}
+        started = time.time()
+        response = self._request("post", url, data=json.dumps(body),
+                                 params=params)
+        scroll_url = "{0}_search/scroll".format(self.host)
+        scroll_id = None
+        try:
+            while True:
+                if not response.status_code in [200, 201]:
+                    raise ElasticSearchException(response.text)
+                result = self._strip_namespace(
+                    self._timed_result(url, started, response))
+                scroll_id = result.get("_scroll_id", scroll_id)
+                hits = result["hits"]["hits"]
+                if not hits:
+                    return
+                yield hits
+                body = {
+                    "scroll": self.scroll_keep_alive,
+                    "scroll_id": scroll_id
+                }
+                url = scroll_url
+                started = time.time()
+                response = self._request("post", scroll_url,
+                                         data=json.dumps(body))
+        finally:
+            if scroll_id is not None:
+                self._request("delete", scroll_url,
+                              data=json.dumps({"scroll_id": [scroll_id]}))
+
+    def search_many(self, queries):
+        """
+        Run many search <queries> (list of JSON) using ElasticSearch's
+        _msearch endpoint, sending msearch_size queries per request.
+
+        Returns a list containing, in the same order as <queries>, the JSON
+        response of each query or, for each query which failed, an
+        ElasticSearchException.
+        """
+        index = self.namespaced(self.index)
+        return self._msearch([(index, query) for query in queries])
+
+    def _msearch(self, searches):
+        """
+        Run (index, query) <searches> through _msearch, returning the same
+        as search_many. An empty index searches all indexes.
+        """
+        url = "{0}_msearch".format(self.host)
+        results = []
+        for start in range(0, len(searches), self.msearch_size):
+            lines = []
+            for index, query in searches[start:start + self.msearch_size]:
+                header = {"index": index} if index else {}
+                query = {} if query is None else query
+                lines.append(json.dumps(header))
+                lines.append(json.dumps(query))
+            payload = "\n".join(lines) + "\n"
+            started = time.time()
+            response = self._request("post", url, data=payload)
+            if not response.status_code in [200, 201]:
+                raise ElasticSearchException(response.text)
+            result = self._timed_result(url, started, response)
+            for item in result["responses"]:
+                if "error" in item:
+                    error = json.dumps(item["error"])
+                    results.append(ElasticSearchException(error))
+                else:
+                    results.append(self._strip_namespace(item))
+        return results
 
     def tokenize(self, text, analyzer):
         """
         Run <analyzer> on text and returns a dict containing the tokens.
         """
-        url = "{0}{1}/_analyze".format(self.host, self.index)
+        index = self.namespaced(self.index)
+        url = "{0}{1}/_analyze".format(self.host, index)
         if analyzer != "default":
             url += "?analyzer={0}".format(analyzer)
-        response = requests.post(
-            url,
-            data=json.dumps(text),
-            proxies=self.proxies)
+        response = self._request("post", url, data=json.dumps(text))
         return json.loads(response.text)
 
+    def tokenize_many(self, texts, analyzer):
+        """
+        Run <analyzer> on each of <texts> (list of strings), sending
+        analyze_size texts per request to ElasticSearch's _analyze endpoint
+        (ElasticSearch 2 or later).
+
+        Returns a list containing, in the same order as <texts>, a dict with
+        the tokens of each text (as tokenize). Offsets are relative to each
+        text and positions are counted from 0 at its first token.
+
+        Uses the following class attributes:
+            analyze_size: max number of texts per request (default: 100)
+            cache_tokens: keep the tokens of each text in estester's
+                tokens_cache, shared by all test cases and discarded only
+                if the index settings change, so texts analyzed before are
+                not sent again (default: True)
+        """
+        texts = [text.decode("utf-8") if isinstance(text, bytes) else text
+                 for text in texts]
+        settings = _flat_settings(self._index_settings(self.index))
+        digest = hashlib.sha1(json.dumps([self.host, settings],
+                                         sort_keys=True).encode("utf-8"))
+        fingerprint = digest.hexdigest()
+        results = {}
+        missing = []
+        for text in texts:
+            key = (fingerprint, analyzer, text)
+            tokens = tokens_cache.get(key) if self.cache_tokens else None
+            if tokens is not None:
+                results[text] = tokens
+            elif text not in results:
+                results[text] = None
+                missing.append(text)
+        index = self.namespaced(self.index)
+        url = "{0}{1}/_analyze".format(self.host, index)
+        for start in range(0, len(missing), self.analyze_size):
+            chunk = missing[start:start + self.analyze_size]
+            payload = {"text": chunk}
+            if analyzer != "default":
+                payload["analyzer"] = analyzer
+            response = self._request("post", url, data=json.dumps(payload))
+            if not response.status_code in [200, 201]:
+                raise ElasticSearchException(response.text)
+            tokens = json.loads(response.text)["tokens"]
+            for text, group in zip(chunk, _split_tokens(chunk, tokens)):
+                results[text] = group
+                if self.cache_tokens:
+                    tokens_cache.set((fingerprint, analyzer, text), group)
+        return [{"tokens": copy.deepcopy(results[text])} for text in texts]
+
     def get(self, doc_type, doc_id):
-        index = urllib.quote_plus(self.index)
+        index = urllib.quote_plus(self.namespaced(self.index))
         doc_type = urllib.quote_plus(doc_type)
         doc_id = urllib.quote_plus(doc_id)
         url = "{0}{1}/{2}/{3}".format(self.host, index, doc_type, doc_id)
-        response = requests.get(url)
+        response = self._request("get", url)
         if not response.status_code in [200, 201]:
             raise ElasticSearchException(response.text)
         else:
-            return json.loads(response.text)
+            return self._strip_namespace(json.loads(response.text))
+
+    def get_many(self, docs):
+        """
+        Get many documents, listed by <docs> as (doc_type, doc_id) tuples,
+        using ElasticSearch's _mget endpoint, mget_size documents per
+        request.
+
+        Returns a dict mapping each doc_id to the same response as get, or
+        to None if the document was not found (without raising an
+        exception), or to an ElasticSearchException if getting it failed.
+        Raises ElasticSearchException if two <docs> have the same doc_id.
+        """
+        index = self.namespaced(self.index)
+        return self._mget([(index, doc_type, doc_id)
+                           for doc_type, doc_id in docs],
+                          [doc_id for doc_type, doc_id in docs])
+
+    def _mget(self, docs, keys):
+        """
+        Get (index, doc_type, doc_id) <docs> through _mget, returning the
+        same as get_many, keyed by the item of <keys> at the position of
+        each document (_mget answers in the order documents are listed).
+        """
+        if len(set(keys)) != len(keys):
+            raise ElasticSearchException(
+                "get_many requires distinct documents")
+        url = "{0}_mget".format(self.host)
+        results = {}
+        for start in range(0, len(docs), self.mget_size):
+            chunk = docs[start:start + self.mget_size]
+            payload = {"docs": [
+                {"_index": index, "_type": doc_type, "_id": doc_id}
+                for index, doc_type, doc_id in chunk
+            ]}
+            response = self._request("post", url, data=json.dumps(payload))
+            if not response.status_code in [200, 201]:
+                raise ElasticSearchException(response.text)
+            found = json.loads(response.text)["docs"]
+            for key, doc in zip(keys[start:start + self.mget_size], found):
+                if "error" in doc:
+                    error = json.dumps(doc["error"])
+                    results[key] = ElasticSearchException(error)
+                elif doc.get("found", doc.get("exists")):
+                    results[key] = self._strip_namespace(doc)
+                else:
+                    results[key] = None
+        return results
+
+    def namespaced(self, name):
+        """
+        Return the name used in ElasticSearch for the index or alias <name>
+        (or comma-separated list of names), which is prefixed by the
+        worker_namespace() if namespace_indexes is True. This allows running
+        tests in parallel processes against the same ElasticSearch cluster.
+        """
+        if not self.namespace_indexes:
+            return name
+        prefix = "{0}-".format(worker_namespace())
+        return ",".join(prefix + part for part in name.split(","))
+
+    def _strip_namespace(self, response):
+        """
+        Remove the worker namespace from the _index of a get or search
+        <response> (parsed JSON).
+        """
+        if not self.namespace_indexes:
+            return response
+        prefix = "{0}-".format(worker_namespace())
+        documents = [response] + response.get("hits", {}).get("hits", [])
+        for document in documents:
+            index = document.get("_index", "")
+            if index.startswith(prefix):
+                document["_index"] = index[len(prefix):]
+        return response
+
+    def create_aliases(self, index, aliases):
+        """
+        Create <aliases> (a list of aliases) for the index identified by
+        <index>
+        """
+        return self._update_aliases("add", [(index, a) for a in aliases])
+
+    def remove_aliases(self, index, aliases):
+        """
+        Remove <aliases> (a list of aliases) of the index identified by
+        <index>
+        """
+        return self._update_aliases("remove", [(index, a) for a in aliases])
+
+    @timed("update_aliases")
+    def _update_aliases(self, action_type, aliases):
+        """
+        Perform <action_type> ("add" or "remove") on every (index, alias)
+        tuple of <aliases> with a single call to _aliases.
+        """
+        url, json_data = self._aliases_request(action_type, aliases)
+        return _json_response(self._request("post", url, data=json_data))
+
+    def _aliases_request(self, action_type, aliases):
+        "Return the url and body of the call made by _update_aliases."
+        payload = {
+            "actions": []
+        }
+        for index, alias in aliases:
+            action = {
+                action_type: {
+                    "index": self.namespaced(index),
+                    "alias": self.namespaced(alias)
+                }
+            }
+            payload["actions"].append(action)
+        url = "{0}/_aliases".format(self.host)
+        return url, json.dumps(payload)
+
+    def get_aliases(self, index):
+        """
+        Gets aliases of <index>
+        """
+        index = self.namespaced(index)
+        url = '{0}{1}/_aliases'.format(self.host, index)
+        response = self._request("get", url)
+        # Elasticsearch 0.90 used to return 404 when there were no aliases
+        if response.status_code == 404:
+            return []
+        elif not response.status_code in [200, 201]:
+            raise ElasticSearchException(response.text)
+        else:
+            aliases = json.loads(response.text)
+            if index not in aliases:
+                return []
+            elif self.namespace_indexes:
+                prefix = "{0}-".format(worker_namespace())
+                return [alias[len(prefix):]
+                        for alias in aliases[index]['aliases']
+                        if alias.startswith(prefix)]
+            else:
+                return aliases[index]['aliases'].keys()
 
 
 class MultipleIndexesQueryTestCase(ElasticSearchQueryTestCase):
@@ -263,196 +1776,163 @@ class MultipleIndexesQueryTestCase(ElasticSearchQueryTestCase):
     """
 
     data = {}
+    setup_workers = 4
+
+    def _index_settings(self, index):
+        "Return the settings <index> was declared with in data."
+        return self.data.get(index, {}).get("settings") or self.settings
 
     def _pre_setup(self):
         """
         Load self.fixtures to the ElasticSearch index. Read load_fixtures
         for more information.
 
+        Indexes are set up concurrently, then all their aliases are created
+        at once, and finally their fixtures are waited for at once.
+
         Uses the following class attributes:
             reset_index: delete index before loading data (default: True)
+            reuse_index: skip loading data of each index which was already
+                loaded with the same mappings, settings, aliases and
+                fixtures, even by a previous test run (default: False)
+            setup_workers: max number of indexes set up at the same time
+                (default: 4)
         """
+        indexes = []
         for index_name, index in self.data.items():
-            if self.reset_index:
-                self.delete_index(index_name)
             settings = index.get("settings", {})
             mappings = index.get("mappings", {})
             fixtures = index.get("fixtures", {})
             aliases = index.get("aliases", [])
-            self.create_index(index_name, settings, mappings)
-            self.load_fixtures(index_name, fixtures)
-            if aliases:
-                self.create_aliases(index_name, aliases)
+            indexes.append((index_name, settings, mappings, fixtures, aliases))
+        results = self._map(lambda args: self._prepare_index(*args), indexes)
+        created = 0
+        waiting = []
+        aliases = []
+        for index, (index_created, index_aliases) in zip(indexes, results):
+            index_name = index[0]
+            aliases.extend((index_name, alias) for alias in index_aliases)
+            if index_created is not None:
+                waiting.append(index_name)
+                created += index_created
+        if aliases:
+            self._update_aliases("add", aliases)
+        if waiting:
+            self.wait_for_fixtures(",".join(waiting), created)
 
-    def _post_teardown(self):
+    def _map(self, function, items):
         """
-        Clear up ElasticSearch index, if reset_index is True.
-
-        Uses the following class attributes:
-            index: name of the index (default: sample.test)
-            host: ElasticSearch host (default: http://localhost:9200/)
-            reset_index: delete index after running tests (default: True)
+        Return the result of <function> applied to every item of <items>,
+        running at most setup_workers at the same time.
         """
-        for index_name, index in self.data.items():
-            if self.reset_index:
-                self.delete_index(index_name)
+        workers = min(self.setup_workers, len(items))
+        if workers <= 1:
+            return [function(item) for item in items]
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+            pool.join()
 
-    def create_aliases(self, index, aliases):
+    def _pre_write(self):
         """
-        Create <aliases> (a list of aliases) for the index identified by
-        <index>
+        Make sure indexes about to be changed are not reused, if reuse_index
+        is True.
         """
-        payload = {
-            "actions": []
-        }
-        for alias in aliases:
-            action = {
-                "add": {
-                    "index": index,
-                    "alias": alias
-                }
-            }
-            payload["actions"].append(action)
-        url = "{0}/_aliases".format(self.host)
-        json_data = json.dumps(payload)
-        response = requests.post(url, proxies=self.proxies, data=json_data)
-        if not response.status_code in [200, 201]:
-            raise ElasticSearchException(response.text)
-        else:
-            return json.loads(response.text)
+        if self.reuse_index and self.reset_strategy == "rebuild":
+            for index_name in self.data:
+                self.remove_fingerprint(index_name)
 
-    def create_index(self, index_name="", settings="", mappings=""):
+    def _post_teardown(self):
         """
-        Use the following class attributes:
+        Clear up ElasticSearch indexes, if reset_index is True and they are
+        not reused (read setup_index for more information).
+
+        Uses the following class attributes:
             index: name of the index (default: sample.test)
             host: ElasticSearch host (default: http://localhost:9200/)
-            settings: used to define analyzers (optional) (i)
-            mappings: attribute specific mappings according to types
-
-        To create an empty index in ElasticSearch.
-
-        (i) http://www.elasticsearch.org/guide/en/elasticsearch/guide/current/
-        configuring-analyzers.html
+            reset_index: delete index after running tests (default: True)
         """
-        url = "{0}{1}/"
-        index = index_name or self.index
-        url = url.format(self.host, index)
-        data = {}
-        mappings = mappings or self.mappings
-        if mappings:
-            data["mappings"] = mappings
-        settings = settings or self.settings
-        if settings:
-            data["settings"] = settings
-        json_data = json.dumps(data)
-        response = requests.put(url, proxies=self.proxies, data=json_data)
+        if not self._keeps_index():
+            self._map(self.delete_index, list(self.data))
 
-    def get_aliases(self, index):
-        """
-        Gets aliases of <index>
-        """
-        url = '{0}{1}/_aliases'.format(self.host, index)
-        response = requests.get(url, proxies=self.proxies)
-        # Elasticsearch 0.90 used to return 404 when there were no aliases
-        if response.status_code == 404:
-            return []
-        elif not response.status_code in [200, 201]:
-            raise ElasticSearchException(response.text)
-        else:
-            aliases = json.loads(response.text)
-            if index in aliases:
-                return aliases[index]['aliases'].keys()
-            else:
-                return []
-
-    def load_fixtures(self, index_name="", fixtures=""):
+    def search(self, query=None):
         """
-        Use the following class attributes:
-            index: name of the index (default: sample.test)
-            host: ElasticSearch host (default: http://localhost:9200/)
-            fixtures: list of items to be loaded (default: [])
-            timeout: time in seconds to wait index load (default: 5s)
-
-        Example of fixtures:
-        [
-            {
-                "type": "book",
-                "id": "1",
-                "body": {"title": "The Hitchhiker's Guide to the Galaxy"}
-            },
-            {
-                "type": "book",
-                "id": "2",
-                "body": {"title": "The Restaurant at the End of the Universe"}
-            }
-        ]
+        Run a search <query> (JSON) and returns the JSON response.
 
-        Each item of the fixtures list represents a document at ElasticSearch
-        and must contain:
-            type: type of the document
-            id: unique identifier
-            body: json with fields of values of document
+        Golden indexes (read setup_index) are not searched. If
+        namespace_indexes is True, only indexes of the current worker are
+        searched.
         """
-        index = index_name or self.index
-        fixtures = fixtures or self.fixtures
-        for doc in fixtures:
-            doc_type = urllib.quote_plus(doc["type"])
-            doc_id = urllib.quote_plus(doc["id"])
-            doc_body = doc["body"]
-            url = "{0}{1}/{2}/{3}"
-            url = url.format(self.host, index, doc_type, doc_id)
-            response = requests.put(
-                url,
-                data=json.dumps(doc_body),
-                proxies=self.proxies)
-            if not response.status_code in [200, 201]:
-                raise ElasticSearchException(response.text)
-        if self.timeout is None:
-            self.refresh_index(index_name)
-        else:
-            time.sleep(self.timeout)
-        # http://0.0.0.0:9200/sample.test/_search
+        indexes = self._searched_indexes()
+        if indexes:
+            indexes += "/"
+        url = "{0}/{1}_search".format(self.host, indexes)
+        query = {} if query is None else query
+        started = time.time()
+        response = self._request("post", url, data=json.dumps(query))
+        return self._strip_namespace(
+            self._timed_result(url, started, response))
 
-    def delete_index(self, index_name=""):
+    def _searched_indexes(self):
         """
-        Deletes test index. Uses class attribute:
-            index: name of the index to be deleted
+        Return the indexes searched by search, or "" for all indexes.
         """
-        index = index_name or self.index
-        url = "{0}{1}/".format(self.host, index)
-        requests.delete(url, proxies=self.proxies)
+        if self.reset_strategy != "rebuild":
+            return "{0},-*.golden".format(self.namespaced("*"))
+        elif self.namespace_indexes:
+            return self.namespaced("*")
+        return ""
 
-    def search(self, query=None):
+    def search_many(self, queries):
         """
-        Run a search <query> (JSON) and returns the JSON response.
+        Run many search <queries> at once (read
+        ElasticSearchQueryTestCase.search_many). Each query is either a
+        query (JSON), searched as by search, or an (index, query) tuple,
+        searched as by search_in_index.
         """
-        url = "{0}/_search".format(self.host)
-        query = {} if query is None else query
-        response = requests.post(
-            url,
-            data=json.dumps(query),
-            proxies=self.proxies)
-        return json.loads(response.text)
+        searches = []
+        for query in queries:
+            if isinstance(query, tuple):
+                index, query = query
+                searches.append((self.namespaced(index), query))
+            else:
+                searches.append((self._searched_indexes(), query))
+        return self._msearch(searches)
 
     def search_in_index(self, index, query=None):
         """
         Run a search <query> (JSON) and returns the JSON response.
         """
-        url = "{0}/{1}/_search".format(self.host, index)
+        url = "{0}/{1}/_search".format(self.host, self.namespaced(index))
         query = {} if query is None else query
-        response = requests.post(
-            url,
-            data=json.dumps(query),
-            proxies=self.proxies)
-        return json.loads(response.text)
+        started = time.time()
+        response = self._request("post", url, data=json.dumps(query))
+        return self._strip_namespace(
+            self._timed_result(url, started, response))
 
     def get(self, index, doc_type, doc_id):
-        index = urllib.quote_plus(index)
+        index = urllib.quote_plus(self.namespaced(index))
         doc_type = urllib.quote_plus(doc_type)
         doc_id = urllib.quote_plus(doc_id)
         url = "{0}{1}/{2}/{3}".format(self.host, index, doc_type, doc_id)
-        response = requests.get(url)
+        response = self._request("get", url)
         if not response.status_code in [200, 201]:
             raise ElasticSearchException(response.text)
         else:
-            return json.loads(response.text)
+            return self._strip_namespace(json.loads(response.text))
+
+    def get_many(self, docs):
+        """
+        Get many documents, listed by <docs> as (index, doc_type, doc_id)
+        tuples, at once. Read ElasticSearchQueryTestCase.get_many for more
+        information.
+
+        As several indexes may have documents with the same id, the dict
+        returned is keyed by (index, doc_id) tuples.
+        """
+        return self._mget([(self.namespaced(index), doc_type, doc_id)
+                           for index, doc_type, doc_id in docs],
+                          [(index, doc_id)
+                           for index, doc_type, doc_id in docs])
@@ -0,0 +1,449 @@
+"""
+asyncio counterparts of ESTester test cases, built on
+unittest.IsolatedAsyncioTestCase (Python 3.8 or later) and aiohttp, which
+can be installed with:
+
+    pip install estester[async]
+
+Their search, get, load_fixtures, create_index and related methods are
+coroutines, so a single test can send many concurrent queries without
+threads:
+
+    responses = await asyncio.gather(*[self.search(q) for q in queries])
+
+The index is set up by asyncSetUp, so test cases which override it must
+await super().asyncSetUp() first.
+
+Only the per test method life cycle is supported: setup_scope, reuse_index,
+reset_strategy, cassette, assertQueryFasterThan and the cluster health check
+(wait_for_status) are specific to the synchronous test cases. Requests are
+built and responses checked by the same methods as in the synchronous test
+cases; only sending them differs.
+"""
+import asyncio
+import collections
+import json
+import time
+import unittest
+from urllib.parse import quote_plus
+
+import aiohttp
+
+from estester import ElasticSearchException, ElasticSearchQueryTestCase, \
+    MultipleIndexesQueryTestCase, _BulkLoad, _check_index_created, \
+    _json_response, _payload_cache_lock
+
+
+Response = collections.namedtuple("Response", ["status_code", "text"])
+
+
+class AsyncElasticSearchQueryTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    Extends unittest.IsolatedAsyncioTestCase.
+
+    Allows testing ElasticSearch queries from coroutines. Uses the same class
+    attributes as estester.ElasticSearchQueryTestCase. The index is set up
+    by asyncSetUp (after setUp) and cleared up after tearDown of every test
+    method, using one aiohttp session per test method.
+    """
+
+    index = "sample.test"  # must be lower case
+    reset_index = True  # warning: if this is True, index will be cleared up
+    host = "http://0.0.0.0:9200/"
+    mappings = {}
+    proxies = {}
+    fixtures = []
+    timeout = 5
+    settings = {}
+    bulk_size = 500
+    bulk_max_bytes = 5 * 1024 * 1024
+    readiness = None
+    pool_size = 10
+    request_timeout = None
+    namespace_indexes = False
+    backend = "http"
+    cassette = None
+    fast_ingest = False
+    record_timings = True
+
+    # request payloads and index names are built as in the synchronous case
+    namespaced = ElasticSearchQueryTestCase.namespaced
+    _strip_namespace = ElasticSearchQueryTestCase._strip_namespace
+    _bulk_payloads = ElasticSearchQueryTestCase._bulk_payloads
+    _serialize_payloads = ElasticSearchQueryTestCase._serialize_payloads
+    _bulk_entries = ElasticSearchQueryTestCase._bulk_entries
+    _create_index_request = ElasticSearchQueryTestCase._create_index_request
+    _create_settings = ElasticSearchQueryTestCase._create_settings
+    _index_settings = ElasticSearchQueryTestCase._index_settings
+    _restored_settings = ElasticSearchQueryTestCase._restored_settings
+    _refresh_url = ElasticSearchQueryTestCase._refresh_url
+    _readiness_step = ElasticSearchQueryTestCase._readiness_step
+    _replaying = ElasticSearchQueryTestCase._replaying
+    _count_wait = ElasticSearchQueryTestCase._count_wait
+    _aliases_request = ElasticSearchQueryTestCase._aliases_request
+    transport = ElasticSearchQueryTestCase.transport
+    _backend = ElasticSearchQueryTestCase._backend
+    query_timings = ElasticSearchQueryTestCase.query_timings
+    _timed_result = ElasticSearchQueryTestCase._timed_result
+
+    @classmethod
+    def tearDownClass(cls):
+        "Drop the _bulk payloads cached for the class."
+        super(AsyncElasticSearchQueryTestCase, cls).tearDownClass()
+        with _payload_cache_lock:
+            if "_payload_cache" in cls.__dict__:
+                del cls._payload_cache
+
+    async def asyncSetUp(self):
+        """
+        Open the session of the test method and set up the index. Test
+        cases overriding asyncSetUp must await super().asyncSetUp() first.
+        """
+        await super(AsyncElasticSearchQueryTestCase, self).asyncSetUp()
+        await self._open_session()
+        await self._pre_setup()
+
+    async def _open_session(self):
+        """
+        Open the aiohttp session used by the test method, which is closed
+        (after _post_teardown) when the test method's clean ups run.
+        """
+        self.session = self._new_session()
+        self.addAsyncCleanup(self.session.close)
+        self.addAsyncCleanup(self._post_teardown)
+
+    def _new_session(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def _benchmark(self, schedule, samples, concurrency):
+        """
+        Set up the index, run the queries of <schedule> in <concurrency>
+        tasks, adding them to <samples>, and clear the index up. Read
+        estester.benchmark for more information.
+        """
+        self.session = self._new_session()
+        try:
+            await self._pre_setup()
+            try:
+                await asyncio.gather(*[
+                    self._benchmark_worker(schedule, samples)
+                    for i in range(concurrency)
+                ])
+            finally:
+                await self._post_teardown()
+        finally:
+            await self.session.close()
+            type(self).tearDownClass()
+
+    async def _benchmark_worker(self, schedule, samples):
+        run = schedule.next()
+        while run is not None:
+            started = time.time()
+            try:
+                response = await self.search(run[1])
+            except Exception as error:
+                samples.add(run, started, error=str(error))
+            else:
+                samples.add(run, started, response)
+            run = schedule.next()
+
+    async def _request(self, method, url, data=None, params=None):
+        """
+        Send a HTTP request through the test method session, returning a
+        Response with its status code and text. Calls to other backends
+        than "http" (such as "memory") are answered synchronously.
+        """
+        if self.backend != "http":
+            response = self.transport.request(method.upper(), url, data=data,
+                                              params=params)
+            return Response(response.status_code, response.text)
+        proxy = self.proxies.get(url.split(":", 1)[0])
+        headers = {"Content-Type": "application/json"}
+        async with self.session.request(method.upper(), url, data=data,
+                                        params=params or None, proxy=proxy,
+                                        headers=headers) as response:
+            return Response(response.status, await response.text())
+
+    async def _pre_setup(self):
+        """
+        Load self.fixtures to the ElasticSearch index. Read load_fixtures
+        for more information.
+
+        Uses the following class attributes:
+            reset_index: delete index before loading data (default: True)
+        """
+        if self.reset_index:
+            await self.delete_index()
+        await self.create_index()
+        await self.load_fixtures()
+
+    async def _post_teardown(self):
+        """
+        Clear up ElasticSearch index, if reset_index is True.
+        """
+        if self.reset_index:
+            await self.delete_index()
+
+    async def refresh_index(self, index=None):
+        """
+        Calls ElasticSearch's _refresh method on <index>. If index is None,
+        then refresh is called on every index.
+        """
+        return _json_response(
+            await self._request("post", self._refresh_url(index)))
+
+    async def refresh(self):
+        """
+        Calls ElasticSearch's _refresh method on the test case default index.
+        """
+        return await self.refresh_index(self.index)
+
+    async def create_index(self, index_name="", settings="", mappings=""):
+        """
+        Create an empty index (default: self.index) with <settings> and
+        <mappings> (default: self.settings and self.mappings). Read
+        estester.ElasticSearchQueryTestCase.create_index for more
+        information.
+
+        Raises ElasticSearchException if ElasticSearch fails to create it,
+        unless it already exists.
+        """
+        url, json_data = self._create_index_request(index_name, settings,
+                                                    mappings)
+        _check_index_created(await self._request("put", url, data=json_data))
+
+    async def update_settings(self, index, settings):
+        """
+        Update the dynamic <settings> (dict) of <index>.
+        """
+        url = "{0}{1}/_settings".format(self.host, self.namespaced(index))
+        return _json_response(
+            await self._request("put", url, data=json.dumps(settings)))
+
+    async def load_fixtures(self, index_name="", fixtures="", wait=True):
+        """
+        Load <fixtures> (default: self.fixtures) into <index_name> (default:
+        self.index) through the _bulk endpoint. Read
+        estester.ElasticSearchQueryTestCase.load_fixtures for the format of
+        fixtures.
+
+        Unless <wait> is False, waits for the fixtures to be searchable.
+
+        Returns the number of documents created.
+        """
+        index = index_name or self.index
+        fixtures = fixtures or self.fixtures
+        created = await self.bulk_index(index, fixtures)
+        if self.fast_ingest:
+            await self.update_settings(index, self._restored_settings(index))
+        if self.readiness == "wait_for":
+            await self.refresh_index(index)
+        if wait:
+            await self.wait_for_fixtures(index, created)
+        return created
+
+    async def wait_for_fixtures(self, index, count):
+        """
+        Wait until the <count> documents loaded to <index> can be searched,
+        according to readiness. Read
+        estester.ElasticSearchQueryTestCase.wait_for_fixtures for more
+        information.
+        """
+        step = self._readiness_step()
+        if step == "refresh":
+            await self.refresh_index(index)
+        elif step == "sleep":
+            await asyncio.sleep(self.timeout)
+        elif step == "count":
+            await self.wait_for_count(index, count)
+
+    async def wait_for_count(self, index, count):
+        """
+        Poll <index>'s _count until at least <count> documents are searchable.
+
+        Raises ElasticSearchException if it takes more than timeout seconds.
+        """
+        wait = self._count_wait(index, count)
+        while True:
+            found = wait.check(await self._request("get", wait.url))
+            if found is not None:
+                return found
+            await asyncio.sleep(wait.next_delay())
+
+    async def bulk_index(self, index, fixtures):
+        """
+        Index <fixtures> into <index> using ElasticSearch's _bulk endpoint.
+        Read estester.ElasticSearchQueryTestCase.bulk_index for more
+        information.
+
+        Returns the number of documents created.
+        """
+        url = "{0}_bulk".format(self.host)
+        load = _BulkLoad(index)
+        for payload, count in self._bulk_payloads(index, fixtures):
+            load.add(await self._request("post", url, data=payload), count)
+        return load.result()
+
+    async def delete_index(self, index_name=""):
+        """
+        Deletes <index_name> (default: self.index).
+        """
+        index = self.namespaced(index_name or self.index)
+        url = "{0}{1}/".format(self.host, index)
+        await self._request("delete", url)
+
+    async def search(self, query=None):
+        """
+        Run a search <query> (JSON) and returns the JSON response.
+        """
+        url = "{0}{1}/_search".format(self.host, self.namespaced(self.index))
+        query = {} if query is None else query
+        started = time.time()
+        response = await self._request("post", url, data=json.dumps(query))
+        return self._strip_namespace(
+            self._timed_result(url, started, response))
+
+    async def tokenize(self, text, analyzer):
+        """
+        Run <analyzer> on text and returns a dict containing the tokens.
+        """
+        index = self.namespaced(self.index)
+        url = "{0}{1}/_analyze".format(self.host, index)
+        params = {}
+        if analyzer != "default":
+            params["analyzer"] = analyzer
+        response = await self._request("post", url, data=json.dumps(text),
+                                       params=params)
+        return json.loads(response.text)
+
+    async def get(self, doc_type, doc_id):
+        return await self._get(self.index, doc_type, doc_id)
+
+    async def _get(self, index, doc_type, doc_id):
+        index = quote_plus(self.namespaced(index))
+        doc_type = quote_plus(doc_type)
+        doc_id = quote_plus(doc_id)
+        url = "{0}{1}/{2}/{3}".format(self.host, index, doc_type, doc_id)
+        response = await self._request("get", url)
+        if response.status_code not in [200, 201]:
+            raise ElasticSearchException(response.text)
+        return self._strip_namespace(json.loads(response.text))
+
+    async def create_aliases(self, index, aliases):
+        """
+        Create <aliases> (a list of aliases) for the index identified by
+        <index>
+        """
+        return await self._update_aliases(
+            "add", [(index, alias) for alias in aliases])
+
+    async def _update_aliases(self, action_type, aliases):
+        """
+        Perform <action_type> ("add" or "remove") on every (index, alias)
+        tuple of <aliases> with a single call to _aliases.
+        """
+        url, json_data = self._aliases_request(action_type, aliases)
+        return _json_response(
+            await self._request("post", url, data=json_data))
+
+    async def get_aliases(self, index):
+        """
+        Gets aliases of <index>
+        """
+        index = self.namespaced(index)
+        url = "{0}{1}/_aliases".format(self.host, index)
+        response = await self._request("get", url)
+        # Elasticsearch 0.90 used to return 404 when there were no aliases
+        if response.status_code == 404:
+            return []
+        elif response.status_code not in [200, 201]:
+            raise ElasticSearchException(response.text)
+        aliases = json.loads(response.text)
+        if index not in aliases:
+            return []
+        prefix = self.namespaced("")
+        return [alias[len(prefix):] for alias in aliases[index]["aliases"]
+                if alias.startswith(prefix)]
+
+
+class AsyncMultipleIndexesQueryTestCase(AsyncElasticSearchQueryTestCase):
+    """
+    Extends estester.aio.AsyncElasticSearchQueryTestCase.
+
+    Asynchronous counterpart of estester.MultipleIndexesQueryTestCase, whose
+    indexes are defined by the data class attribute. All indexes are set up
+    concurrently, then their aliases are created at once, and finally their
+    fixtures are waited for at once.
+    """
+
+    data = {}
+
+    _index_settings = MultipleIndexesQueryTestCase._index_settings
+
+    async def _pre_setup(self):
+        """
+        Set up every index of self.data.
+        """
+        names = list(self.data)
+        results = await asyncio.gather(
+            *[self._prepare_index(name, self.data[name]) for name in names])
+        aliases = []
+        for name in names:
+            index_aliases = self.data[name].get("aliases", [])
+            aliases.extend((name, alias) for alias in index_aliases)
+        if aliases:
+            await self._update_aliases("add", aliases)
+        if names:
+            await self.wait_for_fixtures(",".join(names), sum(results))
+
+    async def _prepare_index(self, name, index):
+        """
+        Delete (if reset_index is True), create and load the index <name>,
+        defined by <index>, without waiting for its fixtures.
+        """
+        if self.reset_index:
+            await self.delete_index(name)
+        await self.create_index(name, index.get("settings", {}),
+                                index.get("mappings", {}))
+        return await self.load_fixtures(name, index.get("fixtures", []),
+                                        wait=False)
+
+    async def _post_teardown(self):
+        """
+        Clear up ElasticSearch indexes, if reset_index is True.
+        """
+        if self.reset_index:
+            await asyncio.gather(
+                *[self.delete_index(name) for name in self.data])
+
+    async def search(self, query=None):
+        """
+        Run a search <query> (JSON) on all indexes and returns the JSON
+        response.
+        """
+        if self.namespace_indexes:
+            indexes = "{0}/".format(self.namespaced("*"))
+        else:
+            indexes = ""
+        url = "{0}{1}_search".format(self.host, indexes)
+        query = {} if query is None else query
+        started = time.time()
+        response = await self._request("post", url, data=json.dumps(query))
+        return self._strip_namespace(
+            self._timed_result(url, started, response))
+
+    async def search_in_index(self, index, query=None):
+        """
+        Run a search <query> (JSON) on <index> and returns the JSON response.
+        """
+        url = "{0}{1}/_search".format(self.host, self.namespaced(index))
+        query = {} if query is None else query
+        started = time.time()
+        response = await self._request("post", url, data=json.dumps(query))
+        return self._strip_namespace(
+            self._timed_result(url, started, response))
+
+    async def get(self, index, doc_type, doc_id):
+        return await self._get(index, doc_type, doc_id)
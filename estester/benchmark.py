@@ -0,0 +1,384 @@
+"""
+Benchmarks of the queries of a test case, run against the index its
+_pre_setup builds (with its index, mappings, settings and fixtures):
+
+    class CatalogTestCase(ElasticSearchQueryTestCase):
+        fixtures = SyntheticFixtures(100000, FIELDS)
+        benchmark_queries = {
+            "by_brand": {"query": {"term": {"brand": "ba"}}},
+            "full_text": {"query": {"match": {"title": "keno ba"}}}
+        }
+
+    results = run_benchmark(CatalogTestCase, concurrency=8, duration=30)
+    print(format_results(results))
+    save_results(results, "baseline.json")
+
+Queries run round-robin, after <warmup> runs of each one which are not
+measured, for <duration> seconds or <iterations> runs of each query. Test
+cases of estester.aio run them with <concurrency> asyncio tasks; the others
+with <concurrency> threads (pool_size should not be smaller). Results have,
+per query and in total, throughput, error rate, and percentiles of the time
+the client waited (wall_ms) and of the time ElasticSearch reported
+(took_ms).
+
+compare(baseline, current) reports the queries which got slower (a one-sided
+Mann-Whitney U test over the wall_ms samples, whose median must also grow
+more than <threshold>) or whose error rate grew. The same is available from
+the command line:
+
+    python -m estester.benchmark run tests.test_catalog.CatalogTestCase \\
+        --concurrency 8 --duration 30 --output current.json
+    python -m estester.benchmark compare baseline.json current.json
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import math
+import sys
+import threading
+import time
+
+from estester import _percentile
+
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+class Schedule(object):
+    """
+    Thread-safe source of the (name, query, measured) runs of a benchmark:
+    <warmup> unmeasured runs of each query, then measured runs until each
+    query ran <iterations> times or <duration> seconds passed.
+    """
+
+    def __init__(self, queries, iterations=None, duration=None, warmup=1):
+        if not iterations and not duration:
+            raise ValueError("Either iterations or duration is required")
+        self.names = sorted(queries)
+        self.queries = queries
+        self.warmup = warmup * len(self.names)
+        self.total = iterations * len(self.names) if iterations else None
+        self.duration = duration
+        self.deadline = None
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        "Return the next run, or None if the benchmark is over."
+        with self.lock:
+            position = self.count - self.warmup
+            if position >= 0:
+                if self.deadline is None and self.duration:
+                    self.deadline = time.time() + self.duration
+                if self.total is not None and position >= self.total:
+                    return None
+                if self.deadline is not None and \
+                        time.time() >= self.deadline:
+                    return None
+            name = self.names[self.count % len(self.names)]
+            self.count += 1
+        return name, self.queries[name], position >= 0
+
+
+class Samples(object):
+    "Thread-safe collection of the timings and errors of measured runs."
+
+    def __init__(self):
+        self.wall_ms = {}
+        self.took_ms = {}
+        self.errors = {}
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def add(self, run, started, response=None, error=None):
+        """
+        Record the <run> (as returned by Schedule.next) started at
+        <started> (time.time()), which returned the JSON <response> or
+        raised <error>.
+        """
+        finished = time.time()
+        name, query, measured = run
+        if not measured:
+            return
+        if error is None and "error" in response:
+            error = json.dumps(response["error"])
+        with self.lock:
+            if self.started is None or started < self.started:
+                self.started = started
+            self.finished = max(self.finished or finished, finished)
+            self.wall_ms.setdefault(name, []).append(
+                (finished - started) * 1000)
+            self.errors.setdefault(name, 0)
+            if error is not None:
+                self.errors[name] += 1
+            elif response.get("took") is not None:
+                self.took_ms.setdefault(name, []).append(response["took"])
+
+    def results(self):
+        "Return the statistics of the samples per query and in total."
+        elapsed = (self.finished or 0) - (self.started or 0)
+        queries = {}
+        for name in sorted(self.wall_ms):
+            queries[name] = _statistics(self.wall_ms[name],
+                                        self.took_ms.get(name, []),
+                                        self.errors[name], elapsed)
+        total = _statistics(
+            sum(self.wall_ms.values(), []), sum(self.took_ms.values(), []),
+            sum(self.errors.values()), elapsed)
+        del total["samples"]
+        return {"elapsed_s": elapsed, "queries": queries, "total": total}
+
+
+def summarize(values):
+    """
+    Return the percentiles (p50, p90, p95 and p99), mean and max of
+    <values>, or None if there are none.
+    """
+    if not values:
+        return None
+    summary = dict(("p{0}".format(percentile),
+                    _percentile(values, percentile))
+                   for percentile in PERCENTILES)
+    summary["mean"] = sum(values) / float(len(values))
+    summary["max"] = max(values)
+    return summary
+
+
+def _statistics(wall_ms, took_ms, errors, elapsed):
+    count = len(wall_ms)
+    return {
+        "count": count,
+        "errors": errors,
+        "error_rate": errors / float(count) if count else 0.0,
+        "throughput": count / elapsed if elapsed else 0.0,
+        "wall_ms": summarize(wall_ms),
+        "took_ms": summarize(took_ms),
+        "samples": {"wall_ms": [round(value, 3) for value in wall_ms]}
+    }
+
+
+def run_query(test_case, run, samples):
+    "Run the query of <run> with test_case.search, adding it to <samples>."
+    started = time.time()
+    try:
+        response = test_case.search(run[1])
+    except Exception as error:
+        samples.add(run, started, error=str(error))
+    else:
+        samples.add(run, started, response)
+
+
+def _worker(test_case, schedule, samples):
+    run = schedule.next()
+    while run is not None:
+        run_query(test_case, run, samples)
+        run = schedule.next()
+
+
+def run_benchmark(test_case_class, queries=None, concurrency=1,
+                  duration=None, iterations=None, warmup=1):
+    """
+    Set up the index of <test_case_class>, run a benchmark of <queries> (a
+    dict of JSON queries by name, by default the benchmark_queries attribute
+    of the class) and clear the index up.
+
+    Returns the results (a JSON-serializable dict).
+    """
+    if queries is None:
+        queries = getattr(test_case_class, "benchmark_queries", None)
+    if not queries:
+        raise ValueError("No queries to benchmark")
+    schedule = Schedule(queries, iterations, duration, warmup)
+    samples = Samples()
+    test_case = test_case_class("run")
+    # a QueryTiming per run would grow with the duration of the benchmark
+    test_case.record_timings = False
+    if hasattr(test_case, "_benchmark"):
+        import asyncio
+        asyncio.run(test_case._benchmark(schedule, samples, concurrency))
+        mode = "async"
+    else:
+        _run_threads(test_case, schedule, samples, concurrency)
+        mode = "threads"
+    results = samples.results()
+    results.update({
+        "test_case": "{0}.{1}".format(test_case_class.__module__,
+                                      test_case_class.__name__),
+        "mode": mode,
+        "concurrency": concurrency
+    })
+    return results
+
+
+@contextlib.contextmanager
+def prepared(test_case):
+    """
+    Set up the indexes of the synchronous <test_case> (as before its test
+    methods run) for the block, and clear them up afterwards.
+    """
+    test_case.wait_for_cluster()
+    test_case._pre_setup()
+    try:
+        yield test_case
+    finally:
+        try:
+            test_case._post_teardown()
+        finally:
+            type(test_case).tearDownClass()
+
+
+def _run_threads(test_case, schedule, samples, concurrency):
+    with prepared(test_case):
+        threads = [threading.Thread(target=_worker,
+                                    args=(test_case, schedule, samples))
+                   for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+def save_results(results, path):
+    with open(path, "w") as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as results:
+        return json.load(results)
+
+
+def format_results(results):
+    "Return the <results> of a benchmark as a text table."
+    lines = ["{0} ({1}, concurrency {2}, {3:.1f}s)".format(
+        results["test_case"], results["mode"], results["concurrency"],
+        results["elapsed_s"])]
+    header = "{0:<24} {1:>8} {2:>7} {3:>9} {4:>9} {5:>9} {6:>9} {7:>9}"
+    lines.append(header.format("query", "count", "errors", "q/s",
+                               "wall p50", "wall p95", "wall p99",
+                               "took p95"))
+    row = "{0:<24} {1:>8} {2:>6.1%} {3:>9.1f} {4:>9} {5:>9} {6:>9} {7:>9}"
+    items = sorted(results["queries"].items())
+    for name, item in items + [("total", results["total"])]:
+        wall = item["wall_ms"] or {}
+        took = item["took_ms"] or {}
+        lines.append(row.format(
+            name, item["count"], item["error_rate"], item["throughput"],
+            _milliseconds(wall.get("p50")), _milliseconds(wall.get("p95")),
+            _milliseconds(wall.get("p99")), _milliseconds(took.get("p95"))))
+    return "\n".join(lines)
+
+
+def _milliseconds(value):
+    return "-" if value is None else "{0:.1f}".format(value)
+
+
+def mann_whitney(baseline, current):
+    """
+    Return the p-value of a one-sided Mann-Whitney U test (normal
+    approximation, corrected for ties) whose alternative hypothesis is that
+    values of <current> tend to be greater than those of <baseline>.
+    """
+    n, m = len(baseline), len(current)
+    if not n or not m:
+        return 1.0
+    values = sorted([(value, 0) for value in baseline] +
+                    [(value, 1) for value in current])
+    rank_sum = 0.0
+    ties = 0.0
+    start = 0
+    while start < len(values):
+        end = start
+        while end + 1 < len(values) and \
+                values[end + 1][0] == values[start][0]:
+            end += 1
+        rank = (start + end) / 2.0 + 1
+        rank_sum += rank * sum(1 for value, group in values[start:end + 1]
+                               if group == 1)
+        tied = end - start + 1
+        ties += tied ** 3 - tied
+        start = end + 1
+    u = rank_sum - m * (m + 1) / 2.0
+    total = n + m
+    variance = n * m / 12.0 * ((total + 1) - ties / (total * (total - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n * m / 2.0) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare(baseline, current, alpha=0.01, threshold=0.1):
+    """
+    Return the list of regressions (messages) of the <current> results in
+    relation to <baseline>: queries whose wall_ms got significantly greater
+    (p-value below <alpha>) with a median more than <threshold> (ratio)
+    greater, and queries whose error rate grew more than 1%.
+    """
+    regressions = []
+    for name, before in sorted(baseline["queries"].items()):
+        after = current["queries"].get(name)
+        if after is None:
+            continue
+        old = before["samples"]["wall_ms"]
+        new = after["samples"]["wall_ms"]
+        if old and new:
+            old_median = _percentile(old, 50)
+            new_median = _percentile(new, 50)
+            p_value = mann_whitney(old, new)
+            if p_value < alpha and \
+                    new_median > old_median * (1 + threshold):
+                regressions.append(
+                    "{0}: median wall time {1:.1f}ms -> {2:.1f}ms "
+                    "(p={3:.2g})".format(name, old_median, new_median,
+                                         p_value))
+        if after["error_rate"] > before["error_rate"] + 0.01:
+            regressions.append("{0}: error rate {1:.1%} -> {2:.1%}".format(
+                name, before["error_rate"], after["error_rate"]))
+    return regressions
+
+
+def _load_class(path):
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m estester.benchmark")
+    commands = parser.add_subparsers(dest="command")
+    # subcommands are optional in Python 3
+    commands.required = True
+    run = commands.add_parser("run", help="run the benchmark of a test case")
+    run.add_argument("test_case", help="dotted path of the test case class")
+    run.add_argument("--concurrency", type=int, default=1)
+    run.add_argument("--duration", type=float)
+    run.add_argument("--iterations", type=int)
+    run.add_argument("--warmup", type=int, default=1)
+    run.add_argument("--output", help="path of the JSON results")
+    diff = commands.add_parser("compare", help="compare two results")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--alpha", type=float, default=0.01)
+    diff.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        results = run_benchmark(_load_class(args.test_case),
+                                concurrency=args.concurrency,
+                                duration=args.duration,
+                                iterations=args.iterations,
+                                warmup=args.warmup)
+        sys.stdout.write(format_results(results) + "\n")
+        if args.output:
+            save_results(results, args.output)
+        return 0
+    regressions = compare(load_results(args.baseline),
+                          load_results(args.current),
+                          args.alpha, args.threshold)
+    for regression in regressions:
+        sys.stdout.write(regression + "\n")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
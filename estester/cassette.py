@@ -0,0 +1,206 @@
+"""
+Cassettes record the HTTP calls made by a test case class to ElasticSearch,
+so later runs can replay them without a cluster:
+
+    class QueryTestCase(ElasticSearchQueryTestCase):
+        cassette = "tests/cassettes/query.json"
+
+A cassette works in one of three modes:
+
+- "record": calls are sent to the backend and their responses are saved
+- "replay": responses are read from the cassette, without network access;
+  calls which were not recorded raise ElasticSearchException
+- "verify": calls are sent to the backend and responses which differ from
+  the recorded ones (ignoring "took") are reported when the class finishes
+
+Calls are keyed by a hash of their method, path (without host) and JSON body,
+normalized so the order of keys does not matter. A call repeated during a run
+(such as searches before and after writing to the index) is answered by its
+recorded responses in the same order. Scroll and point in time ids, which
+change at every run, are ignored by keys and by verify.
+"""
+import collections
+import gzip
+import hashlib
+import json
+import os
+import threading
+
+try:
+    from urllib.parse import urlsplit, parse_qsl, urlencode
+except ImportError:  # Python 2
+    from urlparse import urlsplit, parse_qsl
+    from urllib import urlencode
+
+
+Response = collections.namedtuple("Response", ["status_code", "text"])
+
+MODES = ["record", "replay", "verify"]
+
+# endpoints (last part of the path) whose bodies and responses carry scroll
+# or point in time ids, and the keys holding them
+PAGING_ENDPOINTS = ["_search", "scroll", "_pit"]
+PAGING_IDS = ["_scroll_id", "scroll_id", "pit_id", "id"]
+
+
+def _normalize(text):
+    """
+    Parse <text> as JSON (or NDJSON, as sent to _bulk), returning it as is
+    when it is not JSON.
+    """
+    if not text:
+        return None
+    if isinstance(text, bytes) and not isinstance(text, str):
+        text = text.decode("utf-8")
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return [json.loads(line) for line in text.split("\n") if line]
+    except ValueError:
+        return text
+
+
+def _without_took(value):
+    if isinstance(value, dict):
+        return dict((key, _without_took(item)) for key, item in value.items()
+                    if key != "took")
+    if isinstance(value, list):
+        return [_without_took(item) for item in value]
+    return value
+
+
+def _without_ids(line, value):
+    """
+    Replace the scroll and point in time ids of <value>, the body or
+    response of the call <line> (read request_line), by a placeholder.
+    """
+    path = line.split(" ", 1)[1].split("?", 1)[0]
+    if not isinstance(value, dict) or \
+            path.rsplit("/", 1)[-1] not in PAGING_ENDPOINTS:
+        return value
+    value = dict(value)
+    for key in PAGING_IDS:
+        if key in value:
+            value[key] = "<id>"
+    if isinstance(value.get("pit"), dict):
+        value["pit"] = dict(value["pit"], id="<id>")
+    return value
+
+
+def request_line(method, url, params=None):
+    "Return '<METHOD> <path>?<sorted query string>' for <url>."
+    parts = urlsplit(url)
+    query = sorted(parse_qsl(parts.query) + sorted((params or {}).items()))
+    path = "/" + "/".join(part for part in parts.path.split("/") if part)
+    if query:
+        path += "?" + urlencode(query)
+    return "{0} {1}".format(method.upper(), path)
+
+
+def request_key(method, url, data=None, params=None):
+    """
+    Return the hash identifying a call in cassettes, which ignores the host,
+    the order of query string parameters, the formatting of JSON bodies and
+    their scroll and point in time ids.
+    """
+    line = request_line(method, url, params)
+    payload = json.dumps([line, _without_ids(line, _normalize(data))],
+                         sort_keys=True)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class Cassette(object):
+    """
+    Transport (with the request method of requests.Session) which records,
+    replays or verifies the calls sent to <transport>, according to <mode>.
+    Cassettes are stored in <path> as JSON, compressed with gzip if <path>
+    ends with ".gz".
+    """
+
+    def __init__(self, path, mode, transport):
+        if mode not in MODES:
+            raise ValueError("Unknown cassette mode: {0}".format(mode))
+        self.path = path
+        self.mode = mode
+        self.transport = transport
+        self.interactions = self.load() if mode != "record" else {}
+        self.recorded = {}
+        self.positions = {}
+        self.drifts = []
+        self.lock = threading.Lock()
+
+    def load(self):
+        "Return the interactions saved in the cassette file."
+        if not os.path.exists(self.path):
+            return {}
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "rb") as cassette:
+            return json.loads(cassette.read().decode("utf-8"))
+
+    def save(self):
+        """
+        Write the interactions recorded by this cassette to its file, keeping
+        the ones recorded by other runs (or classes) it did not repeat.
+        """
+        if self.mode != "record":
+            return
+        interactions = self.load()
+        interactions.update(self.recorded)
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        content = json.dumps(interactions, sort_keys=True,
+                             separators=(",", ":"))
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with opener(self.path, "wb") as cassette:
+            cassette.write(content.encode("utf-8"))
+
+    def request(self, method, url, data=None, params=None, **kwargs):
+        key = request_key(method, url, data, params)
+        with self.lock:
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+        if self.mode == "replay":
+            return self._replay(key, position, method, url, params)
+        response = self.transport.request(method, url, data=data,
+                                          params=params, **kwargs)
+        with self.lock:
+            if self.mode == "record":
+                interaction = self.recorded.setdefault(key, {
+                    "request": request_line(method, url, params),
+                    "responses": []
+                })
+                interaction["responses"].append(
+                    [response.status_code, response.text])
+            else:
+                self._verify(key, position, method, url, params, response)
+        return response
+
+    def _replay(self, key, position, method, url, params):
+        interaction = self.interactions.get(key)
+        if interaction is None:
+            from estester import ElasticSearchException
+            raise ElasticSearchException(
+                "Request not recorded in cassette {0}: {1}".format(
+                    self.path, request_line(method, url, params)))
+        responses = interaction["responses"]
+        status_code, text = responses[min(position, len(responses) - 1)]
+        return Response(status_code, text)
+
+    def _verify(self, key, position, method, url, params, response):
+        line = request_line(method, url, params)
+        interaction = self.interactions.get(key)
+        if interaction is None:
+            self.drifts.append("{0}: not recorded".format(line))
+            return
+        responses = interaction["responses"]
+        status_code, text = responses[min(position, len(responses) - 1)]
+        expected = _without_took(_without_ids(line, _normalize(text)))
+        found = _without_took(_without_ids(line, _normalize(response.text)))
+        if status_code != response.status_code or expected != found:
+            self.drifts.append(
+                "{0}: recorded {1} {2}, got {3} {4}".format(
+                    line, status_code, text, response.status_code,
+                    response.text))
@@ -0,0 +1,1042 @@
+"""
+In-memory ElasticSearch backend, which allows running query tests without
+an ElasticSearch node:
+
+    class QueryTestCase(ElasticSearchQueryTestCase):
+        backend = "memory"
+
+It understands the HTTP calls made by ESTester test cases and keeps an
+inverted index of the fields of every document. Supported:
+
+- indexes: create (with mappings and settings), delete, refresh, flush,
+  _settings, _mapping and _clone
+- documents: _bulk (index action), index, get, _mget and delete
+- aliases: _aliases (add and remove actions) and get
+- _analyze with the standard, whitespace and keyword analyzers, of a text
+  or a list of texts
+- _search, _msearch and _count over indexes, aliases, comma-separated
+  lists and wildcards (including -exclusions), with from, size, sort and
+  scroll (point in time is not supported)
+- queries: match_all, match, multi_match, query_string (plain terms and
+  default_operator only), term, terms, prefix, range, exists, ids, bool
+  (must, should, must_not, filter and minimum_should_match, as an integer
+  or a percentage), filtered and constant_score
+
+Field analyzers come from mappings: "analyzer" (standard, whitespace or
+keyword), "index": "not_analyzed" or "type": "keyword"; other strings use
+the standard analyzer, which does not remove stop words. Scores are a
+simplified TF-IDF, so only the relative order of very different matches is
+meaningful. Anything else (such as aggregations or profile) is answered with
+an error, so tests relying on it fail instead of passing by accident.
+"""
+import copy
+import fnmatch
+import json
+import math
+import re
+import threading
+from collections import OrderedDict
+
+try:
+    from urllib.parse import urlsplit, parse_qsl, unquote_plus
+except ImportError:  # Python 2
+    from urlparse import urlsplit, parse_qsl
+    from urllib import unquote_plus
+
+try:
+    string_types = basestring
+except NameError:  # Python 3
+    string_types = str
+
+
+_clusters = {}
+_clusters_lock = threading.Lock()
+
+STANDARD_TOKEN = re.compile(r"\w+(?:['.]\w+)*", re.UNICODE)
+WHITESPACE_TOKEN = re.compile(r"\S+", re.UNICODE)
+
+
+def get_cluster(host):
+    """
+    Return the MemoryElasticSearch which stands for <host>, shared by every
+    test case of the process.
+    """
+    with _clusters_lock:
+        if host not in _clusters:
+            _clusters[host] = MemoryElasticSearch()
+        return _clusters[host]
+
+
+def analyze(text, analyzer="standard"):
+    """
+    Return the list of tokens (dicts in the format of ElasticSearch's
+    _analyze response) of <text> according to <analyzer>.
+    """
+    if analyzer in ["standard", "default"]:
+        matches = STANDARD_TOKEN.finditer(text)
+        lower = True
+    elif analyzer == "whitespace":
+        matches = WHITESPACE_TOKEN.finditer(text)
+        lower = False
+    elif analyzer == "keyword":
+        return [{
+            "token": text,
+            "start_offset": 0,
+            "end_offset": len(text),
+            "type": "word",
+            "position": 1
+        }]
+    else:
+        raise MemoryBackendError(
+            400, "ElasticsearchIllegalArgumentException"
+            "[failed to find analyzer [{0}]]".format(analyzer))
+    tokens = []
+    for position, match in enumerate(matches):
+        token = match.group()
+        if lower:
+            token_type = "<NUM>" if token.isdigit() else "<ALPHANUM>"
+            token = token.lower()
+        else:
+            token_type = "word"
+        tokens.append({
+            "token": token,
+            "start_offset": match.start(),
+            "end_offset": match.end(),
+            "type": token_type,
+            "position": position + 1
+        })
+    return tokens
+
+
+class MemoryBackendError(Exception):
+    """
+    Error answered by MemoryElasticSearch with <status> and <message>.
+    """
+
+    def __init__(self, status, message):
+        super(MemoryBackendError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class MemoryResponse(object):
+    """
+    Response of MemoryElasticSearch, with the same status_code and text
+    attributes used from requests.Response.
+    """
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        if isinstance(body, string_types):
+            self.text = body
+        else:
+            self.text = json.dumps(body)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def _error_body(status, message):
+    # same format (and key order) of ElasticSearch 1.x errors
+    body = OrderedDict([("error", message), ("status", status)])
+    return json.dumps(body, separators=(",", ":"))
+
+
+def _term(value):
+    "Normalize a non-analyzed value, so it can be found by term queries."
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return value
+
+
+def _flatten(source, prefix=""):
+    """
+    Return a dict mapping the dotted path of every field of <source> to the
+    list of its (non null) values.
+    """
+    fields = {}
+    for key, value in source.items():
+        path = prefix + key
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if isinstance(item, dict):
+                for sub_path, sub_values in _flatten(item, path + ".").items():
+                    fields.setdefault(sub_path, []).extend(sub_values)
+            elif item is not None:
+                fields.setdefault(path, []).append(item)
+    return fields
+
+
+def _number(value):
+    "Return <value> as a number, if possible, or None."
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _compare_key(value):
+    "Key which allows comparing numbers and strings, as range queries do."
+    number = _number(value)
+    if number is not None:
+        return (0, number)
+    return (1, value)
+
+
+class MemoryIndex(object):
+    """
+    In-memory ElasticSearch index, which keeps an inverted index of the
+    fields of its documents.
+    """
+
+    def __init__(self, name, mappings=None, settings=None):
+        self.name = name
+        self.mappings = mappings or {}
+        self.settings = {}
+        self.update_settings(settings or {})
+        self.analyzers = {}
+        for properties in self._mapping_properties():
+            self._read_analyzers(properties, "")
+        self.documents = OrderedDict()
+        self.postings = {}
+        self.sequence = 0
+
+    def _mapping_properties(self):
+        # ElasticSearch 7 mappings have no types
+        if "properties" in self.mappings:
+            return [self.mappings["properties"]]
+        return [mapping.get("properties", {})
+                for mapping in self.mappings.values()
+                if isinstance(mapping, dict)]
+
+    def _read_analyzers(self, properties, prefix):
+        for field, mapping in properties.items():
+            path = prefix + field
+            if "properties" in mapping:
+                self._read_analyzers(mapping["properties"], path + ".")
+            elif mapping.get("type") == "keyword" or \
+                    mapping.get("index") == "not_analyzed":
+                self.analyzers[path] = "keyword"
+            elif "analyzer" in mapping:
+                self.analyzers[path] = mapping["analyzer"]
+
+    def update_settings(self, settings, prefix=""):
+        """
+        Merge <settings> (nested or dotted) into the index settings, which
+        are kept flat. None values remove settings.
+        """
+        for key, value in settings.items():
+            key = prefix + key
+            if isinstance(value, dict):
+                self.update_settings(value, key + ".")
+                continue
+            if not key.startswith("index."):
+                key = "index." + key
+            if value is None:
+                self.settings.pop(key, None)
+            else:
+                self.settings[key] = value
+
+    def nested_settings(self):
+        "Return settings as nested dicts of strings, like ElasticSearch."
+        nested = {}
+        for key, value in self.settings.items():
+            parts = key.split(".")
+            current = nested
+            for part in parts[:-1]:
+                current = current.setdefault(part, {})
+            if isinstance(value, bool):
+                value = "true" if value else "false"
+            current[parts[-1]] = str(value)
+        return nested
+
+    def check_writable(self):
+        if self.settings.get("index.blocks.write") in [True, "true"]:
+            raise MemoryBackendError(
+                403, "ClusterBlockException[blocked by: "
+                "[FORBIDDEN/8/index write (api)];]")
+
+    def terms(self, field, value):
+        "Return the terms <value> of <field> is indexed as."
+        if isinstance(value, string_types):
+            analyzer = self.analyzers.get(field, "standard")
+            return [token["token"] for token in analyze(value, analyzer)]
+        return [_term(value)]
+
+    def index(self, doc_type, doc_id, source):
+        """
+        Index a document, returning a tuple containing its version and if it
+        was created (False when it was updated).
+        """
+        self.check_writable()
+        key = (doc_type, doc_id)
+        previous = self.documents.get(key)
+        if previous is not None:
+            self._remove_postings(key, previous["_source"])
+            version = previous["_version"] + 1
+            sequence = previous["sequence"]
+        else:
+            version = 1
+            self.sequence += 1
+            sequence = self.sequence
+        self.documents[key] = {
+            "_source": source,
+            "_version": version,
+            "sequence": sequence
+        }
+        for field, values in _flatten(source).items():
+            field_postings = self.postings.setdefault(field, {})
+            for value in values:
+                for term in self.terms(field, value):
+                    docs = field_postings.setdefault(term, {})
+                    docs[key] = docs.get(key, 0) + 1
+        return version, previous is None
+
+    def delete(self, doc_type, doc_id):
+        self.check_writable()
+        key = (doc_type, doc_id)
+        document = self.documents.pop(key, None)
+        if document is not None:
+            self._remove_postings(key, document["_source"])
+        return document
+
+    def _remove_postings(self, key, source):
+        for field, values in _flatten(source).items():
+            field_postings = self.postings.get(field, {})
+            for value in values:
+                for term in self.terms(field, value):
+                    docs = field_postings.get(term, {})
+                    docs.pop(key, None)
+                    if not docs:
+                        field_postings.pop(term, None)
+
+    def copy(self, name):
+        clone = copy.deepcopy(self)
+        clone.name = name
+        return clone
+
+    # queries
+
+    def search(self, query):
+        """
+        Return a dict mapping the key of every document matching <query>
+        (dict in ElasticSearch's query DSL) to its score.
+        """
+        if not isinstance(query, dict) or len(query) != 1:
+            raise MemoryBackendError(
+                400, "QueryParsingException[[{0}] Failed to "
+                "parse query [{1}]]".format(self.name, json.dumps(query)))
+        query_type, params = list(query.items())[0]
+        method = getattr(self, "_query_" + query_type, None)
+        if method is None:
+            raise MemoryBackendError(
+                400, "QueryParsingException[[{0}] No query "
+                "registered for [{1}]]".format(self.name, query_type))
+        return method(params)
+
+    def _field_params(self, params, value_key):
+        """
+        Return (field, value, options) from query parameters in either the
+        {field: value} or {field: {value_key: value, ...}} format.
+        """
+        options = dict(params)
+        options.pop("boost", None)
+        field, value = list(options.items())[0]
+        if isinstance(value, dict):
+            return field, value.get(value_key), value
+        return field, value, {}
+
+    def _fields(self, field):
+        if field in ["_all", "*"]:
+            return list(self.postings)
+        return fnmatch.filter(list(self.postings), field)
+
+    def _idf(self, docs):
+        return 1.0 + math.log(float(len(self.documents)) / (len(docs) + 1))
+
+    def _score_term(self, field, term):
+        docs = self.postings.get(field, {}).get(term, {})
+        idf = self._idf(docs)
+        return dict((key, math.sqrt(freq) * idf) for key, freq in docs.items())
+
+    def _query_match_all(self, params):
+        return dict((key, 1.0) for key in self.documents)
+
+    def _query_term(self, params):
+        field, value, options = self._field_params(params, "value")
+        scores = {}
+        for name in self._fields(field):
+            self._add(scores, self._score_term(name, _term(value)))
+        return scores
+
+    def _query_terms(self, params):
+        options = dict(params)
+        for ignored in ["boost", "minimum_should_match", "execution"]:
+            options.pop(ignored, None)
+        field, values = list(options.items())[0]
+        scores = {}
+        for value in values:
+            self._add(scores, self._query_term({field: value}))
+        return dict((key, 1.0) for key in scores)
+
+    def _query_prefix(self, params):
+        field, value, options = self._field_params(params, "value")
+        scores = {}
+        for name in self._fields(field):
+            for term in self.postings.get(name, {}):
+                if isinstance(term, string_types) and term.startswith(value):
+                    self._add(scores, self._score_term(name, term))
+        return dict((key, 1.0) for key in scores)
+
+    def _query_match(self, params):
+        field, value, options = self._field_params(params, "query")
+        operator = options.get("operator", "or").lower()
+        return self._match_fields(self._fields(field), value, operator)
+
+    def _query_multi_match(self, params):
+        fields = []
+        for field in params.get("fields", ["_all"]):
+            fields.extend(self._fields(field.split("^")[0]))
+        operator = params.get("operator", "or").lower()
+        return self._match_fields(fields, params["query"], operator)
+
+    def _query_query_string(self, params):
+        fields = params.get("fields") or [params.get("default_field", "_all")]
+        names = []
+        for field in fields:
+            names.extend(self._fields(field.split("^")[0]))
+        operator = params.get("default_operator", "or").lower()
+        return self._match_fields(names, params["query"], operator)
+
+    def _match_fields(self, fields, value, operator):
+        """
+        Match <value> on each of <fields>, keeping the best score of each
+        document (as best_fields multi_match queries do).
+        """
+        scores = {}
+        for field in fields:
+            for key, score in self._match(field, value, operator).items():
+                scores[key] = max(score, scores.get(key, 0))
+        return scores
+
+    def _match(self, field, value, operator):
+        terms = self.terms(field, value)
+        number = _number(value) if isinstance(value, string_types) else None
+        scores = {}
+        matched = {}
+        for term in terms:
+            term_scores = self._score_term(field, term)
+            if not term_scores and number is not None:
+                term_scores = self._score_term(field, number)
+            self._add(scores, term_scores)
+            for key in term_scores:
+                matched[key] = matched.get(key, 0) + 1
+        if operator == "and":
+            return dict((key, score) for key, score in scores.items()
+                        if matched[key] == len(terms))
+        return scores
+
+    def _query_range(self, params):
+        bounds = dict(params)
+        bounds.pop("boost", None)
+        field, bounds = list(bounds.items())[0]
+        checks = []
+        for name, test in [("gt", lambda a, b: a > b),
+                           ("gte", lambda a, b: a >= b),
+                           ("from", lambda a, b: a >= b),
+                           ("lt", lambda a, b: a < b),
+                           ("lte", lambda a, b: a <= b),
+                           ("to", lambda a, b: a <= b)]:
+            if bounds.get(name) is not None:
+                checks.append((test, _compare_key(bounds[name])))
+        scores = {}
+        for key, document in self.documents.items():
+            values = _flatten(document["_source"]).get(field, [])
+            for value in values:
+                value = _compare_key(value)
+                if all(test(value, bound) for test, bound in checks):
+                    scores[key] = 1.0
+                    break
+        return scores
+
+    def _query_exists(self, params):
+        field = params["field"]
+        return dict((key, 1.0) for key, document in self.documents.items()
+                    if _flatten(document["_source"]).get(field))
+
+    def _query_ids(self, params):
+        ids = set(params.get("values", []))
+        types = params.get("type", params.get("types"))
+        if isinstance(types, string_types):
+            types = [types]
+        return dict((key, 1.0) for key in self.documents
+                    if key[1] in ids and (not types or key[0] in types))
+
+    def _query_constant_score(self, params):
+        query = params.get("filter", params.get("query"))
+        boost = params.get("boost", 1.0)
+        return dict((key, boost) for key in self.search(query))
+
+    def _query_filtered(self, params):
+        scores = self.search(params.get("query", {"match_all": {}}))
+        if "filter" in params:
+            matching = self.search(params["filter"])
+            scores = dict((key, score) for key, score in scores.items()
+                          if key in matching)
+        return scores
+
+    def _query_bool(self, params):
+        def clauses(name):
+            value = params.get(name, [])
+            return value if isinstance(value, list) else [value]
+
+        must = clauses("must")
+        filters = clauses("filter")
+        should = clauses("should")
+        scores = None
+        for clause in must + filters:
+            clause_scores = self.search(clause)
+            if clause not in must:
+                clause_scores = dict((key, 0.0) for key in clause_scores)
+            if scores is None:
+                scores = clause_scores
+            else:
+                scores = dict((key, score + clause_scores[key])
+                              for key, score in scores.items()
+                              if key in clause_scores)
+        if scores is None and not should:
+            scores = self._query_match_all({})
+        minimum = params.get("minimum_should_match")
+        if minimum is None:
+            minimum = 0 if must or filters else 1
+        else:
+            minimum = self._minimum_should_match(minimum, len(should))
+        if should:
+            matched = {}
+            should_scores = {}
+            for clause in should:
+                for key, score in self.search(clause).items():
+                    matched[key] = matched.get(key, 0) + 1
+                    should_scores[key] = should_scores.get(key, 0) + score
+            if scores is None:
+                scores = dict((key, 0.0) for key in should_scores)
+            scores = dict((key, score + should_scores.get(key, 0))
+                          for key, score in scores.items()
+                          if matched.get(key, 0) >= minimum)
+        for clause in clauses("must_not"):
+            for key in self.search(clause):
+                scores.pop(key, None)
+        return scores
+
+    def _minimum_should_match(self, value, total):
+        """
+        Return the number of the <total> should clauses which must match
+        according to minimum_should_match <value>: an integer, a
+        percentage ("75%") or their negative forms (-1 or "-25%"), as
+        computed by ElasticSearch. Combinations (such as "3<90%") are not
+        supported.
+        """
+        text = str(value).strip()
+        match = re.match(r"^(-?)(\d+)(%?)$", text)
+        if match is None:
+            raise MemoryBackendError(
+                400, "QueryParsingException[[{0}] minimum_should_match "
+                "[{1}] is not supported by the memory backend]".format(
+                    self.name, text))
+        negative, number, percent = match.groups()
+        number = int(number)
+        if percent:
+            number = int(total * number / 100.0)
+        if negative:
+            number = total - number
+        return max(number, 0)
+
+    def _add(self, scores, other):
+        for key, score in other.items():
+            scores[key] = scores.get(key, 0) + score
+
+
+class MemoryElasticSearch(object):
+    """
+    In-memory ElasticSearch cluster, answering HTTP calls through request,
+    which has the same signature as requests.Session.request.
+    """
+
+    def __init__(self):
+        self.indexes = OrderedDict()
+        self.aliases = {}
+        self.scrolls = {}
+        self.scroll_count = 0
+        self.lock = threading.RLock()
+
+    def request(self, method, url, data=None, params=None, **kwargs):
+        """
+        Answer the HTTP <method> call to <url>, returning a MemoryResponse.
+        """
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query))
+        query.update(params or {})
+        path = [unquote_plus(part) for part in parts.path.split("/") if part]
+        method = method.upper()
+        try:
+            with self.lock:
+                status, body = self._route(method, path, data, query)
+        except MemoryBackendError as error:
+            return MemoryResponse(error.status,
+                                  _error_body(error.status, error.message))
+        if method == "HEAD":
+            body = ""
+        return MemoryResponse(status, body)
+
+    def _route(self, method, path, data, query):
+        if not path:
+            return 200, {"status": 200, "version": {"number": "memory"}}
+        endpoint = [part for part in path if part.startswith("_")]
+        names = [part for part in path if not part.startswith("_")]
+        if path[0] == "_cluster":
+            return 200, {"status": "green", "timed_out": False}
+        if path[-2:] == ["_search", "scroll"]:
+            return self._scroll(method, data)
+        if endpoint and endpoint[0] in self.ENDPOINTS:
+            handler = getattr(self, self.ENDPOINTS[endpoint[0]])
+            return handler(method, names, data, query)
+        if not endpoint and len(names) == 1:
+            return self._index_endpoint(method, names[0], data)
+        if not endpoint and len(names) == 3:
+            return self._document_endpoint(method, names, data)
+        raise MemoryBackendError(
+            400, "No handler found for uri [/{0}] and method "
+            "[{1}]".format("/".join(path), method))
+
+    ENDPOINTS = {
+        "_bulk": "_bulk",
+        "_refresh": "_refresh",
+        "_flush": "_refresh",
+        "_aliases": "_aliases_endpoint",
+        "_search": "_search",
+        "_msearch": "_msearch",
+        "_mget": "_mget",
+        "_pit": "_pit",
+        "_count": "_count",
+        "_analyze": "_analyze",
+        "_settings": "_settings",
+        "_mapping": "_mapping",
+        "_clone": "_clone"
+    }
+
+    def _missing(self, name):
+        return MemoryBackendError(
+            404, "IndexMissingException[[{0}] missing]".format(name))
+
+    def _get_index(self, name):
+        names = self.aliases.get(name, [name])
+        if len(names) != 1 or names[0] not in self.indexes:
+            raise self._missing(name)
+        return self.indexes[names[0]]
+
+    def resolve(self, expression):
+        """
+        Return the names of the indexes matched by <expression>: index or
+        alias names, wildcards and -exclusions, separated by commas.
+        """
+        if expression in ["", "_all"]:
+            return list(self.indexes)
+        names = []
+        for part in expression.split(","):
+            if part.startswith("-"):
+                excluded = self._expand(part[1:], missing_ok=True)
+                names = [name for name in names if name not in excluded]
+            else:
+                for name in self._expand(part.lstrip("+")):
+                    if name not in names:
+                        names.append(name)
+        return names
+
+    def _expand(self, pattern, missing_ok=False):
+        if "*" in pattern:
+            indexes = fnmatch.filter(list(self.indexes), pattern)
+            for alias in fnmatch.filter(list(self.aliases), pattern):
+                indexes.extend(self.aliases[alias])
+            return indexes
+        if pattern in self.aliases:
+            return list(self.aliases[pattern])
+        if pattern not in self.indexes and not missing_ok:
+            raise self._missing(pattern)
+        return [pattern] if pattern in self.indexes else []
+
+    def _body(self, data, default=None):
+        if not data:
+            return {} if default is None else default
+        if isinstance(data, bytes) and not isinstance(data, str):
+            data = data.decode("utf-8")
+        return json.loads(data)
+
+    # indexes
+
+    def _index_endpoint(self, method, name, data):
+        if method in ["HEAD", "GET"]:
+            index = self._get_index(name)
+            return 200, {name: {"settings": index.nested_settings()}}
+        if method == "DELETE":
+            if name not in self.indexes:
+                raise self._missing(name)
+            del self.indexes[name]
+            for alias, names in list(self.aliases.items()):
+                if name in names:
+                    names.remove(name)
+                if not names:
+                    del self.aliases[alias]
+            return 200, {"acknowledged": True}
+        if method in ["PUT", "POST"]:
+            if name in self.indexes:
+                raise MemoryBackendError(
+                    400, "IndexAlreadyExistsException[[{0}] "
+                    "already exists]".format(name))
+            body = self._body(data)
+            self.indexes[name] = MemoryIndex(name, body.get("mappings"),
+                                             body.get("settings"))
+            return 200, {"acknowledged": True}
+        raise MemoryBackendError(
+            405, "Method [{0}] not allowed".format(method))
+
+    def _create_missing_index(self, name):
+        if name not in self.indexes and name not in self.aliases:
+            self.indexes[name] = MemoryIndex(name)
+        return self._get_index(name)
+
+    def _refresh(self, method, names, data, query):
+        for name in self.resolve(",".join(names)):
+            self._get_index(name)
+        return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    def _settings(self, method, names, data, query):
+        indexes = self.resolve(",".join(names))
+        if method == "PUT":
+            for name in indexes:
+                self.indexes[name].update_settings(self._body(data))
+            return 200, {"acknowledged": True}
+        return 200, dict(
+            (name, {"settings": self.indexes[name].nested_settings()})
+            for name in indexes)
+
+    def _mapping(self, method, names, data, query):
+        return 200, dict(
+            (name, {"mappings": self.indexes[name].mappings})
+            for name in self.resolve(",".join(names[:1])))
+
+    def _clone(self, method, names, data, query):
+        source, target = names
+        if target in self.indexes:
+            raise MemoryBackendError(
+                400, "IndexAlreadyExistsException[[{0}] "
+                "already exists]".format(target))
+        clone = self._get_index(source).copy(target)
+        clone.update_settings(self._body(data).get("settings", {}))
+        self.indexes[target] = clone
+        return 200, {"acknowledged": True, "index": target}
+
+    # documents
+
+    def _document_endpoint(self, method, names, data):
+        name, doc_type, doc_id = names
+        if method in ["PUT", "POST"]:
+            index = self._create_missing_index(name)
+            version, created = index.index(doc_type, doc_id, self._body(data))
+            body = {
+                "_index": name,
+                "_type": doc_type,
+                "_id": doc_id,
+                "_version": version,
+                "created": created
+            }
+            return (201 if created else 200), body
+        index = self._get_index(name)
+        if method == "DELETE":
+            document = index.delete(doc_type, doc_id)
+            body = {"found": document is not None, "_index": name,
+                    "_type": doc_type, "_id": doc_id}
+            return (200 if document else 404), body
+        document = index.documents.get((doc_type, doc_id))
+        body = {"_index": index.name, "_type": doc_type, "_id": doc_id}
+        if document is None:
+            body["found"] = False
+            return 404, body
+        body["_version"] = document["_version"]
+        body["found"] = True
+        body["_source"] = document["_source"]
+        return 200, body
+
+    def _mget(self, method, names, data, query):
+        body = self._body(data)
+        docs = body.get("docs") or [{"_id": doc_id}
+                                    for doc_id in body.get("ids", [])]
+        responses = []
+        for doc in docs:
+            name = doc.get("_index", names[0] if names else None)
+            doc_type = doc.get("_type", names[1] if len(names) > 1 else None)
+            try:
+                index = self._get_index(name)
+            except MemoryBackendError as error:
+                responses.append({"_index": name, "_type": doc_type,
+                                  "_id": doc["_id"], "error": error.message})
+                continue
+            if doc_type is None:
+                types = [key[0] for key in index.documents
+                         if key[1] == doc["_id"]]
+                doc_type = types[0] if types else None
+            status, response = self._document_endpoint(
+                "GET", [index.name, doc_type, doc["_id"]], None)
+            responses.append(response)
+        return 200, {"docs": responses}
+
+    def _bulk(self, method, names, data, query):
+        if isinstance(data, bytes) and not isinstance(data, str):
+            data = data.decode("utf-8")
+        lines = [line for line in (data or "").split("\n") if line.strip()]
+        items = []
+        errors = False
+        position = 0
+        while position < len(lines):
+            action = json.loads(lines[position])
+            action_type, meta = list(action.items())[0]
+            name = meta.get("_index", names[0] if names else None)
+            doc_type = meta.get("_type", names[1] if len(names) > 1 else None)
+            doc_id = meta.get("_id")
+            item = {"_index": name, "_type": doc_type, "_id": doc_id}
+            try:
+                if action_type == "delete":
+                    position += 1
+                    if self._get_index(name).delete(doc_type, doc_id):
+                        item["status"] = 200
+                    else:
+                        item["status"] = 404
+                else:
+                    source = json.loads(lines[position + 1])
+                    position += 2
+                    if action_type not in ["index", "create"]:
+                        raise MemoryBackendError(
+                            400, "Unsupported bulk action "
+                            "[{0}]".format(action_type))
+                    index = self._create_missing_index(name)
+                    version, created = index.index(doc_type, doc_id, source)
+                    item["_version"] = version
+                    item["status"] = 201 if created else 200
+            except MemoryBackendError as error:
+                errors = True
+                item["status"] = error.status
+                item["error"] = error.message
+            items.append({action_type: item})
+        return 200, {"took": 0, "errors": errors, "items": items}
+
+    # aliases
+
+    def _aliases_endpoint(self, method, names, data, query):
+        if method == "GET":
+            return self._get_aliases(names)
+        for action in self._body(data).get("actions", []):
+            action_type, params = list(action.items())[0]
+            name = params["index"]
+            alias = params["alias"]
+            if name not in self.indexes:
+                raise self._missing(name)
+            indexes = self.aliases.setdefault(alias, [])
+            if action_type == "add" and name not in indexes:
+                indexes.append(name)
+            elif action_type == "remove":
+                if name not in indexes:
+                    raise MemoryBackendError(
+                        404, "AliasesMissingException"
+                        "[aliases [[{0}]] missing]".format(alias))
+                indexes.remove(name)
+            if not indexes:
+                del self.aliases[alias]
+        return 200, {"acknowledged": True}
+
+    def _get_aliases(self, names):
+        indexes = self.resolve(",".join(names))
+        body = dict((name, {"aliases": {}}) for name in indexes)
+        for alias, alias_indexes in self.aliases.items():
+            for name in alias_indexes:
+                if name in body:
+                    body[name]["aliases"][alias] = {}
+        return 200, body
+
+    # search
+
+    def _search(self, method, names, data, query):
+        body = self._body(data)
+        for unsupported in ["aggs", "aggregations", "facets", "profile"]:
+            if unsupported in body:
+                raise MemoryBackendError(
+                    400, "SearchParseException[[{0}] is not "
+                    "supported by the memory backend]".format(unsupported))
+        hits = self._matches(names[:1], body)
+        hits = self._sort(hits, body.get("sort"))
+        start = int(body.get("from", query.get("from", 0)))
+        size = int(body.get("size", query.get("size", 10)))
+        response = self._page(hits, hits[start:start + size])
+        if "scroll" in query:
+            self.scroll_count += 1
+            scroll_id = str(self.scroll_count)
+            self.scrolls[scroll_id] = (hits, start + size, size)
+            response["_scroll_id"] = scroll_id
+        return 200, response
+
+    def _page(self, hits, page):
+        """
+        Return the _search response whose <hits> (all of them, as returned
+        by _matches) are listed from <page>.
+        """
+        listed = []
+        for index, key, score in page:
+            document = index.documents[key]
+            listed.append({
+                "_index": index.name,
+                "_type": key[0],
+                "_id": key[1],
+                "_score": score,
+                "_source": document["_source"]
+            })
+        max_score = max([hit[2] for hit in hits] or [None])
+        return {
+            "took": 0,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "failed": 0},
+            "hits": {"total": len(hits), "max_score": max_score,
+                     "hits": listed}
+        }
+
+    def _scroll(self, method, data):
+        body = self._body(data)
+        scroll_ids = body.get("scroll_id", [])
+        if method == "DELETE":
+            if not isinstance(scroll_ids, list):
+                scroll_ids = [scroll_ids]
+            for scroll_id in scroll_ids:
+                self.scrolls.pop(scroll_id, None)
+            return 200, {"succeeded": True}
+        if scroll_ids not in self.scrolls:
+            raise MemoryBackendError(
+                404, "SearchContextMissingException[No search context found]")
+        hits, start, size = self.scrolls[scroll_ids]
+        self.scrolls[scroll_ids] = (hits, start + size, size)
+        response = self._page(hits, hits[start:start + size])
+        response["_scroll_id"] = scroll_ids
+        return 200, response
+
+    def _pit(self, method, names, data, query):
+        raise MemoryBackendError(
+            400, "point in time is not supported by the memory backend")
+
+    def _msearch(self, method, names, data, query):
+        if isinstance(data, bytes) and not isinstance(data, str):
+            data = data.decode("utf-8")
+        lines = [line for line in (data or "").split("\n") if line.strip()]
+        responses = []
+        for position in range(0, len(lines), 2):
+            header = json.loads(lines[position])
+            index = header.get("index", names[0] if names else "")
+            if isinstance(index, list):
+                index = ",".join(index)
+            try:
+                status, body = self._search(method, [index] if index else [],
+                                            lines[position + 1], query)
+            except MemoryBackendError as error:
+                body = {"error": error.message, "status": error.status}
+            responses.append(body)
+        return 200, {"responses": responses}
+
+    def _count(self, method, names, data, query):
+        hits = self._matches(names[:1], self._body(data))
+        return 200, {
+            "count": len(hits),
+            "_shards": {"total": 1, "successful": 1, "failed": 0}
+        }
+
+    def _matches(self, names, body):
+        """
+        Return a list of (index, key, score) tuples of documents in the
+        indexes named by <names> which match the query of search <body>.
+        """
+        doc_types = names[1].split(",") if len(names) > 1 else None
+        query = body.get("query", {"match_all": {}})
+        post_filter = body.get("post_filter", body.get("filter"))
+        hits = []
+        for name in self.resolve(names[0] if names else ""):
+            index = self.indexes[name]
+            scores = index.search(query)
+            if post_filter is not None:
+                matching = index.search(post_filter)
+                scores = dict((key, score) for key, score in scores.items()
+                              if key in matching)
+            for key, score in scores.items():
+                if doc_types is None or key[0] in doc_types:
+                    hits.append((index, key, float(score)))
+        hits.sort(key=lambda hit: (-hit[2], hit[0].name,
+                                   hit[0].documents[hit[1]]["sequence"]))
+        return hits
+
+    def _sort(self, hits, sort):
+        if not sort:
+            return hits
+        if not isinstance(sort, list):
+            sort = [sort]
+        for spec in reversed(sort):
+            if isinstance(spec, dict):
+                field, options = list(spec.items())[0]
+                if isinstance(options, dict):
+                    order = options.get("order", "asc")
+                else:
+                    order = options
+            else:
+                field = spec
+                order = "desc" if spec == "_score" else "asc"
+            hits = sorted(hits, key=self._sort_key(field),
+                          reverse=(order == "desc"))
+        return hits
+
+    def _sort_key(self, field):
+        def key(hit):
+            index, doc_key, score = hit
+            if field == "_score":
+                return (0, score)
+            values = _flatten(index.documents[doc_key]["_source"]).get(field)
+            if not values:
+                return (1, None)
+            return (0, _compare_key(values[0]))
+        return key
+
+    def _analyze(self, method, names, data, query):
+        if isinstance(data, bytes) and not isinstance(data, str):
+            data = data.decode("utf-8")
+        text = data or query.get("text", "")
+        analyzer = query.get("analyzer", "standard")
+        try:
+            body = json.loads(text)
+        except ValueError:
+            body = None
+        # ElasticSearch 5+ receives a JSON object, older versions raw text
+        if isinstance(body, dict):
+            text = body.get("text", "")
+            analyzer = body.get("analyzer", analyzer)
+        if names:
+            self._get_index(names[0])
+        if isinstance(text, string_types):
+            return 200, {"tokens": analyze(text, analyzer)}
+        # as ElasticSearch, offsets of the texts of a list are separated by
+        # 1 and positions by 100
+        tokens = []
+        offset = position = 0
+        for item in text:
+            for token in analyze(item, analyzer):
+                token["start_offset"] += offset
+                token["end_offset"] += offset
+                token["position"] += position
+                tokens.append(token)
+            offset += len(item) + 1
+            position = (tokens[-1]["position"] if tokens else 0) + 100
+        return 200, {"tokens": tokens}
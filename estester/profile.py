@@ -0,0 +1,195 @@
+"""
+Parsing of the execution breakdown ElasticSearch returns for searches with
+"profile": true (ElasticSearch 2.2 or later), used by profile_search. Times
+are read from time_in_nanos (ElasticSearch 5 or later) or from the formatted
+time (such as "1.2ms") of earlier versions, whose query type and description
+are named query_type and lucene.
+
+The query and collector trees of every shard are merged into a compact tree
+(nodes with the same type and description under the same parent are added
+up), whose times are in milliseconds:
+
+    profile = self.profile_search({"query": {"wildcard": {"name": "*ox"}}})
+    print(profile.format())
+    profile.query_times  # {"BooleanQuery": 0.2, "TermQuery": 1.3, ...}
+
+Times of nodes include their children's; query_times and collector_times
+add up the self time (excluding children) of each type of query and name of
+collector.
+"""
+import re
+
+
+# milliseconds in each unit of the formatted times of ElasticSearch 2
+TIME_UNITS = {
+    "nanos": 1e-6,
+    "micros": 1e-3,
+    "ms": 1.0,
+    "s": 1e3,
+    "m": 6e4,
+    "h": 3.6e6,
+    "d": 8.64e7
+}
+
+TIME = re.compile(r"^([\d.]+)\s*([a-z]+)$")
+
+
+def _time_ms(node):
+    """
+    Return the time of a query or collector <node> in milliseconds, from
+    time_in_nanos or, in ElasticSearch 2, the formatted time.
+    """
+    if "time_in_nanos" in node:
+        return node["time_in_nanos"] / 1e6
+    match = TIME.match(node["time"].strip())
+    if match is None or match.group(2) not in TIME_UNITS:
+        raise ValueError("Unknown profile time: {0}".format(node["time"]))
+    return float(match.group(1)) * TIME_UNITS[match.group(2)]
+
+
+class ProfileNode(object):
+    "Query or collector of a profile, with its total time in milliseconds."
+
+    def __init__(self, node_type, description, time_ms, children=None):
+        self.type = node_type
+        self.description = description
+        self.time_ms = time_ms
+        self.children = children or []
+
+    @property
+    def self_time_ms(self):
+        "Time spent by the node itself, excluding its children."
+        children = sum(child.time_ms for child in self.children)
+        return max(self.time_ms - children, 0)
+
+    def walk(self):
+        "Yield the node and its descendants, depth first."
+        yield self
+        for child in self.children:
+            for node in child.walk():
+                yield node
+
+    def find(self, pattern):
+        """
+        Yield the topmost nodes whose type matches <pattern> (regular
+        expression), not descending into the children of matching nodes.
+        """
+        if re.search(pattern, self.type):
+            yield self
+            return
+        for child in self.children:
+            for node in child.find(pattern):
+                yield node
+
+    def format(self, total_ms, indent=0):
+        share = 100.0 * self.time_ms / total_ms if total_ms else 0
+        description = self.description
+        if len(description) > 60:
+            description = description[:57] + "..."
+        lines = ["{0}{1} {2:.3f}ms {3:.1f}% {4}".format(
+            "  " * indent, self.type, self.time_ms, share, description)]
+        for child in self.children:
+            lines.append(child.format(total_ms, indent + 1))
+        return "\n".join(lines)
+
+
+def _query_node(node):
+    return ProfileNode(node.get("type", node.get("query_type")),
+                       node.get("description", node.get("lucene", "")),
+                       _time_ms(node),
+                       [_query_node(child)
+                        for child in node.get("children", [])])
+
+
+def _collector_node(node):
+    return ProfileNode(node["name"], node.get("reason", ""), _time_ms(node),
+                       [_collector_node(child)
+                        for child in node.get("children", [])])
+
+
+def _merge(nodes):
+    "Add up <nodes> with the same type and description, recursively."
+    merged = []
+    by_key = {}
+    for node in nodes:
+        key = (node.type, node.description)
+        if key not in by_key:
+            by_key[key] = ProfileNode(node.type, node.description, 0, [])
+            merged.append(by_key[key])
+        by_key[key].time_ms += node.time_ms
+        by_key[key].children.extend(node.children)
+    for node in merged:
+        node.children = _merge(node.children)
+    return merged
+
+
+def _self_times(nodes):
+    times = {}
+    for root in nodes:
+        for node in root.walk():
+            times[node.type] = times.get(node.type, 0) + node.self_time_ms
+    return times
+
+
+class Profile(object):
+    """
+    Profile of a search, parsed from its <response> (JSON), whose "profile"
+    key has the breakdown of every shard.
+    """
+
+    def __init__(self, response):
+        self.response = response
+        queries = []
+        collectors = []
+        self.rewrite_ms = 0.0
+        for shard in response["profile"]["shards"]:
+            for search in shard.get("searches", []):
+                queries.extend(_query_node(node)
+                               for node in search.get("query", []))
+                collectors.extend(_collector_node(node)
+                                  for node in search.get("collector", []))
+                self.rewrite_ms += search.get("rewrite_time", 0) / 1e6
+        self.queries = _merge(queries)
+        self.collectors = _merge(collectors)
+        self.shards = len(response["profile"]["shards"])
+
+    @property
+    def total_ms(self):
+        "Time spent by the queries of all shards (excluding rewrites)."
+        return sum(node.time_ms for node in self.queries)
+
+    @property
+    def query_times(self):
+        "Self time (ms) spent by each type of query, in all shards."
+        return _self_times(self.queries)
+
+    @property
+    def collector_times(self):
+        "Self time (ms) spent by each collector, in all shards."
+        return _self_times(self.collectors)
+
+    def time_share(self, pattern):
+        """
+        Return the percentage of total_ms spent by queries whose type
+        matches <pattern> (regular expression), including their children.
+        """
+        if not self.total_ms:
+            return 0.0
+        spent = sum(node.time_ms for root in self.queries
+                    for node in root.find(pattern))
+        return 100.0 * spent / self.total_ms
+
+    def count(self, pattern):
+        "Return the number of queries whose type matches <pattern>."
+        return sum(1 for root in self.queries for node in root.walk()
+                   if re.search(pattern, node.type))
+
+    def format(self):
+        "Return the query and collector trees as text."
+        lines = ["Query ({0} shards, rewrite {1:.3f}ms)".format(
+            self.shards, self.rewrite_ms)]
+        lines.extend(node.format(self.total_ms, 1) for node in self.queries)
+        lines.append("Collector")
+        total_ms = sum(node.time_ms for node in self.collectors)
+        lines.extend(node.format(total_ms, 1) for node in self.collectors)
+        return "\n".join(lines)
@@ -0,0 +1,330 @@
+"""
+Replay of query logs (such as production slow logs or access logs) against
+the indexes a test case builds, to reproduce a real load on fixture data.
+
+Logs are NDJSON files (optionally compressed with gzip, ".gz") with one
+search per line:
+
+    {"index": "products", "body": {"query": {...}}, "timestamp": 1577836800}
+
+where timestamp is optional, in seconds or an ISO 8601 string (with a "Z" or
+"+hh:mm" offset, or else in UTC). The index is searched with search_in_index
+by MultipleIndexesQueryTestCase subclasses (<indexes> maps logged index names
+to the test case ones) and ignored by ElasticSearchQueryTestCase subclasses,
+which search their index.
+
+Searches are sent as fast as possible or, if <speed> is given, following the
+logged timestamps, <speed> times faster (2 halves the time between two
+searches). At most <window> searches are in flight, each sent by its own
+thread; if all are busy, later searches wait, and their lag (the time they
+were sent after their planned time) is reported. The log is read while it is
+replayed, so its size does not matter.
+
+Searches are grouped by template: their body with every value replaced by
+"?", so queries which only differ by their terms, dates or sizes are
+aggregated together. The report has, per template, the count, error rate
+and percentiles of wall_ms and took_ms. Percentiles are computed from a
+uniform sample of at most SAMPLE_SIZE values per template, so memory use does
+not grow with the size of the log either:
+
+    python -m estester.replay tests.test_catalog.CatalogTestCase \\
+        slowlog.ndjson.gz --speed 2 --window 16 --output replay.json
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+try:
+    from queue import Queue
+except ImportError:  # Python 2
+    from Queue import Queue
+
+from estester import _open_ndjson
+from estester.benchmark import _load_class, prepared, summarize
+
+
+# max number of values kept by Statistics to compute percentiles
+SAMPLE_SIZE = 10000
+
+OFFSET = re.compile(r"^(.*\d)([+-])(\d{2}):?(\d{2})$")
+
+
+def template(body):
+    """
+    Return <body> (JSON) with every value replaced by "?" (lists of values
+    by ["?"]), as JSON with sorted keys.
+    """
+    def strip(value):
+        if isinstance(value, dict):
+            return dict((key, strip(item)) for key, item in value.items())
+        if isinstance(value, list):
+            items = [strip(item) for item in value]
+            if all(item == "?" for item in items):
+                return ["?"] if items else []
+            return items
+        return "?"
+    return json.dumps(strip(body), sort_keys=True)
+
+
+def _seconds(timestamp):
+    """
+    Return <timestamp> (seconds or ISO 8601 string, such as
+    "2020-01-01T10:00:00.5+02:00") in seconds.
+    """
+    if timestamp is None or isinstance(timestamp, (int, float)):
+        return timestamp
+    text = timestamp.strip().replace(",", ".")
+    offset = 0
+    if text.endswith("Z"):
+        text = text[:-1]
+    else:
+        match = OFFSET.match(text)
+        if match is not None:
+            text, sign, hours, minutes = match.groups()
+            offset = (int(hours) * 3600 + int(minutes) * 60) * \
+                (-1 if sign == "-" else 1)
+    date_format = "%Y-%m-%dT%H:%M:%S" if "T" in text else "%Y-%m-%d %H:%M:%S"
+    if "." in text:
+        date_format += ".%f"
+    try:
+        date = datetime.datetime.strptime(text, date_format)
+    except ValueError:
+        raise ValueError("Unsupported timestamp {0!r}: expected seconds or "
+                         "ISO 8601, such as 2020-01-01T10:00:00+02:00".format(
+                             timestamp))
+    delta = date - datetime.datetime(1970, 1, 1)
+    return delta.days * 86400 + delta.seconds + \
+        delta.microseconds / 1e6 - offset
+
+
+def read_log(path):
+    "Yield the (index, body, timestamp in seconds) of each line of <path>."
+    with _open_ndjson(path) as log:
+        for line in log:
+            if not line.strip():
+                continue
+            entry = json.loads(line.decode("utf-8"))
+            yield (entry.get("index"), entry.get("body") or {},
+                   _seconds(entry.get("timestamp")))
+
+
+class Statistics(object):
+    """
+    Count, total and max of values added one at a time, and a uniform sample
+    of at most <size> of them (reservoir sampling) to compute percentiles,
+    so memory use does not grow with the number of values.
+    """
+
+    def __init__(self, size=SAMPLE_SIZE, seed=0):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+        self.sample = []
+        self.rng = random.Random(seed)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+        if len(self.sample) < self.size:
+            self.sample.append(value)
+        else:
+            position = int(self.rng.random() * self.count)
+            if position < self.size:
+                self.sample[position] = value
+
+    def summary(self):
+        """
+        Return the percentiles (estimated from the sample), mean and max of
+        the values, as summarize does, or None if there are none.
+        """
+        if not self.count:
+            return None
+        summary = summarize(self.sample)
+        summary["mean"] = self.total / self.count
+        summary["max"] = self.max
+        return summary
+
+
+class Report(object):
+    "Thread-safe aggregates of the replayed searches, by template."
+
+    def __init__(self):
+        self.templates = {}
+        self.lags = Statistics()
+        self.started = self.finished = None
+        self.lock = threading.Lock()
+
+    def add(self, body, lag, wall_ms, response=None, error=None):
+        if error is None and "error" in response:
+            error = response["error"]
+        text = template(body)
+        with self.lock:
+            item = self.templates.get(text)
+            if item is None:
+                item = self.templates[text] = {
+                    "wall_ms": Statistics(),
+                    "took_ms": Statistics(),
+                    "errors": 0
+                }
+            item["wall_ms"].add(wall_ms)
+            self.lags.add(lag * 1000)
+            if error is not None:
+                item["errors"] += 1
+            elif response.get("took") is not None:
+                item["took_ms"].add(response["took"])
+
+    def results(self):
+        elapsed = (self.finished or 0) - (self.started or 0)
+        templates = {}
+        for text, item in self.templates.items():
+            count = item["wall_ms"].count
+            digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:10]
+            templates[digest] = {
+                "template": text,
+                "count": count,
+                "errors": item["errors"],
+                "error_rate": item["errors"] / float(count),
+                "total_ms": item["wall_ms"].total,
+                "wall_ms": item["wall_ms"].summary(),
+                "took_ms": item["took_ms"].summary()
+            }
+        count = self.lags.count
+        return {
+            "searches": count,
+            "elapsed_s": elapsed,
+            "throughput": count / elapsed if elapsed else 0.0,
+            "lag_ms": self.lags.summary(),
+            "templates": templates
+        }
+
+
+def _search(test_case, index, body):
+    if index and hasattr(test_case, "search_in_index"):
+        return test_case.search_in_index(index, body)
+    return test_case.search(body)
+
+
+def _worker(test_case, queue, report):
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+        index, body, planned = item
+        started = time.time()
+        lag = max(started - planned, 0)
+        try:
+            response = _search(test_case, index, body)
+        except Exception as error:
+            report.add(body, lag, (time.time() - started) * 1000,
+                       error=str(error))
+        else:
+            report.add(body, lag, (time.time() - started) * 1000, response)
+
+
+def replay(test_case_class, path, speed=None, window=8, indexes=None):
+    """
+    Set up the indexes of <test_case_class>, replay the query log at <path>
+    against them and clear them up. Read estester.replay for more
+    information.
+
+    Returns the report (a JSON-serializable dict).
+    """
+    test_case = test_case_class("run")
+    test_case.record_timings = False
+    queue = Queue(window)
+    report = Report()
+    indexes = indexes or {}
+    with prepared(test_case):
+        workers = [threading.Thread(target=_worker,
+                                    args=(test_case, queue, report))
+                   for i in range(window)]
+        for worker in workers:
+            worker.start()
+        report.started = time.time()
+        try:
+            start = first = None
+            for index, body, timestamp in read_log(path):
+                planned = time.time()
+                if speed and timestamp is not None:
+                    if first is None:
+                        start, first = planned, timestamp
+                    planned = start + (timestamp - first) / float(speed)
+                    delay = planned - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                queue.put((indexes.get(index, index), body, planned))
+        finally:
+            for worker in workers:
+                queue.put(None)
+            for worker in workers:
+                worker.join()
+            report.finished = time.time()
+    results = report.results()
+    results["test_case"] = "{0}.{1}".format(test_case_class.__module__,
+                                            test_case_class.__name__)
+    return results
+
+
+def format_report(results):
+    "Return the <results> of a replay as a text table, slowest first."
+    lag = results["lag_ms"] or {}
+    lines = ["{0}: {1} searches in {2:.1f}s ({3:.1f}/s), "
+             "lag p95 {4:.1f}ms".format(
+                 results["test_case"], results["searches"],
+                 results["elapsed_s"], results["throughput"],
+                 lag.get("p95", 0))]
+    header = "{0:<10} {1:>7} {2:>7} {3:>9} {4:>9} {5:>9} {6:>9}  {7}"
+    lines.append(header.format("template", "count", "errors", "wall p50",
+                               "wall p95", "wall p99", "took p95",
+                               "body"))
+    row = "{0:<10} {1:>7} {2:>6.1%} {3:>9.1f} {4:>9.1f} {5:>9.1f} {6:>9}  {7}"
+    templates = sorted(results["templates"].items(),
+                       key=lambda item: -item[1]["total_ms"])
+    for digest, item in templates:
+        took = item["took_ms"] or {}
+        body = item["template"]
+        if len(body) > 60:
+            body = body[:57] + "..."
+        lines.append(row.format(
+            digest, item["count"], item["error_rate"],
+            item["wall_ms"]["p50"], item["wall_ms"]["p95"],
+            item["wall_ms"]["p99"],
+            "-" if "p95" not in took else "{0:.1f}".format(took["p95"]),
+            body))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m estester.replay")
+    parser.add_argument("test_case", help="dotted path of the test case")
+    parser.add_argument("log", help="path of the NDJSON query log")
+    parser.add_argument("--speed", type=float,
+                        help="follow the logged timestamps, this many "
+                             "times faster (default: as fast as possible)")
+    parser.add_argument("--window", type=int, default=8,
+                        help="max number of searches in flight")
+    parser.add_argument("--index", action="append", default=[],
+                        metavar="LOGGED=INDEX",
+                        help="search INDEX instead of the LOGGED one")
+    parser.add_argument("--output", help="path of the JSON report")
+    args = parser.parse_args(argv)
+    indexes = dict(mapping.split("=", 1) for mapping in args.index)
+    results = replay(_load_class(args.test_case), args.log, args.speed,
+                     args.window, indexes)
+    sys.stdout.write(format_report(results) + "\n")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
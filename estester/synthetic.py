@@ -0,0 +1,271 @@
+"""
+Deterministic synthetic fixtures, to check how queries behave with many
+documents without writing them by hand:
+
+    from estester.synthetic import SyntheticFixtures, Dates, GeoPoints, \
+        Numbers, Terms, Text
+
+    class CatalogTestCase(ElasticSearchQueryTestCase):
+        fixtures = SyntheticFixtures(1000000, {
+            "brand": Terms(size=500),
+            "title": Text(length=(3, 12)),
+            "price": Numbers(1, 1000),
+            "created": Dates("2015-01-01", "2020-01-01"),
+            "store": GeoPoints(lat=(-33.9, -22.9), lon=(-51.2, -43.2))
+        }, doc_type="product", seed=42)
+
+Documents are generated one at a time while they are loaded, so memory use
+does not depend on the number of documents. Every iteration over the same
+SyntheticFixtures yields the same documents (they only depend on the seed),
+so they can be loaded again before each test method and used with
+reuse_index. SyntheticFixtures.from_mappings derives the fields from the
+mappings of the test case.
+
+Values only depend on random.random(), so a seed generates the same
+documents in Python 2 and 3.
+"""
+import bisect
+import datetime
+import random
+
+try:
+    xrange
+except NameError:  # Python 3
+    xrange = range
+
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+SYLLABLES = [consonant + vowel
+             for consonant in "bcdfghjklmnprstvz" for vowel in "aeiou"]
+
+
+def word(rank):
+    "Return the pseudo-word of <rank> (0 or more), such as 'ba' or 'keno'."
+    syllables = []
+    rank += 1
+    while rank:
+        rank, syllable = divmod(rank - 1, len(SYLLABLES))
+        syllables.append(SYLLABLES[syllable])
+    return "".join(reversed(syllables))
+
+
+def _parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    for date_format in [DATE_FORMAT, "%Y-%m-%d"]:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError("Unknown date format: {0}".format(value))
+
+
+class Terms(object):
+    """
+    Terms following Zipf's law: the term of rank k (starting at 1) is drawn
+    with a probability proportional to 1 / k ** exponent. <terms> lists the
+    terms from the most to the least frequent; by default, <size>
+    pseudo-words are used.
+    """
+
+    def __init__(self, terms=None, size=1000, exponent=1.0):
+        self.terms = list(terms) if terms else [word(i) for i in range(size)]
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, len(self.terms) + 1):
+            total += 1.0 / rank ** exponent
+            self.cumulative.append(total)
+
+    def sample(self, rng):
+        position = bisect.bisect(self.cumulative,
+                                 rng.random() * self.cumulative[-1])
+        return self.terms[min(position, len(self.terms) - 1)]
+
+
+class Text(object):
+    """
+    Text made of a number of <words> (default: Terms(size=10000)) drawn
+    uniformly from the <length> range (inclusive).
+    """
+
+    def __init__(self, words=None, length=(5, 20)):
+        self.words = words or Terms(size=10000)
+        self.length = length
+
+    def sample(self, rng):
+        low, high = self.length
+        count = low + int(rng.random() * (high - low + 1))
+        return " ".join(self.words.sample(rng) for i in range(count))
+
+
+class Numbers(object):
+    """
+    Numbers drawn uniformly between <low> and <high>. If both are integers,
+    so are the numbers (<high> included); otherwise they are floats,
+    rounded to <decimals> if it is given.
+    """
+
+    def __init__(self, low, high, decimals=None):
+        self.low = low
+        self.high = high
+        self.decimals = decimals
+        self.integer = all(isinstance(bound, int) for bound in [low, high])
+
+    def sample(self, rng):
+        if self.integer:
+            return self.low + int(rng.random() * (self.high - self.low + 1))
+        value = self.low + rng.random() * (self.high - self.low)
+        if self.decimals is not None:
+            value = round(value, self.decimals)
+        return value
+
+
+class Dates(object):
+    """
+    Dates (with time, formatted according to <date_format>) drawn uniformly
+    between <start> and <end>, which are datetimes or strings such as
+    "2015-01-01".
+    """
+
+    def __init__(self, start, end, date_format=DATE_FORMAT):
+        self.start = _parse_date(start)
+        span = _parse_date(end) - self.start
+        self.seconds = span.days * 86400 + span.seconds
+        self.date_format = date_format
+
+    def sample(self, rng):
+        seconds = int(rng.random() * self.seconds)
+        date = self.start + datetime.timedelta(seconds=seconds)
+        return date.strftime(self.date_format)
+
+
+class GeoPoints(object):
+    """
+    Geo points ({"lat": ..., "lon": ...}) drawn uniformly inside the <lat>
+    and <lon> ranges, rounded to <decimals>.
+    """
+
+    def __init__(self, lat=(-90.0, 90.0), lon=(-180.0, 180.0), decimals=6):
+        self.lat = Numbers(float(lat[0]), float(lat[1]), decimals)
+        self.lon = Numbers(float(lon[0]), float(lon[1]), decimals)
+
+    def sample(self, rng):
+        return {"lat": self.lat.sample(rng), "lon": self.lon.sample(rng)}
+
+
+class Choice(object):
+    "One of <values>, drawn according to <weights> (default: uniformly)."
+
+    def __init__(self, values, weights=None):
+        self.values = list(values)
+        weights = weights or [1] * len(self.values)
+        self.cumulative = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            self.cumulative.append(total)
+
+    def sample(self, rng):
+        position = bisect.bisect(self.cumulative,
+                                 rng.random() * self.cumulative[-1])
+        return self.values[min(position, len(self.values) - 1)]
+
+
+# values generated for each type of field by SyntheticFixtures.from_mappings
+INTEGER_TYPES = ["integer", "long", "short", "byte"]
+FLOAT_TYPES = ["float", "double", "half_float", "scaled_float"]
+
+
+def _mapping_fields(properties):
+    "Return the fields generated for the <properties> of a mapping."
+    fields = {}
+    for name, mapping in properties.items():
+        field_type = mapping.get("type", "object")
+        if "properties" in mapping:
+            fields[name] = _mapping_fields(mapping["properties"])
+        elif field_type == "keyword" or (
+                field_type == "string" and
+                mapping.get("index") == "not_analyzed"):
+            fields[name] = Terms()
+        elif field_type in ["string", "text"]:
+            fields[name] = Text()
+        elif field_type in INTEGER_TYPES:
+            fields[name] = Numbers(0, 1000)
+        elif field_type in FLOAT_TYPES:
+            fields[name] = Numbers(0.0, 1000.0, decimals=2)
+        elif field_type == "date":
+            fields[name] = Dates("2000-01-01", "2020-01-01")
+        elif field_type == "geo_point":
+            fields[name] = GeoPoints()
+        elif field_type == "boolean":
+            fields[name] = Choice([True, False])
+    return fields
+
+
+class SyntheticFixtures(object):
+    """
+    Fixtures (read ElasticSearchQueryTestCase.load_fixtures) made of <count>
+    documents of <doc_type>, with ids <id_prefix>0, <id_prefix>1... Their
+    body has the given <fields>, whose values are either distributions
+    (objects with a sample(rng) method, such as Terms or Numbers), dicts of
+    fields (objects) or constants.
+    """
+
+    def __init__(self, count, fields, doc_type="doc", seed=0, id_prefix=""):
+        self.count = count
+        self.fields = fields
+        self.doc_type = doc_type
+        self.seed = seed
+        self.id_prefix = id_prefix
+
+    @classmethod
+    def from_mappings(cls, mappings, count, doc_type=None, fields=None,
+                      seed=0, id_prefix=""):
+        """
+        Return SyntheticFixtures whose fields are derived from <mappings>
+        (of ElasticSearch 7, or with a single type unless <doc_type> is
+        given): terms for keyword (or not_analyzed) fields, text for other
+        strings, numbers, dates, geo points and booleans. Fields of other
+        types are left out. <fields> adds or replaces fields.
+        """
+        if "properties" in mappings:
+            properties = mappings["properties"]
+            doc_type = doc_type or "doc"
+        else:
+            if doc_type is None:
+                if len(mappings) != 1:
+                    raise ValueError(
+                        "doc_type is required for mappings of many types")
+                doc_type = list(mappings)[0]
+            properties = mappings[doc_type].get("properties", {})
+        generated = _mapping_fields(properties)
+        generated.update(fields or {})
+        return cls(count, generated, doc_type, seed, id_prefix)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        for position in xrange(self.count):
+            yield {
+                "type": self.doc_type,
+                "id": "{0}{1}".format(self.id_prefix, position),
+                "body": self._sample(self.fields, rng)
+            }
+
+    def _sample(self, fields, rng):
+        body = {}
+        # sorted, so documents do not depend on the order of dict keys
+        for name in sorted(fields):
+            value = fields[name]
+            if isinstance(value, dict):
+                body[name] = self._sample(value, rng)
+            elif hasattr(value, "sample"):
+                body[name] = value.sample(rng)
+            else:
+                body[name] = value
+        return body
@@ -0,0 +1,228 @@
+"""
+Timings of the phases of ESTester test cases, to find out where the time of
+a slow test suite goes: setting up indexes (delete_index, create_index,
+load_fixtures, wait_for_fixtures, aliases...), running the test methods,
+clearing up indexes, and every HTTP call made to ElasticSearch.
+
+Timings are only recorded if one of these environment variables is set:
+
+- ESTESTER_TIMINGS: print a summary per test case class and test method to
+  stderr when the process exits
+- ESTESTER_TIMINGS_JSON: path of a JSON file where the timings and the
+  summary are written when the process exits
+- ESTESTER_TIMINGS_TRACE: path of a file where the timings are written in
+  Chrome's trace event format (open it in chrome://tracing or Perfetto)
+
+or if estester.timings.recorder.enable() is called. Only the synchronous
+test cases are instrumented.
+"""
+import atexit
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from urlparse import urlsplit
+
+
+Event = namedtuple("Event", ["name", "category", "test_case", "test_method",
+                             "start", "duration", "thread"])
+
+# phases of a test method, in the order they run
+METHOD_PHASES = ["pre_setup", "test", "post_teardown"]
+
+
+def endpoint(method, url):
+    """
+    Return the name of the call to <url> used in summaries, such as
+    "POST _bulk", "PUT index" or "GET document".
+    """
+    parts = [part for part in urlsplit(url).path.split("/") if part]
+    names = [part for part in parts if part.startswith("_")]
+    if names:
+        name = names[0]
+    elif len(parts) <= 1:
+        name = "index"
+    else:
+        name = "document"
+    return "{0} {1}".format(method.upper(), name)
+
+
+class Recorder(object):
+    "Collects the timings (Event) of test case phases and HTTP calls."
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.origin = time.time()
+        self.lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.lock:
+            del self.events[:]
+
+    @contextlib.contextmanager
+    def phase(self, test_case, name, category="phase"):
+        "Record the time taken by the block as the phase <name>."
+        if not self.enabled:
+            yield
+            return
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add(test_case, name, category, started, time.time())
+
+    def request(self, test_case, method, url):
+        "Record the time taken by the block as a HTTP call to <url>."
+        return self.phase(test_case, endpoint(method, url), "http")
+
+    def add(self, test_case, name, category, started, finished):
+        cls = type(test_case)
+        event = Event(name, category,
+                      "{0}.{1}".format(cls.__module__, cls.__name__),
+                      getattr(test_case, "_testMethodName", None),
+                      started, finished - started,
+                      threading.current_thread().ident)
+        with self.lock:
+            self.events.append(event)
+
+    def summarize(self):
+        """
+        Return an OrderedDict mapping each test case class to a dict with
+        "phases" (count and total_ms of each phase and HTTP call) and
+        "methods" (total_ms of pre_setup, test and post_teardown of each
+        test method).
+        """
+        summary = OrderedDict()
+        with self.lock:
+            events = list(self.events)
+        for event in events:
+            item = summary.setdefault(event.test_case, {
+                "phases": OrderedDict(),
+                "methods": OrderedDict()
+            })
+            phase = item["phases"].setdefault(
+                event.name, {"count": 0, "total_ms": 0.0})
+            phase["count"] += 1
+            phase["total_ms"] += event.duration * 1000
+            if event.name in METHOD_PHASES and event.test_method:
+                method = item["methods"].setdefault(event.test_method, {})
+                method[event.name] = method.get(event.name, 0.0) + \
+                    event.duration * 1000
+        return summary
+
+    def summary(self):
+        "Return the summary (read summarize) as text."
+        lines = ["ESTester timings (ms)"]
+        for test_case, item in self.summarize().items():
+            lines.append("")
+            lines.append(test_case)
+            phases = sorted(item["phases"].items(),
+                            key=lambda phase: -phase[1]["total_ms"])
+            for name, phase in phases:
+                lines.append("  {0:<40} {1:>6} calls {2:>12.1f}".format(
+                    name, phase["count"], phase["total_ms"]))
+            for name, method in item["methods"].items():
+                timings = ", ".join(
+                    "{0} {1:.1f}".format(phase, method[phase])
+                    for phase in METHOD_PHASES if phase in method)
+                lines.append("  {0}: {1}".format(name, timings))
+        return "\n".join(lines)
+
+    def as_json(self):
+        "Return the events and the summary as a JSON-serializable dict."
+        with self.lock:
+            events = list(self.events)
+        return {
+            "events": [{
+                "name": event.name,
+                "category": event.category,
+                "test_case": event.test_case,
+                "test_method": event.test_method,
+                "start_ms": (event.start - self.origin) * 1000,
+                "duration_ms": event.duration * 1000,
+                "thread": event.thread
+            } for event in events],
+            "summary": self.summarize()
+        }
+
+    def chrome_trace(self):
+        "Return the events in Chrome's trace event format."
+        with self.lock:
+            events = list(self.events)
+        pid = os.getpid()
+        return {
+            "traceEvents": [{
+                "name": event.name,
+                "cat": event.category,
+                "ph": "X",
+                "ts": int((event.start - self.origin) * 1000000),
+                "dur": int(event.duration * 1000000),
+                "pid": pid,
+                "tid": event.thread,
+                "args": {
+                    "test_case": event.test_case,
+                    "test_method": event.test_method
+                }
+            } for event in events],
+            "displayTimeUnit": "ms"
+        }
+
+    def save_json(self, path):
+        with open(path, "w") as output:
+            json.dump(self.as_json(), output, indent=2)
+
+    def save_chrome_trace(self, path):
+        with open(path, "w") as output:
+            json.dump(self.chrome_trace(), output)
+
+    def report(self):
+        """
+        Print the summary and write the files chosen by the ESTESTER_TIMINGS
+        environment variables.
+        """
+        if os.environ.get("ESTESTER_TIMINGS"):
+            sys.stderr.write(self.summary() + "\n")
+        if os.environ.get("ESTESTER_TIMINGS_JSON"):
+            self.save_json(os.environ["ESTESTER_TIMINGS_JSON"])
+        if os.environ.get("ESTESTER_TIMINGS_TRACE"):
+            self.save_chrome_trace(os.environ["ESTESTER_TIMINGS_TRACE"])
+
+
+def timed(name):
+    """
+    Decorator which records the time taken by a test case method as the
+    phase <name>.
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not recorder.enabled:
+                return method(self, *args, **kwargs)
+            with recorder.phase(self, name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+recorder = Recorder()
+
+if os.environ.get("ESTESTER_TIMINGS") or \
+        os.environ.get("ESTESTER_TIMINGS_JSON") or \
+        os.environ.get("ESTESTER_TIMINGS_TRACE"):
+    recorder.enable()
+    atexit.register(recorder.report)
@@ -17,6 +17,7 @@ setup(name="ESTester",
       description=u"Utilities for testing ElasticSearch queries",
       include_package_data=True,
       install_requires=["requests>=2.0.0"],
+      extras_require={"async": ["aiohttp>=3.6"]},
       license="GNU GPLv2",
       long_description=README,
       packages=find_packages(),
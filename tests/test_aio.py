@@ -0,0 +1,187 @@
+import json
+import sys
+import unittest
+
+if sys.version_info < (3, 8):
+    raise unittest.SkipTest("estester.aio requires Python 3.8 or later")
+
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+from estester import ElasticSearchException
+from estester.benchmark import run_benchmark
+from estester.aio import AsyncElasticSearchQueryTestCase, \
+    AsyncMultipleIndexesQueryTestCase, Response
+
+
+def bulk_response(errors=()):
+    items = [{"index": {"_type": doc_type, "_id": doc_id, "error": "Failed"}}
+             for doc_type, doc_id in errors]
+    return Response(200, json.dumps({"items": items}))
+
+
+class AsyncElasticSearchQueryTestCaseTestCase(unittest.TestCase):
+
+    class DogsTestCase(AsyncElasticSearchQueryTestCase):
+        readiness = "refresh"
+        fixtures = [
+            {
+                "type": "dog",
+                "id": str(i),
+                "body": {"name": "Dog {0}".format(i)}
+            }
+            for i in range(5)
+        ]
+        calls = []
+
+        def setUp(self):
+            self.calls.append("setUp")
+
+        def test_search(self):
+            self.calls.append("test")
+
+        def tearDown(self):
+            self.calls.append("tearDown")
+
+    def setUp(self):
+        self.test_case = self.DogsTestCase("test_search")
+        patcher = patch.object(self.DogsTestCase, "_request",
+                               new_callable=AsyncMock)
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.request.return_value = Response(200, '{"items": []}')
+
+    def urls(self):
+        host = self.test_case.host
+        return [(call[0][0], call[0][1].replace(host, ""))
+                for call in self.request.call_args_list]
+
+    def test_index_is_set_up_and_cleared_up_around_each_test(self):
+        del self.DogsTestCase.calls[:]
+        result = unittest.TestResult()
+        self.DogsTestCase("test_search").run(result)
+        self.assertTrue(result.wasSuccessful())
+        self.assertEqual(self.DogsTestCase.calls,
+                         ["setUp", "test", "tearDown"])
+        expected = [
+            ("delete", "sample.test/"),
+            ("put", "sample.test/"),
+            ("post", "_bulk"),
+            ("post", "sample.test/_refresh"),
+            ("delete", "sample.test/")
+        ]
+        self.assertEqual(self.urls(), expected)
+
+    def test_search_returns_parsed_response(self):
+        self.request.return_value = Response(200, '{"hits": {"total": 1}}')
+        response = asyncio.run(self.test_case.search({"query": {}}))
+        self.assertEqual(response, {"hits": {"total": 1}})
+        self.request.assert_called_once_with(
+            "post", "{0}sample.test/_search".format(self.test_case.host),
+            data='{"query": {}}')
+
+    def test_queries_can_run_concurrently(self):
+        self.request.return_value = Response(200, '{"hits": {"total": 1}}')
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        tasks = [loop.create_task(self.test_case.search({"size": i}))
+                 for i in range(10)]
+        responses = loop.run_until_complete(asyncio.gather(*tasks))
+        self.assertEqual(len(responses), 10)
+        self.assertEqual(self.request.call_count, 10)
+
+    def test_get_raises_exception_on_missing_document(self):
+        self.request.return_value = Response(404, '{"found": false}')
+        with self.assertRaises(ElasticSearchException):
+            asyncio.run(self.test_case.get("dog", "20"))
+
+    def test_create_index_raises_exception_on_failure(self):
+        self.request.return_value = Response(500, '{"error": "Failed"}')
+        with self.assertRaises(ElasticSearchException):
+            asyncio.run(self.test_case.create_index())
+
+    def test_create_index_ignores_existing_index(self):
+        self.request.return_value = Response(
+            400, '{"error": "IndexAlreadyExistsException[[sample.test]]"}')
+        asyncio.run(self.test_case.create_index())
+
+    def test_fast_ingest_restores_refresh_interval(self):
+        self.test_case.fast_ingest = True
+        self.test_case.readiness = "wait_for"
+        self.test_case.settings = {"index": {"refresh_interval": "30s"}}
+        asyncio.run(self.test_case._pre_setup())
+        create = self.request.call_args_list[1]
+        settings = json.loads(create[1]["data"])["settings"]
+        self.assertEqual(settings["index.refresh_interval"], "-1")
+        self.assertEqual(self.urls()[2:], [
+            ("post", "_bulk"),
+            ("put", "sample.test/_settings"),
+            ("post", "sample.test/_refresh")
+        ])
+        self.assertEqual(
+            json.loads(self.request.call_args_list[3][1]["data"]),
+            {"index.refresh_interval": "30s"})
+
+    def test_bulk_index_reports_every_failed_document(self):
+        self.request.return_value = bulk_response([("dog", "1")])
+        self.test_case.bulk_size = 2
+        with self.assertRaises(ElasticSearchException) as cm:
+            asyncio.run(self.test_case.bulk_index("sample.test",
+                                                  self.test_case.fixtures))
+        self.assertIn("dog/1", str(cm.exception))
+        self.assertEqual(self.request.call_count, 3)
+
+
+class AsyncMultipleIndexesQueryTestCaseTestCase(unittest.TestCase):
+
+    class BandsTestCase(AsyncMultipleIndexesQueryTestCase):
+        readiness = "refresh"
+        data = {
+            "beatles": {
+                "aliases": ["band"],
+                "fixtures": [{"type": "member", "id": "lenon", "body": {}}]
+            },
+            "thepolice": {
+                "aliases": ["band"],
+                "fixtures": [{"type": "member", "id": "sting", "body": {}}]
+            }
+        }
+
+    def setUp(self):
+        self.test_case = self.BandsTestCase("run")
+        patcher = patch.object(self.BandsTestCase, "_request",
+                               new_callable=AsyncMock)
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.request.return_value = Response(200, '{"items": []}')
+
+    def test_aliases_and_fixtures_of_all_indexes_are_handled_at_once(self):
+        asyncio.run(self.test_case._pre_setup())
+        host = self.test_case.host
+        urls = [call[0][1].replace(host, "")
+                for call in self.request.call_args_list]
+        self.assertEqual(urls.count("/_aliases"), 1)
+        self.assertEqual(urls[-1], "beatles,thepolice/_refresh")
+
+    def test_search_in_index(self):
+        self.request.return_value = Response(200, '{"hits": {"total": 2}}')
+        response = asyncio.run(self.test_case.search_in_index("band"))
+        self.assertEqual(response["hits"]["total"], 2)
+        self.request.assert_called_once_with(
+            "post", "{0}band/_search".format(self.test_case.host), data="{}")
+
+
+class AsyncBenchmarkTestCase(unittest.TestCase):
+
+    class DogsTestCase(AsyncElasticSearchQueryTestCase):
+        backend = "memory"
+        readiness = "refresh"
+        fixtures = [{"type": "dog", "id": "1", "body": {"name": "Nina"}}]
+        benchmark_queries = {"match": {"query": {"match": {"name": "nina"}}}}
+
+    def test_queries_run_in_tasks(self):
+        results = run_benchmark(self.DogsTestCase, concurrency=4,
+                                iterations=8)
+        self.assertEqual(results["mode"], "async")
+        self.assertEqual(results["queries"]["match"]["count"], 8)
+        self.assertEqual(results["queries"]["match"]["errors"], 0)
@@ -75,7 +75,7 @@ class AliasMultipleIndexesTestCase(MultipleIndexesQueryTestCase):
         self.assertEqual(self.get_aliases('metallica'), [])
 
     # I could not make elasticsearch's _aliases to return an error
-    @patch('requests.get')
+    @patch('requests.Session.request')
     def test_failure_in_getting_alias(self, get):
         attrs = {
             "text": 'Error',
@@ -0,0 +1,136 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from estester import ElasticSearchQueryTestCase
+from estester.benchmark import Schedule, compare, format_results, \
+    load_results, main, mann_whitney, run_benchmark, save_results
+
+
+class DogsQueryTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    fixtures = [
+        {"type": "dog", "id": "1", "body": {"name": "Nina Fox"}},
+        {"type": "dog", "id": "2", "body": {"name": "Charles M."}}
+    ]
+    benchmark_queries = {
+        "match": {"query": {"match": {"name": "nina"}}},
+        "broken": {"query": {"magic": {}}}
+    }
+
+
+def results(samples, error_rate=0.0):
+    return {"queries": {"match": {
+        "error_rate": error_rate,
+        "samples": {"wall_ms": samples}
+    }}}
+
+
+class RunBenchmarkTestCase(unittest.TestCase):
+
+    def test_iterations(self):
+        results = run_benchmark(DogsQueryTestCase, concurrency=3,
+                                iterations=10)
+        self.assertEqual(results["mode"], "threads")
+        self.assertEqual(results["test_case"],
+                         "test_benchmark.DogsQueryTestCase")
+        match = results["queries"]["match"]
+        self.assertEqual((match["count"], match["errors"]), (10, 0))
+        self.assertEqual(match["took_ms"]["p95"], 0)
+        self.assertTrue(match["wall_ms"]["p50"] <= match["wall_ms"]["p99"])
+        self.assertEqual(len(match["samples"]["wall_ms"]), 10)
+        self.assertEqual(results["queries"]["broken"]["error_rate"], 1.0)
+        self.assertEqual(results["total"]["count"], 20)
+        self.assertTrue(results["total"]["throughput"] > 0)
+        self.assertIn("broken", format_results(results))
+
+    def test_duration(self):
+        queries = {"all": {"query": {"match_all": {}}}}
+        results = run_benchmark(DogsQueryTestCase, queries, concurrency=2,
+                                duration=0.05)
+        self.assertTrue(results["queries"]["all"]["count"] > 0)
+        self.assertTrue(results["elapsed_s"] < 1)
+
+    def test_query_timings_are_not_recorded(self):
+        test_cases = []
+
+        class RecordedDogsQueryTestCase(DogsQueryTestCase):
+            def __init__(self, *args):
+                super(RecordedDogsQueryTestCase, self).__init__(*args)
+                test_cases.append(self)
+
+        results = run_benchmark(RecordedDogsQueryTestCase, iterations=1000)
+        self.assertEqual(results["total"]["count"], 2000)
+        self.assertEqual(test_cases[0].query_timings, [])
+
+    def test_schedule(self):
+        schedule = Schedule({"b": 2, "a": 1}, iterations=2, warmup=1)
+        runs = []
+        run = schedule.next()
+        while run is not None:
+            runs.append(run)
+            run = schedule.next()
+        self.assertEqual(runs, [("a", 1, False), ("b", 2, False),
+                                ("a", 1, True), ("b", 2, True),
+                                ("a", 1, True), ("b", 2, True)])
+        self.assertRaises(ValueError, Schedule, {"a": 1})
+
+
+class CompareTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.baseline = [10 + rng.random() for i in range(50)]
+        self.similar = [10 + rng.random() for i in range(50)]
+        self.slower = [12 + rng.random() for i in range(50)]
+
+    def test_mann_whitney(self):
+        self.assertTrue(mann_whitney(self.baseline, self.slower) < 0.001)
+        self.assertTrue(mann_whitney(self.slower, self.baseline) > 0.999)
+        self.assertTrue(mann_whitney(self.baseline, self.similar) > 0.01)
+        self.assertEqual(mann_whitney([1, 1], [1, 1]), 1.0)
+
+    def test_regressions(self):
+        baseline = results(self.baseline)
+        self.assertEqual(compare(baseline, results(self.similar)), [])
+        regressions = compare(baseline, results(self.slower))
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("match: median wall"))
+        regressions = compare(baseline, results(self.similar, 0.5))
+        self.assertEqual(regressions, ["match: error rate 0.0% -> 50.0%"])
+
+    def test_small_slowdowns_are_ignored(self):
+        slightly_slower = [value * 1.05 for value in self.baseline]
+        self.assertEqual(compare(results(self.baseline),
+                                 results(slightly_slower)), [])
+
+
+class CommandLineTestCase(unittest.TestCase):
+
+    @patch("sys.stdout")
+    def test_run_and_compare(self, stdout):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "baseline.json")
+        status = main(["run", "test_benchmark.DogsQueryTestCase",
+                       "--iterations", "5", "--output", path])
+        self.assertEqual(status, 0)
+        self.assertEqual(load_results(path)["queries"]["match"]["count"], 5)
+        self.assertEqual(main(["compare", path, path]), 0)
+        slower = load_results(path)
+        slower["queries"]["match"]["error_rate"] = 1.0
+        save_results(slower, path + ".slower")
+        self.assertEqual(main(["compare", path, path + ".slower"]), 1)
+        stdout.write.assert_called_with("match: error rate 0.0% -> 100.0%\n")
+
+    @patch("sys.stderr")
+    def test_command_is_required(self, stderr):
+        with self.assertRaises(SystemExit) as cm:
+            main([])
+        self.assertEqual(cm.exception.code, 2)
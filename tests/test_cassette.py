@@ -0,0 +1,160 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from estester import ElasticSearchException, ElasticSearchQueryTestCase
+from estester.cassette import Cassette, Response, request_key
+
+
+class OfflineBackend(object):
+
+    def request(self, method, url, **kwargs):
+        raise AssertionError("Unexpected call: {0} {1}".format(method, url))
+
+
+class StaticBackend(object):
+
+    def __init__(self, text):
+        self.text = text
+
+    def request(self, method, url, **kwargs):
+        return Response(200, self.text)
+
+
+class DogsQueryTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    fixtures = [
+        {"type": "dog", "id": "1", "body": {"name": "Nina Fox"}},
+        {"type": "dog", "id": "2", "body": {"name": "Charles M."}}
+    ]
+
+    def test_search(self):
+        response = self.search({"query": {"match": {"name": "nina"}}})
+        self.assertEqual(response["hits"]["total"], 1)
+
+    def test_get(self):
+        self.assertEqual(self.get("dog", "2")["_source"]["name"], "Charles M.")
+
+
+class PagedDogsQueryTestCase(DogsQueryTestCase):
+
+    def test_iter_hits(self):
+        hits = list(self.iter_hits(page_size=1))
+        self.assertEqual(sorted(hit["_id"] for hit in hits), ["1", "2"])
+
+
+class CassetteTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "cassettes", "dogs.json.gz")
+
+    def run_test_case(self, base=DogsQueryTestCase, **attributes):
+        test_case = type("DogsTestCase", (base,), attributes)
+        suite = unittest.defaultTestLoader.loadTestsFromTestCase(test_case)
+        result = unittest.TestResult()
+        suite.run(result)
+        return result
+
+    def test_recorded_calls_are_replayed_without_backend(self):
+        result = self.run_test_case(cassette=self.path)
+        self.assertTrue(result.wasSuccessful())
+        self.assertTrue(os.path.exists(self.path))
+        result = self.run_test_case(cassette=self.path,
+                                    backend=OfflineBackend())
+        self.assertEqual(result.testsRun, 2)
+        self.assertTrue(result.wasSuccessful())
+
+    def test_replaying_a_call_which_was_not_recorded_fails(self):
+        cassette = Cassette(self.path, "replay", None)
+        with self.assertRaises(ElasticSearchException) as cm:
+            cassette.request("post", "http://localhost:9200/dogs/_search",
+                             data="{}")
+        self.assertIn("POST /dogs/_search", str(cm.exception))
+
+    def test_verify_reports_responses_which_changed(self):
+        url = "http://localhost:9200/dogs/_search"
+        recorder = Cassette(self.path, "record",
+                            StaticBackend('{"hits": 1, "took": 3}'))
+        recorder.request("post", url, data="{}")
+        recorder.save()
+        verifier = Cassette(self.path, "verify",
+                            StaticBackend('{"took": 8, "hits": 1}'))
+        verifier.request("post", url, data="{}")
+        self.assertEqual(verifier.drifts, [])
+        verifier = Cassette(self.path, "verify",
+                            StaticBackend('{"hits": 2, "took": 3}'))
+        verifier.request("post", url, data="{}")
+        self.assertEqual(len(verifier.drifts), 1)
+        self.assertIn("POST /dogs/_search", verifier.drifts[0])
+
+    def test_verify_fails_test_case_class(self):
+        self.run_test_case(cassette=self.path)
+        fixtures = [
+            {"type": "dog", "id": "1", "body": {"name": "Nina Fox Terrier"}},
+            {"type": "dog", "id": "2", "body": {"name": "Charles M."}}
+        ]
+        result = self.run_test_case(cassette=self.path, fixtures=fixtures,
+                                    cassette_mode="verify")
+        self.assertEqual(result.failures, [])
+        self.assertEqual(len(result.errors), 1)
+        self.assertIn("differ from cassette", result.errors[0][1])
+
+    def test_iter_hits_is_recorded_and_verified(self):
+        # every run gets new scroll ids
+        for mode in ["record", "verify", "verify"]:
+            result = self.run_test_case(PagedDogsQueryTestCase,
+                                        cassette=self.path,
+                                        cassette_mode=mode)
+            self.assertTrue(result.wasSuccessful(), result.errors)
+        result = self.run_test_case(PagedDogsQueryTestCase,
+                                    cassette=self.path,
+                                    backend=OfflineBackend())
+        self.assertEqual(result.testsRun, 3)
+        self.assertTrue(result.wasSuccessful(), result.errors)
+
+    def test_verify_ignores_point_in_time_ids(self):
+        url = "http://localhost:9200/dogs/_pit?keep_alive=1m"
+        search_url = "http://localhost:9200/_search"
+        recorder = Cassette(self.path, "record", StaticBackend('{"id": "a"}'))
+        recorder.request("post", url)
+        recorder.transport = StaticBackend('{"pit_id": "a", "hits": 1}')
+        recorder.request("post", search_url, data='{"pit": {"id": "a"}}')
+        recorder.save()
+        verifier = Cassette(self.path, "verify", StaticBackend('{"id": "b"}'))
+        verifier.request("post", url)
+        verifier.transport = StaticBackend('{"pit_id": "b", "hits": 1}')
+        verifier.request("post", search_url, data='{"pit": {"id": "b"}}')
+        self.assertEqual(verifier.drifts, [])
+
+    def test_repeated_calls_are_replayed_in_order(self):
+        url = "http://localhost:9200/dogs/_count"
+        recorder = Cassette(self.path, "record", StaticBackend("1"))
+        recorder.request("get", url)
+        recorder.transport = StaticBackend("2")
+        recorder.request("get", url)
+        recorder.save()
+        player = Cassette(self.path, "replay", None)
+        texts = [player.request("get", url).text for i in range(3)]
+        self.assertEqual(texts, ["1", "2", "2"])
+
+
+class RequestKeyTestCase(unittest.TestCase):
+
+    def test_key_ignores_host_and_json_formatting(self):
+        first = request_key("post", "http://localhost:9200/dogs/_search",
+                            '{"query": {"match_all": {}}, "size": 1}')
+        second = request_key("POST", "http://es:9200//dogs/_search",
+                             '{"size":1,"query":{"match_all":{}}}')
+        self.assertEqual(first, second)
+
+    def test_key_depends_on_path_and_body(self):
+        key = request_key("post", "http://localhost:9200/dogs/_search", "{}")
+        self.assertNotEqual(key, request_key(
+            "post", "http://localhost:9200/cats/_search", "{}"))
+        self.assertNotEqual(key, request_key(
+            "post", "http://localhost:9200/dogs/_search", '{"size": 1}'))
@@ -1,6 +1,12 @@
 import json
+import threading
+import time
+import unittest
 import requests
-from estester import MultipleIndexesQueryTestCase, ElasticSearchQueryTestCase
+from mock import patch, Mock
+import estester
+from estester import MultipleIndexesQueryTestCase, ElasticSearchQueryTestCase,\
+    ElasticSearchException
 
 
 class IndexManagementSingleIndexTestCase(ElasticSearchQueryTestCase):
@@ -178,3 +184,431 @@ class IndexManagementMultipleIndexesTestCase(MultipleIndexesQueryTestCase):
         self.delete_index(self.new_index)
         response = requests.head(self.url)
         self.assertEqual(response.status_code, 404)
+
+
+class ReuseIndexTestCase(unittest.TestCase):
+
+    class ReusedTestCase(ElasticSearchQueryTestCase):
+        reuse_index = True
+        fixtures = [
+            {
+                "type": "dog",
+                "id": "1",
+                "body": {"name": "Nina Fox"}
+            }
+        ]
+
+        def test_nothing(self):
+            pass
+
+    def setUp(self):
+        self.test_case = self.ReusedTestCase("test_nothing")
+        for method in ["delete_index", "create_index", "load_fixtures",
+                       "create_aliases", "remove_aliases", "get_aliases",
+                       "wait_for_fixtures"]:
+            patcher = patch.object(self.test_case, method)
+            setattr(self, method, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def stored_alias(self):
+        self.get_aliases.return_value = []
+        self.test_case._pre_setup()
+        return self.create_aliases.call_args[0][1][0]
+
+    def test_index_is_loaded_and_fingerprinted_when_not_found(self):
+        alias = self.stored_alias()
+        self.delete_index.assert_called_once_with("sample.test")
+        self.create_index.assert_called_once_with("sample.test", {}, {})
+        self.load_fixtures.assert_called_once_with(
+            "sample.test", self.test_case.fixtures, wait=False)
+        self.assertTrue(alias.startswith("sample.test.fingerprint."))
+
+    def test_index_with_same_fingerprint_is_reused(self):
+        alias = self.stored_alias()
+        self.load_fixtures.reset_mock()
+        self.get_aliases.return_value = [alias]
+        self.test_case._pre_setup()
+        self.assertFalse(self.load_fixtures.called)
+
+    def test_fingerprint_depends_on_fixtures(self):
+        alias = self.stored_alias()
+        self.test_case.fixtures = [
+            {
+                "type": "dog",
+                "id": "1",
+                "body": {"name": "Charles M."}
+            }
+        ]
+        self.assertNotEqual(self.stored_alias(), alias)
+
+    def test_functions_are_fingerprinted_by_their_fixtures(self):
+        def fixtures():
+            for i in range(3):
+                yield {"type": "dog", "id": str(i), "body": {"name": "Dog"}}
+        digest = estester._fingerprint({}, {}, fixtures)
+        self.assertEqual(estester._fingerprint({}, {}, fixtures), digest)
+        self.assertEqual(estester._fingerprint({}, {}, list(fixtures())),
+                         digest)
+
+    def test_iterators_cannot_be_fingerprinted(self):
+        with self.assertRaises(ElasticSearchException):
+            estester._fingerprint({}, {}, iter([]))
+
+    def test_reused_index_is_not_deleted_after_test(self):
+        self.test_case._post_teardown()
+        self.assertFalse(self.delete_index.called)
+
+    def test_fingerprint_is_removed_before_writing_to_index(self):
+        self.get_aliases.return_value = ["sample.test.fingerprint.123", "a"]
+        self.test_case._pre_write()
+        self.remove_aliases.assert_called_once_with(
+            "sample.test", ["sample.test.fingerprint.123"])
+
+    def test_multiple_indexes_store_fingerprint_with_aliases(self):
+        class ReusedMultipleTestCase(MultipleIndexesQueryTestCase):
+            reuse_index = True
+            data = {"beatles": {"aliases": ["band"]}}
+        test_case = ReusedMultipleTestCase("run")
+        with patch.object(test_case, "get_aliases", return_value=[]), \
+                patch.object(test_case, "delete_index"), \
+                patch.object(test_case, "create_index"), \
+                patch.object(test_case, "load_fixtures"), \
+                patch.object(test_case, "wait_for_fixtures"), \
+                patch.object(test_case, "_update_aliases") as update_aliases:
+            test_case._pre_setup()
+        action_type, aliases = update_aliases.call_args[0]
+        self.assertEqual(action_type, "add")
+        self.assertEqual(aliases[0], ("beatles", "band"))
+        self.assertEqual(aliases[1][0], "beatles")
+        self.assertTrue(aliases[1][1].startswith("beatles.fingerprint."))
+
+
+class ResetStrategyTestCase(unittest.TestCase):
+
+    class GoldenTestCase(ElasticSearchQueryTestCase):
+        reset_strategy = "clone"
+        readiness = "refresh"
+        fixtures = [
+            {
+                "type": "dog",
+                "id": "1",
+                "body": {"name": "Nina Fox"}
+            }
+        ]
+
+        def test_nothing(self):
+            pass
+
+    def setUp(self):
+        self.test_case = self.GoldenTestCase("test_nothing")
+        patcher = patch.object(self.GoldenTestCase, "_request")
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+        attrs = {
+            "text": '{"snapshot": {"state": "SUCCESS"}, "items": []}',
+            "status_code": 200
+        }
+        self.request.return_value.configure_mock(**attrs)
+        self.addCleanup(self.GoldenTestCase.tearDownClass)
+
+    def calls(self):
+        return [(call[0][0], call[0][1].replace(self.test_case.host, ""))
+                for call in self.request.call_args_list]
+
+    def test_clone_strategy_loads_golden_index_only_once(self):
+        self.test_case._pre_setup()
+        self.test_case._pre_setup()
+        calls = self.calls()
+        self.assertEqual(calls.count(("put", "sample.test.golden/")), 1)
+        self.assertEqual(calls.count(("post", "_bulk")), 1)
+        self.assertEqual(
+            calls.count(("post", "sample.test.golden/_clone/sample.test")), 2)
+
+    def test_golden_index_is_read_only(self):
+        self.test_case._pre_setup()
+        self.assertIn(("post", "sample.test.golden/_flush"), self.calls())
+        self.assertIn(("put", "sample.test.golden/_settings"), self.calls())
+        settings = [call[1]["data"] for call in self.request.call_args_list
+                    if call[0][1].endswith("_settings")]
+        self.assertEqual(json.loads(settings[0]),
+                         {"index.blocks.write": True})
+
+    def test_snapshot_strategy_restores_golden_index(self):
+        self.test_case.reset_strategy = "snapshot"
+        self.test_case._pre_setup()
+        self.test_case._pre_setup()
+        calls = self.calls()
+        snapshot = "_snapshot/estester/sample.test.golden"
+        self.assertEqual(calls.count(("put", snapshot)), 1)
+        self.assertEqual(calls.count(("post", snapshot + "/_restore")), 2)
+        restore = json.loads(self.request.call_args[1]["data"])
+        self.assertEqual(restore["rename_replacement"], "sample.test")
+
+    def test_golden_index_is_deleted_with_class(self):
+        self.test_case._pre_setup()
+        self.request.reset_mock()
+        self.GoldenTestCase.tearDownClass()
+        self.assertEqual(self.calls(), [("delete", "sample.test.golden/")])
+
+    def test_unknown_strategy_fails(self):
+        self.test_case.reset_strategy = "magic"
+        with self.assertRaises(ElasticSearchException):
+            self.test_case._pre_setup()
+
+
+class FastIngestTestCase(unittest.TestCase):
+
+    class FastTestCase(ElasticSearchQueryTestCase):
+        fast_ingest = True
+        readiness = "refresh"
+        settings = {
+            "index": {"number_of_shards": 2, "refresh_interval": "30s"},
+            "analysis": {"analyzer": {"folding": {"tokenizer": "standard"}}}
+        }
+        fixtures = [
+            {
+                "type": "dog",
+                "id": "1",
+                "body": {"name": "Nina Fox"}
+            }
+        ]
+
+        def test_nothing(self):
+            pass
+
+    def setUp(self):
+        self.test_case = self.FastTestCase("test_nothing")
+        patcher = patch.object(self.FastTestCase, "_request")
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+        attrs = {"text": '{"items": []}', "status_code": 200}
+        self.request.return_value.configure_mock(**attrs)
+
+    def calls(self):
+        return [(call[0][0], call[0][1].replace(self.test_case.host, ""),
+                 call[1].get("data"))
+                for call in self.request.call_args_list]
+
+    def test_index_is_created_with_fast_ingest_settings(self):
+        self.test_case._pre_setup()
+        method, url, data = self.calls()[1]
+        self.assertEqual((method, url), ("put", "sample.test/"))
+        self.assertEqual(json.loads(data)["settings"], {
+            "index.number_of_shards": 2,
+            "index.number_of_replicas": 0,
+            "index.refresh_interval": "-1",
+            "index.translog.durability": "async",
+            "index.analysis.analyzer.folding.tokenizer": "standard"
+        })
+
+    def test_refresh_interval_is_restored_after_loading_fixtures(self):
+        self.test_case._pre_setup()
+        urls = [call[:2] for call in self.calls()]
+        self.assertEqual(urls[2:], [
+            ("post", "_bulk"),
+            ("put", "sample.test/_settings"),
+            ("post", "sample.test/_refresh")
+        ])
+        self.assertEqual(json.loads(self.calls()[3][2]),
+                         {"index.refresh_interval": "30s"})
+
+    def test_default_refresh_interval_is_restored(self):
+        self.test_case.settings = {}
+        self.test_case._pre_setup()
+        self.assertEqual(json.loads(self.calls()[3][2]),
+                         {"index.refresh_interval": "1s"})
+
+    def test_whole_index_is_refreshed_instead_of_waiting(self):
+        self.test_case.readiness = "wait_for"
+        self.test_case.bulk_size = 1
+        self.test_case.fixtures = [
+            {"type": "dog", "id": str(i), "body": {"name": "Dog"}}
+            for i in range(3)
+        ]
+        self.test_case._pre_setup()
+        bulks = [call for call in self.request.call_args_list
+                 if call[0][1].endswith("_bulk")]
+        self.assertEqual(len(bulks), 3)
+        self.assertFalse(any("params" in call[1] for call in bulks))
+        urls = [call[:2] for call in self.calls()]
+        self.assertEqual(urls[5:], [
+            ("put", "sample.test/_settings"),
+            ("post", "sample.test/_refresh")
+        ])
+
+
+class ParallelSetupTestCase(unittest.TestCase):
+
+    class BandsTestCase(MultipleIndexesQueryTestCase):
+        readiness = "refresh"
+        setup_workers = 3
+        data = {
+            "beatles": {
+                "aliases": ["band"],
+                "fixtures": [
+                    {"type": "member", "id": "lenon", "body": {}}
+                ]
+            },
+            "thepolice": {
+                "aliases": ["band", "single-man-band"],
+                "fixtures": [
+                    {"type": "member", "id": "sting", "body": {}}
+                ]
+            },
+            "ramones": {
+                "fixtures": [
+                    {"type": "member", "id": "joey", "body": {}}
+                ]
+            }
+        }
+
+        def test_nothing(self):
+            pass
+
+    def setUp(self):
+        self.test_case = self.BandsTestCase("test_nothing")
+        patcher = patch.object(self.BandsTestCase, "_request")
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+        attrs = {"text": '{"items": []}', "status_code": 200}
+        self.request.return_value.configure_mock(**attrs)
+
+    def urls(self, method):
+        host = self.test_case.host
+        return [call[0][1].replace(host, "")
+                for call in self.request.call_args_list
+                if call[0][0] == method]
+
+    def test_indexes_are_set_up_in_threads(self):
+        threads = set()
+        create_index = self.test_case.create_index
+
+        def tracking_create_index(*args):
+            threads.add(threading.current_thread().ident)
+            time.sleep(0.05)
+            return create_index(*args)
+
+        with patch.object(self.test_case, "create_index",
+                          side_effect=tracking_create_index):
+            self.test_case._pre_setup()
+        self.assertEqual(len(threads), 3)
+
+    def test_aliases_of_all_indexes_are_created_at_once(self):
+        self.test_case._pre_setup()
+        self.assertEqual(self.urls("post").count("/_aliases"), 1)
+        payload = [json.loads(call[1]["data"])
+                   for call in self.request.call_args_list
+                   if call[0][1].endswith("_aliases")][0]
+        added = sorted((action["add"]["index"], action["add"]["alias"])
+                       for action in payload["actions"])
+        expected = [("beatles", "band"), ("thepolice", "band"),
+                    ("thepolice", "single-man-band")]
+        self.assertEqual(added, expected)
+
+    def test_fixtures_of_all_indexes_are_waited_for_at_once(self):
+        self.test_case._pre_setup()
+        refreshes = [url for url in self.urls("post")
+                     if url.endswith("_refresh")]
+        self.assertEqual(len(refreshes), 1)
+        indexes = refreshes[0].split("/")[0].split(",")
+        self.assertEqual(sorted(indexes), ["beatles", "ramones", "thepolice"])
+
+    def test_indexes_can_be_set_up_serially(self):
+        self.test_case.setup_workers = 1
+        self.test_case._pre_setup()
+        self.assertEqual(len(self.urls("put")), 3)
+
+
+class ClusterHealthTestCase(unittest.TestCase):
+
+    class StartingTestCase(ElasticSearchQueryTestCase):
+        host = "http://starting.node:9200/"
+        cluster_timeout = 1
+
+        def test_nothing(self):
+            pass
+
+    def setUp(self):
+        self.test_case = self.StartingTestCase("test_nothing")
+        estester._cluster_health.pop(self.test_case.host, None)
+        self.addCleanup(estester._cluster_health.pop, self.test_case.host,
+                        None)
+        patcher = patch("requests.Session.request")
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def health(self, status):
+        return Mock(status_code=200, text=json.dumps({"status": status}))
+
+    def test_cluster_is_polled_until_ready_once_per_process(self):
+        self.request.side_effect = [
+            requests.ConnectionError("Connection refused"),
+            self.health("red"),
+            self.health("yellow")
+        ]
+        self.test_case.wait_for_cluster()
+        self.assertEqual(self.request.call_count, 3)
+        self.assertEqual(self.request.call_args[0],
+                         ("GET", "http://starting.node:9200/_cluster/health"))
+        self.assertEqual([call[0][0] for call in self.sleep.call_args_list],
+                         [0.1, 0.2])
+        self.StartingTestCase("test_nothing").wait_for_cluster()
+        self.assertEqual(self.request.call_count, 3)
+
+    def test_green_is_waited_for_if_required(self):
+        self.test_case.wait_for_status = "green"
+        self.request.side_effect = [self.health("yellow"),
+                                    self.health("green")]
+        self.test_case.wait_for_cluster()
+        self.assertEqual(self.request.call_count, 2)
+
+    def test_failure_is_cached(self):
+        self.test_case.cluster_timeout = 0
+        self.request.return_value = Mock(status_code=503, text="Starting")
+        with self.assertRaises(ElasticSearchException) as cm:
+            self.test_case.wait_for_cluster()
+        self.assertIn("was not yellow after 0s: Starting",
+                      str(cm.exception))
+        with self.assertRaises(ElasticSearchException):
+            self.StartingTestCase("test_nothing").wait_for_cluster()
+        self.assertEqual(self.request.call_count, 1)
+
+    def test_check_is_skipped_without_http_backend(self):
+        self.test_case.backend = "memory"
+        self.test_case.wait_for_cluster()
+        self.test_case.backend = "http"
+        self.test_case.wait_for_status = None
+        self.test_case.wait_for_cluster()
+        self.assertEqual(self.request.call_count, 0)
+
+
+class CreateIndexStatusTestCase(unittest.TestCase):
+
+    class CreatingTestCase(ElasticSearchQueryTestCase):
+
+        def test_nothing(self):
+            pass
+
+    def setUp(self):
+        self.test_case = self.CreatingTestCase("test_nothing")
+        patcher = patch.object(self.CreatingTestCase, "_request")
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failure_raises_exception(self):
+        self.request.return_value = Mock(
+            status_code=503, text='{"error": "MasterNotDiscoveredException"}')
+        with self.assertRaises(ElasticSearchException) as cm:
+            self.test_case.create_index()
+        self.assertIn("MasterNotDiscoveredException", str(cm.exception))
+
+    def test_existing_index_is_kept(self):
+        for text in ['{"error":"IndexAlreadyExistsException[[sample.test] '
+                     'already exists]","status":400}',
+                     '{"error":{"type":"resource_already_exists_exception"}'
+                     ',"status":400}']:
+            self.request.return_value = Mock(status_code=400, text=text)
+            self.test_case.create_index()
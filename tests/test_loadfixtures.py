@@ -1,5 +1,13 @@
-from mock import patch
-from estester import ElasticSearchQueryTestCase, MultipleIndexesQueryTestCase
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing.pool import ThreadPool
+from mock import patch, Mock
+from estester import ElasticSearchQueryTestCase, MultipleIndexesQueryTestCase,\
+    ElasticSearchException
 
 
 class MultipleIndexesFixtureLoadingTestCase(MultipleIndexesQueryTestCase):
@@ -110,3 +118,271 @@ class SingleIndexFixtureLoadingTestCase(ElasticSearchQueryTestCase):
             sleep.assert_called_once_with(5)
         finally:
             self.timeout = old_timeout
+
+
+class FixturesMethodTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+
+    def fixtures(self):
+        for i in range(3):
+            yield {"type": "dog", "id": str(i), "body": {"name": "Dog"}}
+
+    def test_fixtures_are_loaded(self):
+        self.assertEqual(self.search()["hits"]["total"], 3)
+
+    def test_fixtures_are_loaded_again(self):
+        self.assertEqual(self.search()["hits"]["total"], 3)
+
+
+class BulkFixtureLoadingTestCase(unittest.TestCase):
+
+    fixtures = [
+        {
+            "type": "dog",
+            "id": str(i),
+            "body": {"name": "Dog {0}".format(i)}
+        }
+        for i in range(5)
+    ]
+
+    def setUp(self):
+        self.test_case = ElasticSearchQueryTestCase("run")
+
+    def bulk_response(self, errors=()):
+        items = []
+        for doc_type, doc_id in errors:
+            items.append({
+                "index": {
+                    "_type": doc_type,
+                    "_id": doc_id,
+                    "error": "MapperParsingException[failed]"
+                }
+            })
+        return {"text": json.dumps({"items": items}), "status_code": 200}
+
+    @patch('requests.Session.request')
+    def test_bulk_index_sends_documents_as_ndjson(self, post):
+        post.return_value.configure_mock(**self.bulk_response())
+        self.test_case.bulk_index("sample.test", self.fixtures[:1])
+        method, url = post.call_args[0]
+        self.assertEqual(method, "POST")
+        self.assertEqual(url, "{0}_bulk".format(self.test_case.host))
+        lines = post.call_args[1]["data"].split("\n")
+        self.assertEqual(json.loads(lines[0]), {
+            "index": {"_index": "sample.test", "_type": "dog", "_id": "0"}
+        })
+        self.assertEqual(json.loads(lines[1]), {"name": "Dog 0"})
+        self.assertEqual(lines[2], "")
+
+    @patch('requests.Session.request')
+    def test_bulk_index_splits_by_number_of_documents(self, post):
+        post.return_value.configure_mock(**self.bulk_response())
+        self.test_case.bulk_size = 2
+        self.test_case.bulk_index("sample.test", self.fixtures)
+        self.assertEqual(post.call_count, 3)
+
+    @patch('requests.Session.request')
+    def test_bulk_index_splits_by_size_in_bytes(self, post):
+        post.return_value.configure_mock(**self.bulk_response())
+        self.test_case.bulk_max_bytes = 1
+        self.test_case.bulk_index("sample.test", self.fixtures)
+        self.assertEqual(post.call_count, len(self.fixtures))
+
+    @patch('requests.Session.request')
+    def test_bulk_index_reports_every_failed_document(self, post):
+        errors = [("dog", "1"), ("dog", "3")]
+        post.return_value.configure_mock(**self.bulk_response(errors))
+        self.test_case.bulk_size = 2
+        with self.assertRaises(ElasticSearchException) as cm:
+            self.test_case.bulk_index("sample.test", self.fixtures)
+        self.assertIn("dog/1", cm.exception.message)
+        self.assertIn("dog/3", cm.exception.message)
+        self.assertEqual(post.call_count, 3)
+
+    @patch('requests.Session.request')
+    def test_bulk_index_sends_no_refresh(self, post):
+        # refresh=wait_for would block every chunk until the next refresh
+        post.return_value.configure_mock(**self.bulk_response())
+        self.test_case.bulk_size = 2
+        self.test_case.bulk_index("sample.test", self.fixtures)
+        self.assertEqual(post.call_count, 3)
+        for call in post.call_args_list:
+            self.assertNotIn("params", call[1])
+
+    @patch('requests.Session.request')
+    def test_wait_for_readiness_refreshes_once_after_loading(self, post):
+        post.return_value.configure_mock(**self.bulk_response())
+        self.test_case.bulk_size = 2
+        self.test_case.readiness = "wait_for"
+        with patch.object(self.test_case, 'refresh_index') as refresh_index:
+            self.test_case.load_fixtures("sample.test", self.fixtures,
+                                         wait=False)
+        self.assertEqual(post.call_count, 3)
+        refresh_index.assert_called_once_with("sample.test")
+
+    @patch('requests.Session.request')
+    def test_bulk_index_returns_number_of_created_documents(self, post):
+        items = [
+            {"index": {"_type": "dog", "_id": "1", "status": 201}},
+            {"index": {"_type": "dog", "_id": "1", "status": 200}}
+        ]
+        attrs = {"text": json.dumps({"items": items}), "status_code": 200}
+        post.return_value.configure_mock(**attrs)
+        created = self.test_case.bulk_index("sample.test", self.fixtures[:2])
+        self.assertEqual(created, 1)
+
+    @patch('requests.Session.request')
+    def test_bulk_payloads_are_built_once_per_fixtures_list(self, post):
+        post.return_value.configure_mock(**self.bulk_response())
+        fixtures = list(self.fixtures)
+        with patch('json.dumps', side_effect=json.dumps) as dumps:
+            self.test_case.bulk_index("sample.test", fixtures)
+            self.test_case.bulk_index("sample.test", fixtures)
+            # one action and one body per document
+            self.assertEqual(dumps.call_count, 2 * 5)
+            fixtures.append(self.fixtures[0])
+            self.test_case.bulk_index("sample.test", fixtures)
+            self.assertEqual(dumps.call_count, 2 * 5 + 2 * 6)
+        self.assertEqual(post.call_count, 3)
+
+    def test_cached_bulk_payloads_are_dropped_with_the_class(self):
+        test_case_class = type("DogsTestCase", (ElasticSearchQueryTestCase,),
+                               {"fixtures": self.fixtures})
+        test_case = test_case_class("run")
+        list(test_case._bulk_payloads("sample.test", test_case.fixtures))
+        self.assertIn("_payload_cache", test_case_class.__dict__)
+        test_case_class.tearDownClass()
+        self.assertNotIn("_payload_cache", test_case_class.__dict__)
+
+    def test_bulk_payloads_are_cached_by_parallel_threads(self):
+        test_case_class = type("DogsTestCase", (ElasticSearchQueryTestCase,),
+                               {"fixtures": self.fixtures})
+        self.addCleanup(test_case_class.tearDownClass)
+        test_case = test_case_class("run")
+        indexes = ["index{0}".format(i) for i in range(20)]
+        pool = ThreadPool(8)
+        self.addCleanup(pool.close)
+        pool.map(lambda index: list(test_case._bulk_payloads(
+            index, test_case.fixtures)), indexes)
+        self.assertEqual(len(test_case_class._payload_cache), len(indexes))
+
+    @patch('requests.Session.request')
+    def test_bulk_index_streams_fixtures_from_iterators(self, post):
+        post.return_value.configure_mock(**self.bulk_response())
+        self.test_case.bulk_size = 2
+        self.test_case.bulk_index("sample.test", iter(self.fixtures))
+        self.assertEqual(post.call_count, 3)
+
+    @patch('requests.Session.request')
+    def test_iterators_cannot_be_loaded_twice(self, post):
+        post.return_value.configure_mock(**self.bulk_response())
+        fixtures = iter(self.fixtures)
+        self.test_case.bulk_index("sample.test", fixtures)
+        with self.assertRaises(ElasticSearchException) as cm:
+            self.test_case.bulk_index("sample.test", fixtures)
+        self.assertIn("already loaded", cm.exception.message)
+        self.assertEqual(post.call_count, 1)
+
+    @patch('requests.Session.request')
+    def test_functions_return_new_fixtures_at_each_load(self, post):
+        post.return_value.configure_mock(**self.bulk_response())
+        self.test_case.bulk_size = 2
+        fixtures = lambda: iter(self.fixtures)
+        self.test_case.bulk_index("sample.test", fixtures)
+        self.test_case.bulk_index("sample.test", fixtures)
+        self.assertEqual(post.call_count, 6)
+
+    def write_ndjson(self, name, opener=open):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, name)
+        with opener(path, "wb") as ndjson:
+            for doc in self.fixtures:
+                action = {"index": {"_index": "other", "_type": doc["type"],
+                                    "_id": doc["id"]}}
+                ndjson.write(json.dumps(action) + "\n")
+                ndjson.write('{"name":  "%s"}\n' % doc["body"]["name"])
+        return path
+
+    @patch('requests.Session.request')
+    def test_bulk_index_sends_source_lines_of_ndjson_files_as_they_are(self,
+                                                                       post):
+        post.return_value.configure_mock(**self.bulk_response())
+        self.test_case.bulk_size = 2
+        path = self.write_ndjson("dogs.ndjson")
+        self.test_case.bulk_index("sample.test", path)
+        self.assertEqual(post.call_count, 3)
+        lines = post.call_args_list[0][1]["data"].split("\n")
+        self.assertEqual(json.loads(lines[0]), {
+            "index": {"_index": "sample.test", "_type": "dog", "_id": "0"}
+        })
+        self.assertEqual(lines[1], '{"name":  "Dog 0"}')
+
+    @patch('requests.Session.request')
+    def test_bulk_index_reads_gzip_ndjson_files(self, post):
+        post.return_value.configure_mock(**self.bulk_response())
+        path = self.write_ndjson("dogs.ndjson.gz", gzip.open)
+        self.test_case.bulk_index("sample.test", path)
+        payload = post.call_args[1]["data"]
+        self.assertEqual(len(payload.splitlines()), 2 * len(self.fixtures))
+
+
+class ReadinessTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_case = ElasticSearchQueryTestCase("run")
+
+    def count_response(self, count):
+        response = Mock()
+        response.configure_mock(text=json.dumps({"count": count}),
+                                status_code=200)
+        return response
+
+    @patch('time.sleep')
+    @patch('requests.Session.request')
+    def test_count_readiness_polls_until_all_documents_are_found(self, get,
+                                                                 sleep):
+        get.side_effect = [self.count_response(1), self.count_response(3)]
+        self.test_case.readiness = "count"
+        self.test_case.wait_for_fixtures("sample.test", 3)
+        self.assertEqual(get.call_count, 2)
+        get.assert_called_with(
+            "GET",
+            "{0}sample.test/_count".format(self.test_case.host),
+            timeout=None)
+
+    @patch('time.sleep')
+    @patch('time.time')
+    @patch('requests.Session.request')
+    def test_count_readiness_fails_after_timeout(self, get, time, sleep):
+        get.return_value = self.count_response(1)
+        time.side_effect = [0, 1, 2, 6]
+        self.test_case.readiness = "count"
+        with self.assertRaises(ElasticSearchException) as cm:
+            self.test_case.wait_for_fixtures("sample.test", 3)
+        expected = "Index sample.test was not ready after 5s: " \
+            "1 of 3 documents are searchable"
+        self.assertEqual(cm.exception.message, expected)
+
+    @patch('time.sleep')
+    def test_refresh_readiness_does_not_sleep(self, sleep):
+        self.test_case.readiness = "refresh"
+        with patch.object(self.test_case, 'refresh_index') as refresh_index:
+            self.test_case.wait_for_fixtures("sample.test", 3)
+        refresh_index.assert_called_once_with("sample.test")
+        self.assertFalse(sleep.called)
+
+    @patch('time.sleep')
+    def test_wait_for_readiness_does_not_wait_after_loading(self, sleep):
+        self.test_case.readiness = "wait_for"
+        with patch.object(self.test_case, 'refresh_index') as refresh_index:
+            self.test_case.wait_for_fixtures("sample.test", 3)
+        self.assertFalse(refresh_index.called)
+        self.assertFalse(sleep.called)
+
+    def test_unknown_readiness_fails(self):
+        self.test_case.readiness = "eventually"
+        with self.assertRaises(ElasticSearchException):
+            self.test_case.wait_for_fixtures("sample.test", 3)
@@ -0,0 +1,204 @@
+import json
+import unittest
+
+from estester import ElasticSearchException, ElasticSearchQueryTestCase, \
+    MultipleIndexesQueryTestCase
+from estester.memory import MemoryElasticSearch, analyze
+
+
+class MemoryQueryTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    mappings = {
+        "dog": {
+            "properties": {
+                "name": {"type": "string"},
+                "breed": {"type": "string", "index": "not_analyzed"},
+                "age": {"type": "integer"}
+            }
+        }
+    }
+    fixtures = [
+        {
+            "type": "dog",
+            "id": "1",
+            "body": {"name": "Nina Fox", "breed": "Golden Retriever", "age": 3}
+        },
+        {
+            "type": "dog",
+            "id": "2",
+            "body": {"name": "Charles M.", "breed": "Beagle", "age": 8}
+        },
+        {
+            "type": "dog",
+            "id": "3",
+            "body": {"name": "Fox Mulder", "breed": "Beagle", "age": 5}
+        }
+    ]
+
+    def ids(self, query):
+        response = self.search({"query": query})
+        return sorted(hit["_id"] for hit in response["hits"]["hits"])
+
+    def test_match_analyzes_text(self):
+        self.assertEqual(self.ids({"match": {"name": "FOX"}}), ["1", "3"])
+
+    def test_match_with_and_operator(self):
+        query = {"match": {"name": {"query": "nina fox", "operator": "and"}}}
+        self.assertEqual(self.ids(query), ["1"])
+
+    def test_term_on_not_analyzed_field(self):
+        self.assertEqual(self.ids({"term": {"breed": "Golden Retriever"}}),
+                         ["1"])
+        self.assertEqual(self.ids({"term": {"breed": "golden"}}), [])
+
+    def test_bool_with_filter_and_must_not(self):
+        query = {
+            "bool": {
+                "filter": [{"term": {"breed": "Beagle"}}],
+                "must_not": [{"range": {"age": {"gt": 6}}}]
+            }
+        }
+        self.assertEqual(self.ids(query), ["3"])
+
+    def test_bool_minimum_should_match(self):
+        should = [
+            {"match": {"name": "fox"}},
+            {"term": {"breed": "Beagle"}},
+            {"range": {"age": {"lt": 6}}}
+        ]
+
+        def ids(minimum):
+            return self.ids({"bool": {"should": should,
+                                      "minimum_should_match": minimum}})
+        self.assertEqual(ids(3), ["3"])
+        self.assertEqual(ids("2"), ["1", "3"])
+        self.assertEqual(ids(-1), ["1", "3"])
+        self.assertEqual(ids("50%"), ["1", "2", "3"])
+        self.assertEqual(ids("70%"), ["1", "3"])
+        self.assertEqual(ids("100%"), ["3"])
+        # the missing clauses are rounded down
+        self.assertEqual(ids("-25%"), ["3"])
+        self.assertEqual(ids("-50%"), ["1", "3"])
+
+    def test_unsupported_minimum_should_match_returns_error(self):
+        response = self.search({"query": {"bool": {
+            "should": [{"match": {"name": "fox"}}],
+            "minimum_should_match": "2<75%"
+        }}})
+        self.assertEqual(response["status"], 400)
+        self.assertIn("2<75%", json.dumps(response))
+
+    def test_best_match_comes_first(self):
+        response = self.search({"query": {"match": {"name": "nina fox"}}})
+        self.assertEqual(response["hits"]["hits"][0]["_id"], "1")
+
+    def test_sort_from_and_size(self):
+        response = self.search({"sort": [{"age": "desc"}], "from": 1,
+                                "size": 1})
+        self.assertEqual(response["hits"]["total"], 3)
+        self.assertEqual([hit["_id"] for hit in response["hits"]["hits"]],
+                         ["3"])
+
+    def test_get(self):
+        response = self.get("dog", "2")
+        self.assertEqual(response["_source"]["name"], "Charles M.")
+        self.assertEqual(response["_version"], 1)
+        self.assertRaises(ElasticSearchException, self.get, "dog", "20")
+
+    def test_unsupported_query_returns_error(self):
+        response = self.search({"query": {"fuzzy": {"name": "nima"}}})
+        self.assertEqual(response["status"], 400)
+        response = self.search({"aggs": {"ages": {"terms": {"field": "age"}}}})
+        self.assertEqual(response["status"], 400)
+
+
+class MemoryMultipleIndexesQueryTestCase(MultipleIndexesQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    data = {
+        "beatles": {
+            "aliases": ["band"],
+            "fixtures": [
+                {"type": "member", "id": "lenon", "body": {"name": "John"}}
+            ]
+        },
+        "thepolice": {
+            "aliases": ["band", "sting"],
+            "fixtures": [
+                {"type": "member", "id": "sting", "body": {"name": "Sting"}}
+            ]
+        }
+    }
+
+    def test_search_alias(self):
+        response = self.search_in_index("band", {"query": {"match_all": {}}})
+        self.assertEqual(response["hits"]["total"], 2)
+        response = self.search_in_index("sting")
+        self.assertEqual(response["hits"]["hits"][0]["_index"], "thepolice")
+
+    def test_get_aliases(self):
+        self.assertEqual(sorted(self.get_aliases("thepolice")),
+                         ["band", "sting"])
+
+
+class MemoryElasticSearchTestCase(unittest.TestCase):
+
+    host = "http://0.0.0.0:9200/"
+
+    def setUp(self):
+        self.cluster = MemoryElasticSearch()
+        for index in ["personal", "professional", "personal.golden"]:
+            self.request("put", index)
+            self.request("put", index + "/contact/1", {"name": index})
+
+    def request(self, method, path, body=None):
+        data = None if body is None else json.dumps(body)
+        response = self.cluster.request(method, self.host + path, data=data)
+        return response.status_code, json.loads(response.text or "null")
+
+    def test_wildcards_and_exclusions(self):
+        status, response = self.request("post", "*,-*.golden/_search")
+        indexes = sorted(hit["_index"] for hit in response["hits"]["hits"])
+        self.assertEqual(indexes, ["personal", "professional"])
+
+    def test_missing_index_error_has_elasticsearch_format(self):
+        response = self.cluster.request("post", self.host + "ohnoes/_refresh")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.text, '{"error":"IndexMissingException'
+                                        '[[ohnoes] missing]","status":404}')
+
+    def test_write_block(self):
+        self.request("put", "personal/_settings", {"index.blocks.write": True})
+        status, response = self.request("put", "personal/contact/2", {})
+        self.assertEqual(status, 403)
+
+    def test_clone(self):
+        status, response = self.request("post", "personal/_clone/copy")
+        self.assertEqual(status, 200)
+        status, response = self.request("get", "copy/contact/1")
+        self.assertEqual(response["_source"], {"name": "personal"})
+
+
+class AnalyzeTestCase(unittest.TestCase):
+
+    def tokens(self, text, analyzer):
+        return [token["token"] for token in analyze(text, analyzer)]
+
+    def test_standard(self):
+        self.assertEqual(self.tokens("Don't PANIC, 42!", "standard"),
+                         ["don't", "panic", "42"])
+
+    def test_whitespace(self):
+        self.assertEqual(self.tokens("Don't PANIC, 42!", "whitespace"),
+                         ["Don't", "PANIC,", "42!"])
+
+    def test_keyword(self):
+        self.assertEqual(self.tokens("Don't PANIC", "keyword"),
+                         ["Don't PANIC"])
+
+    def test_offsets(self):
+        token = analyze("so long", "standard")[1]
+        self.assertEqual((token["start_offset"], token["end_offset"]), (3, 7))
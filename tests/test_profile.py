@@ -0,0 +1,182 @@
+import unittest
+
+from mock import patch
+
+from estester import ElasticSearchException, ElasticSearchQueryTestCase
+from estester.profile import Profile
+
+
+def shard(query, collector, rewrite_time=0):
+    return {
+        "id": "[node][sample.test][0]",
+        "searches": [{
+            "query": [query],
+            "rewrite_time": rewrite_time,
+            "collector": [collector]
+        }]
+    }
+
+
+def node(node_type, description, nanos, children=None):
+    return {
+        "type": node_type,
+        "description": description,
+        "time_in_nanos": nanos,
+        "breakdown": {},
+        "children": children or []
+    }
+
+
+def collector(name, nanos, children=None):
+    return {
+        "name": name,
+        "reason": "search_top_hits",
+        "time_in_nanos": nanos,
+        "children": children or []
+    }
+
+
+PROFILE_RESPONSE = {
+    "took": 3,
+    "hits": {"total": 0, "hits": []},
+    "profile": {
+        "shards": [
+            shard(node("BooleanQuery", "+name:nina* +kind:dog", 4000000, [
+                node("BooleanQuery", "name:nina name:ninas", 3000000, [
+                    node("TermQuery", "name:nina", 1000000),
+                    node("TermQuery", "name:ninas", 1500000)
+                ]),
+                node("TermQuery", "kind:dog", 500000)
+            ]), collector("SimpleTopScoreDocCollector", 800000), 200000),
+            shard(node("BooleanQuery", "+name:nina* +kind:dog", 2000000, [
+                node("BooleanQuery", "name:ninab", 1000000, [
+                    node("TermQuery", "name:ninab", 900000)
+                ]),
+                node("TermQuery", "kind:dog", 500000)
+            ]), collector("SimpleTopScoreDocCollector", 200000), 300000)
+        ]
+    }
+}
+
+SIMPLE_QUERY = {"query": {"prefix": {"name": "nina"}}}
+
+
+class ProfileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = Profile(PROFILE_RESPONSE)
+
+    def test_shards_are_merged(self):
+        self.assertEqual(self.profile.shards, 2)
+        self.assertEqual(len(self.profile.queries), 1)
+        root = self.profile.queries[0]
+        self.assertEqual(root.type, "BooleanQuery")
+        self.assertAlmostEqual(root.time_ms, 6.0)
+        self.assertEqual([child.description for child in root.children],
+                         ["name:nina name:ninas", "kind:dog", "name:ninab"])
+        self.assertAlmostEqual(root.children[1].time_ms, 1.0)
+        self.assertAlmostEqual(self.profile.total_ms, 6.0)
+        self.assertAlmostEqual(self.profile.rewrite_ms, 0.5)
+
+    def test_self_times_are_aggregated_by_type(self):
+        times = self.profile.query_times
+        self.assertAlmostEqual(times["TermQuery"], 4.4)
+        self.assertAlmostEqual(times["BooleanQuery"], 1.6)
+        self.assertAlmostEqual(sum(times.values()), self.profile.total_ms)
+        self.assertEqual(list(self.profile.collector_times),
+                         ["SimpleTopScoreDocCollector"])
+        self.assertAlmostEqual(
+            self.profile.collector_times["SimpleTopScoreDocCollector"], 1.0)
+
+    def test_time_share_counts_topmost_matching_queries(self):
+        self.assertAlmostEqual(self.profile.time_share("^TermQuery$"),
+                               100 * 4.4 / 6)
+        # the root matches, so its children are not counted again
+        self.assertAlmostEqual(self.profile.time_share("Boolean"), 100)
+        self.assertEqual(self.profile.time_share("Wildcard"), 0)
+
+    def test_count(self):
+        self.assertEqual(self.profile.count("^TermQuery$"), 4)
+        self.assertEqual(self.profile.count("Query"), 7)
+
+    def test_format(self):
+        text = self.profile.format()
+        self.assertIn("Query (2 shards, rewrite 0.500ms)", text)
+        self.assertIn("  BooleanQuery 6.000ms 100.0% +name:nina* +kind:dog",
+                      text)
+        self.assertIn("      TermQuery 1.000ms 16.7% name:nina", text)
+        self.assertIn("  SimpleTopScoreDocCollector 1.000ms 100.0%", text)
+
+    def test_formatted_times_of_elasticsearch_2(self):
+        profile = Profile({"profile": {"shards": [{
+            "id": "[node][sample.test][0]",
+            "searches": [{
+                "query": [{
+                    "query_type": "BooleanQuery",
+                    "lucene": "name:nina* kind:dog",
+                    "time": "1.5ms",
+                    "children": [{
+                        "query_type": "WildcardQuery",
+                        "lucene": "name:nina*",
+                        "time": "900.0micros"
+                    }]
+                }],
+                "rewrite_time": 20000,
+                "collector": [{
+                    "name": "SimpleTopScoreDocCollector",
+                    "reason": "search_top_hits",
+                    "time": "0.3ms"
+                }]
+            }]
+        }]}})
+        root = profile.queries[0]
+        self.assertEqual((root.type, root.description),
+                         ("BooleanQuery", "name:nina* kind:dog"))
+        self.assertAlmostEqual(root.children[0].time_ms, 0.9)
+        self.assertAlmostEqual(profile.time_share("Wildcard"), 60)
+        self.assertAlmostEqual(
+            profile.collector_times["SimpleTopScoreDocCollector"], 0.3)
+
+    def test_empty_profile(self):
+        profile = Profile({"profile": {"shards": []}})
+        self.assertEqual(profile.total_ms, 0)
+        self.assertEqual(profile.time_share("TermQuery"), 0)
+        self.assertEqual(profile.query_times, {})
+
+
+class ProfileSearchTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+
+    def test_search_is_profiled(self):
+        with patch.object(self, "search",
+                          return_value=PROFILE_RESPONSE) as search:
+            profile = self.profile_search(SIMPLE_QUERY)
+        search.assert_called_once_with(dict(SIMPLE_QUERY, profile=True))
+        self.assertNotIn("profile", SIMPLE_QUERY)
+        self.assertEqual(profile.shards, 2)
+        self.assertEqual(profile.response, PROFILE_RESPONSE)
+
+    def test_unprofiled_search_raises(self):
+        with self.assertRaises(ElasticSearchException) as cm:
+            self.profile_search(SIMPLE_QUERY)
+        self.assertIn("Search was not profiled", str(cm.exception))
+
+    def test_assert_clause_time_below(self):
+        profile = Profile(PROFILE_RESPONSE)
+        self.assertClauseTimeBelow(profile, "Wildcard|Script", 1)
+        self.assertClauseTimeBelow(profile, "^TermQuery$", 75)
+        with self.assertRaises(self.failureException) as cm:
+            self.assertClauseTimeBelow(profile, "^TermQuery$", 70)
+        self.assertIn("^TermQuery$ took 73.3% of the query time, above 70%",
+                      str(cm.exception))
+
+    def test_assert_term_clauses_at_most(self):
+        with patch.object(self, "search", return_value=PROFILE_RESPONSE):
+            self.assertTermClausesAtMost(SIMPLE_QUERY, 4)
+            with self.assertRaises(self.failureException) as cm:
+                self.assertTermClausesAtMost(SIMPLE_QUERY, 3)
+        self.assertIn("rewritten into 4 term queries, above 3",
+                      str(cm.exception))
+        self.assertIn("TermQuery 1.000ms", str(cm.exception))
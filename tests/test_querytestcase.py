@@ -1,11 +1,13 @@
 import unittest
 import json
+import os
 import time
 import requests
 from operator import itemgetter
-from mock import patch
+from mock import patch, Mock
 from estester import ElasticSearchQueryTestCase, ExtendedTestCase,\
-    MultipleIndexesQueryTestCase, ElasticSearchException
+    MultipleIndexesQueryTestCase, ElasticSearchException, writes_index,\
+    worker_namespace, tokens_cache, _percentile
 
 
 SIMPLE_QUERY = {
@@ -38,6 +40,48 @@ class TestExtendedTestCase(ExtendedTestCase):
         self.assertEqual(self.value, 8)
 
 
+class ClassScopeTestCase(unittest.TestCase):
+
+    class CountingTestCase(ExtendedTestCase):
+        setup_scope = "class"
+        calls = []
+
+        def _pre_setup(self):
+            self.calls.append("pre_setup")
+
+        def _post_teardown(self):
+            self.calls.append("post_teardown")
+
+        def test_a_reads(self):
+            self.calls.append("a")
+
+        @writes_index
+        def test_b_writes(self):
+            self.calls.append("b")
+
+        def test_c_reads(self):
+            self.calls.append("c")
+
+    def run_class(self, test_case_class):
+        del test_case_class.calls[:]
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_case_class)
+        result = unittest.TestResult()
+        suite.run(result)
+        self.assertTrue(result.wasSuccessful())
+        return test_case_class.calls
+
+    def test_pre_setup_runs_once_unless_a_test_writes_to_index(self):
+        expected = ["pre_setup", "a", "b", "pre_setup", "c", "post_teardown"]
+        self.assertEqual(self.run_class(self.CountingTestCase), expected)
+
+    def test_method_scope_runs_pre_setup_around_every_test(self):
+        class MethodScopeTestCase(self.CountingTestCase):
+            setup_scope = "method"
+        calls = self.run_class(MethodScopeTestCase)
+        self.assertEqual(calls.count("pre_setup"), 3)
+        self.assertEqual(calls.count("post_teardown"), 3)
+
+
 class DefaultValuesTestCase(unittest.TestCase):
 
     def test_default_values(self):
@@ -48,6 +92,61 @@ class DefaultValuesTestCase(unittest.TestCase):
         self.assertEqual(ESQTC.fixtures, [])
         self.assertEqual(ESQTC.timeout, 5)
         self.assertEqual(ESQTC.proxies, {})
+        self.assertEqual(ESQTC.pool_size, 10)
+        self.assertEqual(ESQTC.max_retries, 0)
+        self.assertEqual(ESQTC.request_timeout, None)
+        self.assertEqual(ESQTC.fast_ingest, False)
+        self.assertEqual(ESQTC.wait_for_status, "yellow")
+        self.assertEqual(ESQTC.cluster_timeout, 30)
+
+
+class SessionTestCase(unittest.TestCase):
+
+    class ProxiedTestCase(ElasticSearchQueryTestCase):
+        proxies = {"http": "http://proxy:3128"}
+        pool_size = 3
+        max_retries = 2
+        request_timeout = 7
+
+        def test_nothing(self):
+            pass
+
+    def tearDown(self):
+        self.ProxiedTestCase.tearDownClass()
+
+    def test_session_is_shared_by_tests_of_the_same_class(self):
+        first = self.ProxiedTestCase("test_nothing")
+        second = self.ProxiedTestCase("test_nothing")
+        self.assertIs(first.session, second.session)
+
+    def test_session_is_not_shared_with_other_classes(self):
+        session = self.ProxiedTestCase("test_nothing").session
+        self.assertIsNot(ElasticSearchQueryTestCase("run").session, session)
+
+    def test_session_is_configured_by_class_attributes(self):
+        session = self.ProxiedTestCase("test_nothing").session
+        self.assertEqual(session.proxies["http"], "http://proxy:3128")
+        adapter = session.get_adapter("http://0.0.0.0:9200/")
+        self.assertEqual(adapter.max_retries, 2)
+        self.assertEqual(adapter._pool_maxsize, 3)
+
+    def test_tear_down_class_closes_session(self):
+        session = self.ProxiedTestCase("test_nothing").session
+        with patch.object(session, "close") as close:
+            self.ProxiedTestCase.tearDownClass()
+        close.assert_called_once_with()
+        self.assertIsNot(self.ProxiedTestCase("test_nothing").session, session)
+
+    @patch('requests.Session.request')
+    def test_requests_use_request_timeout(self, request):
+        attrs = {"text": '{"hits": {"total": 0}}', "status_code": 200}
+        request.return_value.configure_mock(**attrs)
+        self.ProxiedTestCase("test_nothing").search()
+        request.assert_called_once_with(
+            "POST",
+            "http://0.0.0.0:9200/sample.test/_search",
+            data="{}",
+            timeout=7)
 
 
 class SimpleMultipleIndexesQueryTestCase(MultipleIndexesQueryTestCase):
@@ -244,7 +343,7 @@ class SimpleQueryTestCase(ElasticSearchQueryTestCase):
             '{"error":"IndexMissingException[[ohnoes] missing]","status":404}'
         self.assertEqual(cm.exception.message, expected)
 
-    @patch('requests.post')
+    @patch('requests.Session.request')
     def test_must_call_refresh_on_url_root(self, post):
         attrs = {
             "text": '{"_shards":{"total":20,"successful":10,"failed":0}}',
@@ -252,8 +351,9 @@ class SimpleQueryTestCase(ElasticSearchQueryTestCase):
         }
         post.return_value.configure_mock(**attrs)
         self.refresh_index()
-        post.assert_called_once_with('{0}_refresh'.format(self.host),
-                                     proxies=self.proxies)
+        post.assert_called_once_with('POST',
+                                     '{0}_refresh'.format(self.host),
+                                     timeout=None)
 
     def test_search_by_nothing_returns_three_results(self):
         response = self.search()
@@ -333,3 +433,398 @@ class SimpleQueryTestCase(ElasticSearchQueryTestCase):
         self.assertEqual(len(items_list), 3)
         tokens = [item["token"] for item in items_list]
         self.assertEqual(sorted(tokens), ['"Nothing', 'declare"', "to"])
+
+
+class ClassScopedQueryTestCase(ElasticSearchQueryTestCase):
+
+    setup_scope = "class"
+    readiness = "refresh"
+    fixtures = [
+        {
+            "type": "dog",
+            "id": "1",
+            "body": {"name": "Nina Fox"}
+        },
+        {
+            "type": "dog",
+            "id": "2",
+            "body": {"name": "Charles M."}
+        }
+    ]
+
+    def test_a_search_by_nothing_returns_every_fixture(self):
+        response = self.search()
+        self.assertEqual(response["hits"]["total"], 2)
+
+    @writes_index
+    def test_b_delete_index(self):
+        self.delete_index()
+        self.create_index()
+        self.refresh()
+        self.assertEqual(self.search()["hits"]["total"], 0)
+
+    def test_c_fixtures_are_loaded_again_after_index_is_written(self):
+        response = self.search()
+        self.assertEqual(response["hits"]["total"], 2)
+
+
+class NamespaceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.dict(os.environ, {"ESTESTER_NAMESPACE": "GW1"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch('requests.Session.request')
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.test_case = ElasticSearchQueryTestCase("run")
+        self.test_case.namespace_indexes = True
+        self.multiple = MultipleIndexesQueryTestCase("run")
+        self.multiple.namespace_indexes = True
+
+    def respond(self, body):
+        attrs = {"text": json.dumps(body), "status_code": 200}
+        self.request.return_value.configure_mock(**attrs)
+
+    def url(self):
+        return self.request.call_args[0][1]
+
+    def test_worker_namespace_precedence(self):
+        self.assertEqual(worker_namespace(), "gw1")
+        with patch.dict(os.environ, {"PYTEST_XDIST_WORKER": "gw3"}):
+            del os.environ["ESTESTER_NAMESPACE"]
+            self.assertEqual(worker_namespace(), "gw3")
+            del os.environ["PYTEST_XDIST_WORKER"]
+            self.assertEqual(worker_namespace(), "p{0}".format(os.getpid()))
+
+    def test_namespaced_prefixes_every_index(self):
+        self.assertEqual(self.test_case.namespaced("a,b"), "gw1-a,gw1-b")
+
+    def test_namespaced_does_nothing_by_default(self):
+        self.test_case.namespace_indexes = False
+        self.assertEqual(self.test_case.namespaced("a"), "a")
+
+    def test_search_uses_namespaced_index_and_strips_it_from_hits(self):
+        self.respond({"hits": {"hits": [{"_index": "gw1-sample.test"}]}})
+        response = self.test_case.search()
+        self.assertEqual(self.url(), "{0}gw1-sample.test/_search".format(
+            self.test_case.host))
+        self.assertEqual(response["hits"]["hits"][0]["_index"], "sample.test")
+
+    def test_get_strips_namespace(self):
+        self.respond({"_index": "gw1-personal", "_id": "1"})
+        response = self.multiple.get("personal", "contact", "1")
+        self.assertEqual(self.url(), "{0}gw1-personal/contact/1".format(
+            self.multiple.host))
+        self.assertEqual(response["_index"], "personal")
+
+    def test_search_all_indexes_of_the_worker_only(self):
+        self.respond({"hits": {"hits": []}})
+        self.multiple.search()
+        self.assertEqual(self.url(), "{0}/gw1-*/_search".format(
+            self.multiple.host))
+
+    def test_aliases_are_namespaced(self):
+        self.respond({})
+        self.multiple.create_aliases("beatles", ["band"])
+        payload = json.loads(self.request.call_args[1]["data"])
+        expected = {"add": {"index": "gw1-beatles", "alias": "gw1-band"}}
+        self.assertEqual(payload["actions"], [expected])
+
+    def test_get_aliases_strips_namespace(self):
+        self.respond({"gw1-beatles": {"aliases": {"gw1-band": {}}}})
+        self.assertEqual(self.multiple.get_aliases("beatles"), ["band"])
+
+    def test_fixtures_are_loaded_into_namespaced_index(self):
+        self.respond({"items": []})
+        fixtures = [{"type": "dog", "id": "1", "body": {}}]
+        self.test_case.bulk_index("sample.test", fixtures)
+        action = json.loads(self.request.call_args[1]["data"].split("\n")[0])
+        self.assertEqual(action["index"]["_index"], "gw1-sample.test")
+
+
+class SearchManyTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    fixtures = [
+        {"type": "dog", "id": "1", "body": {"name": "Nina Fox"}},
+        {"type": "dog", "id": "2", "body": {"name": "Charles M."}},
+        {"type": "dog", "id": "3", "body": {"name": "Fox Mulder"}}
+    ]
+
+    def test_responses_are_returned_in_order(self):
+        queries = [{"query": {"match": {"name": name}}}
+                   for name in ["fox", "charles", "rex"]]
+        responses = self.search_many(queries)
+        totals = [response["hits"]["total"] for response in responses]
+        self.assertEqual(totals, [2, 1, 0])
+
+    def test_failed_queries_are_returned_as_exceptions(self):
+        queries = [SIMPLE_QUERY, {"query": {"magic": {}}}, None]
+        responses = self.search_many(queries)
+        self.assertEqual(responses[0]["hits"]["total"], 1)
+        self.assertIsInstance(responses[1], ElasticSearchException)
+        self.assertEqual(responses[2]["hits"]["total"], 3)
+
+    def test_queries_are_sent_in_chunks(self):
+        self.msearch_size = 2
+        with patch.object(self.transport, "request",
+                          wraps=self.transport.request) as request:
+            responses = self.search_many([{}] * 5)
+        self.assertEqual(len(responses), 5)
+        self.assertEqual(request.call_count, 3)
+        lines = request.call_args_list[0][1]["data"].splitlines()
+        self.assertEqual(json.loads(lines[0]), {"index": "sample.test"})
+
+
+class TokenizeManyTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+
+    def setUp(self):
+        tokens_cache.clear()
+
+    def tokens(self, response):
+        return [token["token"] for token in response["tokens"]]
+
+    def test_each_text_has_its_own_tokens(self):
+        responses = self.tokenize_many(["Nina Fox", "", "so long"],
+                                       "standard")
+        self.assertEqual([self.tokens(response) for response in responses],
+                         [["nina", "fox"], [], ["so", "long"]])
+        token = responses[2]["tokens"][1]
+        self.assertEqual((token["start_offset"], token["end_offset"]), (3, 7))
+        self.assertEqual(token["position"], 1)
+
+    def test_texts_are_sent_in_chunks(self):
+        self.analyze_size = 2
+        with patch.object(self.transport, "request",
+                          wraps=self.transport.request) as request:
+            responses = self.tokenize_many(["a", "b", "c", "a"], "whitespace")
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(request.call_count, 2)
+
+    def test_cached_texts_are_not_sent_again(self):
+        self.tokenize_many(["Nina Fox"], "standard")
+        with patch.object(self.transport, "request",
+                          wraps=self.transport.request) as request:
+            responses = self.tokenize_many(["Nina Fox", "Rex"], "standard")
+            self.tokenize_many(["Nina Fox"], "whitespace")
+        self.assertEqual(request.call_count, 2)
+        data = json.loads(request.call_args_list[0][1]["data"])
+        self.assertEqual(data, {"text": ["Rex"], "analyzer": "standard"})
+        self.assertEqual(self.tokens(responses[0]), ["nina", "fox"])
+
+    def test_cache_depends_on_index_settings(self):
+        self.tokenize_many(["Nina Fox"], "standard")
+        self.settings = {
+            "analysis": {"analyzer": {"folding": {"tokenizer": "standard"}}}
+        }
+        with patch.object(self.transport, "request",
+                          wraps=self.transport.request) as request:
+            self.tokenize_many(["Nina Fox"], "standard")
+        self.assertEqual(request.call_count, 1)
+
+
+class QueryTimingTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    fixtures = [
+        {"type": "dog", "id": "1", "body": {"name": "Nina Fox"}},
+        {"type": "dog", "id": "2", "body": {"name": "Charles M."}}
+    ]
+
+    def test_search_calls_are_timed(self):
+        response = self.search(SIMPLE_QUERY)
+        self.search_many([{}, {}])
+        self.assertEqual(len(self.query_timings), 2)
+        timing = self.query_timings[0]
+        self.assertEqual(timing.url, self.host + "sample.test/_search")
+        self.assertEqual(timing.took_ms, response["took"])
+        self.assertTrue(timing.wall_ms >= 0)
+        self.assertTrue(timing.size > 0)
+        self.assertEqual(self.query_timings[1].url, self.host + "_msearch")
+
+    def test_assert_query_faster_than(self):
+        self.assertQueryFasterThan(SIMPLE_QUERY, 1000, runs=5, warmup=1)
+        self.assertEqual(len(self.query_timings), 6)
+        self.assertQueryFasterThan(SIMPLE_QUERY, 1, timing="took_ms")
+        with self.assertRaises(self.failureException) as cm:
+            self.assertQueryFasterThan(SIMPLE_QUERY, -1, runs=3)
+        self.assertIn("Percentile 95 of wall_ms", str(cm.exception))
+
+    def test_assert_query_faster_than_fails_on_errors(self):
+        with self.assertRaises(self.failureException) as cm:
+            self.assertQueryFasterThan({"query": {"magic": {}}}, 1000)
+        self.assertIn("Query failed", str(cm.exception))
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(_percentile(values, 95), 95)
+        self.assertEqual(_percentile(values, 100), 100)
+        self.assertEqual(_percentile([3, 1, 2], 50), 2)
+        self.assertEqual(_percentile([3, 1, 2], 0), 1)
+
+
+class GetManyTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    fixtures = [
+        {"type": "dog", "id": str(i), "body": {"name": "Dog {0}".format(i)}}
+        for i in range(5)
+    ]
+
+    def test_documents_are_returned_by_id(self):
+        docs = self.get_many([("dog", "1"), ("dog", "3")])
+        self.assertEqual(sorted(docs), ["1", "3"])
+        self.assertEqual(docs["3"]["_source"], {"name": "Dog 3"})
+
+    def test_missing_documents_are_none(self):
+        docs = self.get_many([("dog", "1"), ("dog", "20"), ("cat", "2")])
+        self.assertEqual(docs["1"]["_id"], "1")
+        self.assertEqual(docs["20"], None)
+        self.assertEqual(docs["2"], None)
+
+    def test_documents_are_got_in_chunks(self):
+        self.mget_size = 2
+        with patch.object(self.transport, "request",
+                          wraps=self.transport.request) as request:
+            docs = self.get_many([("dog", str(i)) for i in range(5)])
+        self.assertEqual(len(docs), 5)
+        self.assertEqual(request.call_count, 3)
+
+    def test_ids_must_be_distinct(self):
+        with self.assertRaises(ElasticSearchException):
+            self.get_many([("dog", "1"), ("cat", "1")])
+
+
+class IterHitsTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    fixtures = [
+        {"type": "dog", "id": str(i), "body": {"name": "Dog {0}".format(i)}}
+        for i in range(25)
+    ]
+
+    def test_every_hit_is_read_page_by_page(self):
+        with patch.object(self.transport, "request",
+                          wraps=self.transport.request) as request:
+            ids = [hit["_id"] for hit in self.iter_hits(page_size=10)]
+        self.assertEqual(sorted(ids), sorted(str(i) for i in range(25)))
+        urls = [call[0][1].replace(self.host, "")
+                for call in request.call_args_list]
+        # point in time is not supported by the memory backend
+        self.assertEqual(urls, ["sample.test/_pit", "sample.test/_search"] +
+                         ["_search/scroll"] * 4)
+        self.assertEqual(request.call_args[0][0], "DELETE")
+        self.assertEqual(self.transport.scrolls, {})
+
+    def test_scroll_is_cleared_when_iteration_is_abandoned(self):
+        hits = self.iter_hits({"query": {"match": {"name": "dog"}}},
+                              page_size=10)
+        next(hits)
+        self.assertEqual(len(self.transport.scrolls), 1)
+        hits.close()
+        self.assertEqual(self.transport.scrolls, {})
+
+    def test_point_in_time_is_used_when_supported(self):
+        def response(body):
+            return Mock(status_code=200, text=json.dumps(body))
+
+        def page(ids):
+            hits = [{"_id": i, "sort": [i]} for i in ids]
+            return response({"pit_id": "b", "hits": {"hits": hits}})
+
+        with patch.object(ElasticSearchQueryTestCase, "_request") as request:
+            request.side_effect = [response({"id": "a"}), page([1, 2]),
+                                   page([3]), response({})]
+            ids = [hit["_id"] for hit in self.iter_hits(page_size=2)]
+        self.assertEqual(ids, [1, 2, 3])
+        bodies = [json.loads(call[1]["data"])
+                  for call in request.call_args_list[1:]]
+        self.assertEqual(bodies[0]["pit"]["id"], "a")
+        self.assertEqual(bodies[1]["search_after"], [2])
+        self.assertEqual(bodies[1]["pit"]["id"], "b")
+        self.assertEqual(bodies[2], {"id": "b"})
+
+    def test_scroll_is_used_when_point_in_time_cannot_be_searched(self):
+        # ElasticSearch 7.10 and 7.11 open points in time, but cannot sort
+        # by _shard_doc
+        answers = [
+            Mock(status_code=200, text='{"id": "a"}'),
+            Mock(status_code=400, text='{"error": "_shard_doc"}'),
+            Mock(status_code=200, text='{"succeeded": true}')
+        ]
+        request = self.transport.request
+
+        def answer(*args, **kwargs):
+            if answers:
+                return answers.pop(0)
+            return request(*args, **kwargs)
+
+        with patch.object(self.transport, "request",
+                          side_effect=answer) as mocked:
+            ids = [hit["_id"] for hit in self.iter_hits(page_size=10)]
+        self.assertEqual(sorted(ids), sorted(str(i) for i in range(25)))
+        calls = [(call[0][0], call[0][1].replace(self.host, ""))
+                 for call in mocked.call_args_list]
+        self.assertEqual(calls[:4], [
+            ("POST", "sample.test/_pit"),
+            ("POST", "_search"),
+            ("DELETE", "_pit"),
+            ("POST", "sample.test/_search")
+        ])
+        self.assertEqual(self.transport.scrolls, {})
+
+
+class MultipleIndexesBatchQueryTestCase(MultipleIndexesQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    data = {
+        "personal": {
+            "fixtures": [
+                {"type": "contact", "id": "1", "body": {"name": "Dmitriy"}}
+            ]
+        },
+        "professional": {
+            "fixtures": [
+                {"type": "contact", "id": "1", "body": {"name": "Nikolay"}},
+                {"type": "contact", "id": "2", "body": {"name": "Dmitriy"}}
+            ]
+        }
+    }
+
+    def test_queries_can_override_index(self):
+        query = {"query": {"match": {"name": "dmitriy"}}}
+        responses = self.search_many([query, ("professional", query),
+                                      ("personal", {})])
+        totals = [response["hits"]["total"] for response in responses]
+        self.assertEqual(totals, [2, 1, 1])
+
+    def test_get_many_from_several_indexes(self):
+        docs = self.get_many([("personal", "contact", "1"),
+                              ("professional", "contact", "2"),
+                              ("missing", "contact", "3")])
+        self.assertEqual(docs[("personal", "1")]["_index"], "personal")
+        self.assertEqual(docs[("professional", "2")]["_source"],
+                         {"name": "Dmitriy"})
+        self.assertIsInstance(docs[("missing", "3")], ElasticSearchException)
+
+    def test_get_many_of_same_id_in_several_indexes(self):
+        docs = self.get_many([("personal", "contact", "1"),
+                              ("professional", "contact", "1")])
+        self.assertEqual(docs[("personal", "1")]["_source"],
+                         {"name": "Dmitriy"})
+        self.assertEqual(docs[("professional", "1")]["_source"],
+                         {"name": "Nikolay"})
+
+    def test_iter_hits_of_all_indexes_or_one(self):
+        self.assertEqual(len(list(self.iter_hits(page_size=2))), 3)
+        hits = list(self.iter_hits(index="professional", page_size=1))
+        self.assertEqual([hit["_index"] for hit in hits], ["professional"] * 2)
@@ -0,0 +1,178 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import patch
+
+from estester import ElasticSearchQueryTestCase, MultipleIndexesQueryTestCase
+from estester.replay import Statistics, format_report, main, read_log, \
+    replay, template, _seconds
+
+
+class DogsQueryTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    fixtures = [
+        {"type": "dog", "id": "1", "body": {"name": "Nina Fox"}},
+        {"type": "dog", "id": "2", "body": {"name": "Charles M."}}
+    ]
+
+
+class BandsQueryTestCase(MultipleIndexesQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    data = {
+        "beatles": {
+            "fixtures": [{"type": "member", "id": "lenon",
+                          "body": {"name": "John"}}]
+        },
+        "thepolice": {
+            "fixtures": [{"type": "member", "id": "sting",
+                          "body": {"name": "Sting"}}]
+        }
+    }
+
+
+def match(name):
+    return {"query": {"match": {"name": name}}, "size": 10}
+
+
+class ReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_log(self, entries, name="queries.ndjson.gz"):
+        path = os.path.join(self.directory, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wb") as log:
+            for entry in entries:
+                log.write((json.dumps(entry) + "\n").encode("utf-8"))
+        return path
+
+    def test_searches_are_aggregated_by_template(self):
+        path = self.write_log(
+            [{"index": "dogs", "body": match(name)}
+             for name in ["nina", "fox", "charles", "rex"]] +
+            [{"index": "dogs", "body": {"query": {"magic": {}}}}])
+        results = replay(DogsQueryTestCase, path, window=2)
+        self.assertEqual(results["searches"], 5)
+        self.assertEqual(results["test_case"], "test_replay.DogsQueryTestCase")
+        templates = sorted(results["templates"].values(),
+                           key=lambda item: item["count"])
+        self.assertEqual([item["count"] for item in templates], [1, 4])
+        self.assertEqual(templates[0]["error_rate"], 1.0)
+        self.assertEqual(templates[1]["errors"], 0)
+        self.assertEqual(templates[1]["took_ms"]["p95"], 0)
+        self.assertEqual(templates[1]["template"], template(match("x")))
+        self.assertIn('{"query": {"match"', format_report(results))
+
+    def test_logged_indexes_are_searched(self):
+        path = self.write_log([
+            {"index": "beatles", "body": match("john")},
+            {"index": "police", "body": match("sting")},
+            {"body": match("sting")}
+        ])
+        with patch.object(BandsQueryTestCase, "search_in_index",
+                          wraps=BandsQueryTestCase.search_in_index,
+                          autospec=True) as search_in_index:
+            results = replay(BandsQueryTestCase, path, window=1,
+                             indexes={"police": "thepolice"})
+        indexes = [call[0][1] for call in search_in_index.call_args_list]
+        self.assertEqual(indexes, ["beatles", "thepolice"])
+        item = list(results["templates"].values())[0]
+        self.assertEqual((item["count"], item["errors"]), (3, 0))
+
+    def test_query_timings_are_not_recorded(self):
+        test_cases = []
+
+        class RecordedDogsQueryTestCase(DogsQueryTestCase):
+            def __init__(self, *args):
+                super(RecordedDogsQueryTestCase, self).__init__(*args)
+                test_cases.append(self)
+
+        path = self.write_log([{"body": match("nina")}] * 5000)
+        results = replay(RecordedDogsQueryTestCase, path, window=4)
+        self.assertEqual(results["searches"], 5000)
+        self.assertEqual(test_cases[0].query_timings, [])
+
+    def test_timestamps_are_followed(self):
+        path = self.write_log([
+            {"body": match("nina"), "timestamp": "2020-01-01T10:00:00Z"},
+            {"body": match("fox"), "timestamp": "2020-01-01T10:00:00.300Z"}
+        ])
+        started = time.time()
+        replay(DogsQueryTestCase, path, speed=3)
+        self.assertTrue(time.time() - started >= 0.1)
+
+    def test_read_log(self):
+        path = self.write_log([
+            {"index": "dogs", "body": {}, "timestamp": 1.5},
+            {"index": "dogs", "timestamp": "1970-01-01 00:00:02,5"}
+        ], name="queries.ndjson")
+        self.assertEqual(list(read_log(path)), [("dogs", {}, 1.5),
+                                                ("dogs", {}, 2.5)])
+
+    def test_timestamp_offsets(self):
+        self.assertEqual(_seconds("1970-01-01T02:00:00+02:00"), 0)
+        self.assertEqual(_seconds("1970-01-01T00:00:00-0130"), 5400)
+        self.assertEqual(_seconds("1970-01-01 00:00:01.5+00:00"), 1.5)
+        with self.assertRaises(ValueError) as cm:
+            _seconds("1970-01-01T00:00:00 CET")
+        self.assertIn("Unsupported timestamp", str(cm.exception))
+
+    @patch("sys.stdout")
+    def test_command_line(self, stdout):
+        path = self.write_log([{"body": match("nina")}])
+        output = os.path.join(self.directory, "report.json")
+        status = main(["test_replay.DogsQueryTestCase", path, "--window",
+                       "2", "--output", output])
+        self.assertEqual(status, 0)
+        with open(output) as report:
+            self.assertEqual(json.load(report)["searches"], 1)
+
+
+class StatisticsTestCase(unittest.TestCase):
+
+    def test_sample_is_bounded(self):
+        statistics = Statistics(size=100)
+        for value in range(10000):
+            statistics.add(value)
+        self.assertEqual(len(statistics.sample), 100)
+        summary = statistics.summary()
+        self.assertEqual(statistics.count, 10000)
+        self.assertEqual(summary["max"], 9999)
+        self.assertEqual(summary["mean"], 4999.5)
+        self.assertTrue(3500 < summary["p50"] < 6500)
+
+    def test_percentiles_are_exact_below_the_sample_size(self):
+        statistics = Statistics()
+        for value in range(1, 101):
+            statistics.add(value)
+        self.assertEqual(statistics.summary()["p95"], 95)
+        self.assertEqual(Statistics().summary(), None)
+
+
+class TemplateTestCase(unittest.TestCase):
+
+    def test_values_are_replaced(self):
+        body = {
+            "query": {"terms": {"tag": ["a", "b", "c"]}},
+            "sort": [{"date": "desc"}],
+            "size": 10
+        }
+        self.assertEqual(json.loads(template(body)), {
+            "query": {"terms": {"tag": ["?"]}},
+            "sort": [{"date": "?"}],
+            "size": "?"
+        })
+        self.assertEqual(template({"query": {"terms": {"tag": ["x"]}},
+                                   "sort": [{"date": "asc"}], "size": 1}),
+                         template(body))
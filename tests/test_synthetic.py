@@ -0,0 +1,97 @@
+import unittest
+from collections import Counter
+
+from estester import ElasticSearchQueryTestCase
+from estester.synthetic import Choice, Dates, GeoPoints, Numbers, \
+    SyntheticFixtures, Terms, Text, word
+
+
+FIELDS = {
+    "brand": Terms(size=50),
+    "title": Text(length=(2, 4)),
+    "price": Numbers(1, 10),
+    "weight": Numbers(0.5, 2.0, decimals=1),
+    "created": Dates("2015-01-01", "2015-01-02"),
+    "store": GeoPoints(lat=(-30, -20), lon=(-50, -40)),
+    "seller": {"active": Choice([True, False]), "country": "BR"}
+}
+
+
+class SyntheticFixturesTestCase(unittest.TestCase):
+
+    def test_documents_depend_only_on_seed(self):
+        fixtures = SyntheticFixtures(20, FIELDS, seed=1)
+        self.assertEqual(list(fixtures), list(fixtures))
+        self.assertEqual(list(fixtures),
+                         list(SyntheticFixtures(20, FIELDS, seed=1)))
+        self.assertNotEqual(list(fixtures),
+                            list(SyntheticFixtures(20, FIELDS, seed=2)))
+
+    def test_documents(self):
+        fixtures = SyntheticFixtures(100, FIELDS, doc_type="product",
+                                     id_prefix="p")
+        docs = list(fixtures)
+        self.assertEqual(len(fixtures), 100)
+        self.assertEqual(len(docs), 100)
+        self.assertEqual((docs[0]["type"], docs[0]["id"]), ("product", "p0"))
+        for doc in docs:
+            body = doc["body"]
+            self.assertTrue(1 <= body["price"] <= 10)
+            self.assertTrue(0.5 <= body["weight"] <= 2.0)
+            self.assertTrue(body["created"].startswith("2015-01-01T"))
+            self.assertTrue(-30 <= body["store"]["lat"] <= -20)
+            self.assertTrue(-50 <= body["store"]["lon"] <= -40)
+            self.assertTrue(2 <= len(body["title"].split()) <= 4)
+            self.assertEqual(body["seller"]["country"], "BR")
+        prices = set(doc["body"]["price"] for doc in docs)
+        self.assertEqual(prices, set(range(1, 11)))
+
+    def test_terms_follow_zipf_law(self):
+        fixtures = SyntheticFixtures(2000, {"brand": Terms(size=50)})
+        counts = Counter(doc["body"]["brand"] for doc in fixtures)
+        self.assertEqual(counts.most_common(1)[0][0], word(0))
+        self.assertTrue(counts[word(0)] > 4 * counts[word(9)])
+
+    def test_words(self):
+        self.assertEqual([word(0), word(1), word(85)], ["ba", "be", "baba"])
+        self.assertEqual(len(set(word(i) for i in range(10000))), 10000)
+
+    def test_from_mappings(self):
+        mappings = {
+            "dog": {
+                "properties": {
+                    "name": {"type": "string"},
+                    "breed": {"type": "string", "index": "not_analyzed"},
+                    "age": {"type": "integer"},
+                    "born": {"type": "date"},
+                    "home": {"type": "geo_point"},
+                    "owner": {"properties": {"score": {"type": "float"}}},
+                    "ip": {"type": "ip"}
+                }
+            }
+        }
+        fixtures = SyntheticFixtures.from_mappings(
+            mappings, 1, fields={"age": 3})
+        doc = list(fixtures)[0]
+        self.assertEqual(doc["type"], "dog")
+        body = doc["body"]
+        self.assertEqual(sorted(body),
+                         ["age", "born", "breed", "home", "name", "owner"])
+        self.assertEqual(body["age"], 3)
+        self.assertEqual(len(body["breed"].split()), 1)
+        self.assertIsInstance(body["owner"]["score"], float)
+        self.assertRaises(ValueError, SyntheticFixtures.from_mappings,
+                          {"dog": {}, "cat": {}}, 1)
+
+
+class SyntheticQueryTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    bulk_size = 100
+    fixtures = SyntheticFixtures(1000, {"brand": Terms(size=20),
+                                        "price": Numbers(1, 100)})
+
+    def test_fixtures_are_loaded(self):
+        response = self.search({"query": {"range": {"price": {"lte": 100}}}})
+        self.assertEqual(response["hits"]["total"], 1000)
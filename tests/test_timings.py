@@ -0,0 +1,95 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from estester import ElasticSearchQueryTestCase
+from estester.timings import Recorder, endpoint, recorder
+
+
+class DogsQueryTestCase(ElasticSearchQueryTestCase):
+
+    backend = "memory"
+    readiness = "refresh"
+    fixtures = [
+        {"type": "dog", "id": "1", "body": {"name": "Nina Fox"}},
+        {"type": "dog", "id": "2", "body": {"name": "Charles M."}}
+    ]
+
+    def test_search(self):
+        self.search({"query": {"match": {"name": "nina"}}})
+
+    def test_get(self):
+        self.get("dog", "2")
+
+
+class RecorderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, recorder, "events", recorder.events)
+        self.addCleanup(setattr, recorder, "enabled", recorder.enabled)
+        recorder.events = []
+        recorder.enable()
+        suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+            DogsQueryTestCase)
+        suite.run(unittest.TestResult())
+        self.test_case = "test_timings.DogsQueryTestCase"
+
+    def test_phases_and_http_calls_are_recorded(self):
+        names = [event.name for event in recorder.events
+                 if event.test_method == "test_get"]
+        for name in ["pre_setup", "delete_index", "create_index",
+                     "load_fixtures", "wait_for_fixtures", "POST _bulk",
+                     "test", "GET document", "post_teardown"]:
+            self.assertIn(name, names)
+        self.assertEqual(names[-1], "post_teardown")
+
+    def test_summarize(self):
+        summary = recorder.summarize()[self.test_case]
+        self.assertEqual(summary["phases"]["test"]["count"], 2)
+        self.assertEqual(summary["phases"]["POST _search"]["count"], 1)
+        self.assertEqual(sorted(summary["methods"]), ["test_get",
+                                                      "test_search"])
+        self.assertEqual(sorted(summary["methods"]["test_get"]),
+                         ["post_teardown", "pre_setup", "test"])
+        text = recorder.summary()
+        self.assertIn(self.test_case, text)
+        self.assertIn("test_search: pre_setup", text)
+
+    def test_exports(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "timings.json")
+        recorder.save_json(path)
+        with open(path) as report:
+            report = json.load(report)
+        self.assertEqual(len(report["events"]), len(recorder.events))
+        self.assertIn(self.test_case, report["summary"])
+        path = os.path.join(directory, "trace.json")
+        recorder.save_chrome_trace(path)
+        with open(path) as trace:
+            events = json.load(trace)["traceEvents"]
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertEqual(events[0]["args"]["test_case"], self.test_case)
+
+
+class DisabledRecorderTestCase(unittest.TestCase):
+
+    def test_nothing_is_recorded(self):
+        disabled = Recorder()
+        with disabled.phase(self, "test"):
+            pass
+        self.assertEqual(disabled.events, [])
+
+
+class EndpointTestCase(unittest.TestCase):
+
+    def test_endpoint(self):
+        host = "http://localhost:9200/"
+        self.assertEqual(endpoint("post", host + "_bulk"), "POST _bulk")
+        self.assertEqual(endpoint("post", host + "dogs/_search?scroll=1m"),
+                         "POST _search")
+        self.assertEqual(endpoint("put", host + "dogs/"), "PUT index")
+        self.assertEqual(endpoint("get", host + "dogs/dog/1"),
+                         "GET document")